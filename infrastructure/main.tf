@@ -27,6 +27,33 @@ module "scanner" {
   location = var.region
   image_repository = var.image_repository
   env_vars = var.scanner_env_vars
+  parser_url = module.parser.url
+  blob_bucket = google_storage_bucket.scan_blobs.name
+}
+
+module "parser" {
+  source  = "./modules/parser"
+  project = var.project
+  location = var.region
+  image_repository = var.image_repository
+  env_vars = var.parser_env_vars
+  blob_bucket = google_storage_bucket.scan_blobs.name
+}
+
+# Raw grype reports between the scanner and the parser, mounted by both as BLOB_DIR.
+# The parser deletes blobs it has stored. The lifecycle rule removes any it never got to.
+resource "google_storage_bucket" "scan_blobs" {
+  name = "${var.project}-scan-blobs"
+  location = var.region
+  uniform_bucket_level_access = true
+  lifecycle_rule {
+    condition {
+      age = 7
+    }
+    action {
+      type = "Delete"
+    }
+  }
 }
 
 resource "google_cloud_scheduler_job" "scheduler" {
@@ -43,6 +70,23 @@ resource "google_cloud_scheduler_job" "scheduler" {
   time_zone = "UTC"
 }
 
+resource "google_cloud_scheduler_job" "rescan_scheduler" {
+  name = "rescan-scheduler"
+  schedule = "*/5 * * * *"
+  http_target {
+    uri = "${module.publisher.url}/rescan"
+    http_method = "POST"
+    oidc_token {
+      service_account_email = "${var.service_account}@${var.project}.iam.gserviceaccount.com"
+      audience = module.publisher.url
+    }
+  }
+  time_zone = "UTC"
+}
+
+# A scan throttled by a registry rate limit returns 503. Cloud Tasks ignores
+# Retry-After and counts every 503 as an attempt, so attempts are unlimited
+# and retries stop after an hour, when the next publish enqueues the image again.
 resource "google_cloud_tasks_queue" "scan_queue" {
   name = "to-scan"
   location = var.region
@@ -51,10 +95,10 @@ resource "google_cloud_tasks_queue" "scan_queue" {
     max_concurrent_dispatches = 5
   }
   retry_config {
-    max_attempts = 16
-    max_retry_duration = "300s"
+    max_attempts = -1
+    max_retry_duration = "3600s"
     min_backoff = "1s"
-    max_backoff = "60s"
+    max_backoff = "300s"
     max_doublings = 5
   }
 }
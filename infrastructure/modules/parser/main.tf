@@ -0,0 +1,64 @@
+resource "google_cloud_run_service" "parser" {
+  name = "parser"
+  location = var.location
+  template {
+    spec {
+      containers {
+        image = "${var.location}-docker.pkg.dev/${var.project}/${var.image_repository}/scanner:latest"
+        resources {
+          limits = {
+            cpu = 1
+            memory = "2Gi"
+          }
+        }
+        ports {
+          container_port = 8080
+        }
+        env {
+          name = "APP_MODULE"
+          value = "parser"
+        }
+        env {
+          name = "OTEL_SERVICE_NAME"
+          value = "parser"
+        }
+        env {
+          name = "BLOB_DIR"
+          value = "/mnt/blobs"
+        }
+        volume_mounts {
+          name = "blobs"
+          mount_path = "/mnt/blobs"
+        }
+        dynamic "env" {
+          for_each = var.env_vars
+          content {
+            name = env.key
+            value = env.value
+          }
+        }
+      }
+      volumes {
+        name = "blobs"
+        csi {
+          driver = "gcsfuse.run.googleapis.com"
+          volume_attributes = {
+            bucket = var.blob_bucket
+          }
+        }
+      }
+    }
+    metadata {
+      annotations = {
+        "run.googleapis.com/execution-environment" = "gen2"
+        "autoscaling.knative.dev/maxScale" = "10"
+        "autoscaling.knative.dev/concurrency" = "10"
+      }
+    }
+  }
+  traffic {
+    percent = 100
+      latest_revision = true
+  }
+  autogenerate_revision_name = true
+}
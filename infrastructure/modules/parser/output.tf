@@ -0,0 +1,3 @@
+output "url" {
+  value = google_cloud_run_service.parser.status[0].url
+}
\ No newline at end of file
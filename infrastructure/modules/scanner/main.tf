@@ -14,6 +14,18 @@ resource "google_cloud_run_service" "scanner" {
         ports {
           container_port = 8080
         }
+        env {
+          name = "PARSER_URL"
+          value = var.parser_url
+        }
+        env {
+          name = "BLOB_DIR"
+          value = "/mnt/blobs"
+        }
+        volume_mounts {
+          name = "blobs"
+          mount_path = "/mnt/blobs"
+        }
         dynamic "env" {
           for_each = var.env_vars
           content {
@@ -22,9 +34,19 @@ resource "google_cloud_run_service" "scanner" {
           }
         }
       }
+      volumes {
+        name = "blobs"
+        csi {
+          driver = "gcsfuse.run.googleapis.com"
+          volume_attributes = {
+            bucket = var.blob_bucket
+          }
+        }
+      }
     }
     metadata {
       annotations = {
+        "run.googleapis.com/execution-environment" = "gen2"
         "autoscaling.knative.dev/maxScale" = "125"
         "autoscaling.knative.dev/concurrency" = "1"
       }
@@ -17,4 +17,15 @@ variable "env_vars" {
     description = "A map of environment variables for the Cloud Run service"
     type = map(string)
     default = {}
+}
+
+variable "parser_url" {
+    description = "The URL of the Cloud Run parser service"
+    type = string
+    default = ""
+}
+
+variable "blob_bucket" {
+    description = "The Cloud Storage bucket mounted as BLOB_DIR, shared by the scanner and parser"
+    type = string
 }
\ No newline at end of file
@@ -28,4 +28,10 @@ variable "scanner_env_vars" {
     description = "A map of environment variables for the scanner service"
     type = map(string)
     default = {}
+}
+
+variable "parser_env_vars" {
+    description = "A map of environment variables for the parser service"
+    type = map(string)
+    default = {}
 }
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""
+Benchmarks grype scan throughput at several concurrency levels.
+
+Targets are read from the same CSV as `test_images.py` (with `registry`,
+`repository` and `tag` columns), optionally redirected to a local
+registry with `--registry`, or from a directory of OCI archives
+(`*.tar`) and layouts with `--oci-dir`, so runs do not depend on the
+internet.
+
+For every scan, records the wall time, CPU time, peak RSS and size of
+the grype output. Each concurrency level is summarized with its
+throughput and percentiles, and the report is written as JSON. With
+`--baseline`, the report is compared against an earlier one and the
+run fails if throughput, p95 wall time or peak RSS regressed by more
+than `--tolerance`.
+
+Usage:
+
+    python benchmark_scans.py --oci-dir ./archives --concurrency 1 2 4 8 \\
+        --output report.json --baseline baseline.json
+"""
+
+# Standard lib
+from typing import Dict, List
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+
+METRICS = ["wall_secs", "cpu_secs", "peak_rss_mb", "output_bytes"]
+
+# A level is a good default if it reaches this share of the best throughput
+SATURATION = 0.95
+
+# Scans must not download a DB or check for updates mid-benchmark
+GRYPE_ENV = {
+    "GRYPE_DB_AUTO_UPDATE": "false",
+    "GRYPE_DB_VALIDATE_AGE": "false",
+    "GRYPE_CHECK_FOR_APP_UPDATE": "false"
+}
+
+
+def read_targets(args: argparse.Namespace) -> List[str]:
+    if args.oci_dir is not None:
+        targets = []
+        for name in sorted(os.listdir(args.oci_dir)):
+            path = os.path.join(args.oci_dir, name)
+            if name.endswith(".tar"):
+                targets.append(f"oci-archive:{path}")
+            elif os.path.isfile(os.path.join(path, "index.json")):
+                targets.append(f"oci-dir:{path}")
+        return targets
+
+    with open(args.images, "r", encoding="utf-8") as f:
+        return [f"{args.registry or row['registry']}/{row['repository']}:{row['tag']}"
+                for row in csv.DictReader(f)]
+
+
+def scan(target: str, env: Dict[str, str]) -> Dict:
+    """
+    Runs grype on `target` and measures it with the child's resource usage.
+    """
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(["grype", target, "--output", "json"],
+                                stdout=out, stderr=err, env=env)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+        result = {
+            "target": target,
+            "ok": proc.returncode == 0,
+            "wall_secs": wall,
+            "cpu_secs": usage.ru_utime + usage.ru_stime,
+            # ru_maxrss is in KiB on Linux and bytes on macOS
+            "peak_rss_mb": usage.ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024),
+            "output_bytes": out.tell()
+        }
+        if not result["ok"]:
+            err.seek(0)
+            result["error"] = err.read().decode(errors="replace")[-500:]
+        return result
+
+
+def percentiles(data: List[float]) -> Dict[str, float]:
+    if len(data) == 0:
+        return {"p50": 0, "p95": 0, "max": 0}
+    if len(data) == 1:
+        return {"p50": data[0], "p95": data[0], "max": data[0]}
+    q = statistics.quantiles(data, n=100, method="inclusive")
+    return {"p50": q[49], "p95": q[94], "max": max(data)}
+
+
+def run_level(targets: List[str], concurrency: int, env: Dict[str, str]) -> Dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        scans = list(pool.map(lambda t: scan(t, env), targets))
+    wall = time.perf_counter() - start
+
+    ok = [s for s in scans if s["ok"]]
+    return {
+        "concurrency": concurrency,
+        "scans": len(ok),
+        "errors": len(scans) - len(ok),
+        "wall_secs": wall,
+        "scans_per_sec": len(ok) / wall if wall > 0 else 0,
+        "per_scan": {m: percentiles([s[m] for s in ok]) for m in METRICS},
+        "results": scans
+    }
+
+
+def recommend(levels: List[Dict]) -> Dict:
+    """
+    Picks the lowest concurrency within `SATURATION` of the best
+    throughput, and the memory its scans need at the same time.
+    """
+    best = max(level["scans_per_sec"] for level in levels)
+    for level in sorted(levels, key=lambda l: l["concurrency"]):
+        if level["scans_per_sec"] >= SATURATION * best:
+            return {"concurrency": level["concurrency"],
+                    "scans_per_sec": level["scans_per_sec"],
+                    "memory_mb": level["concurrency"] * level["per_scan"]["peak_rss_mb"]["max"],
+                    "cpu_per_scan_secs": level["per_scan"]["cpu_secs"]["p50"]}
+    return {}
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Lists the regressions of `report` against `baseline` at the concurrency levels both ran.
+    """
+    regressions = []
+    baseline_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in report["levels"]:
+        base = baseline_levels.get(level["concurrency"], None)
+        if base is None:
+            continue
+        checks = [
+            ("scans/s", level["scans_per_sec"], base["scans_per_sec"], False),
+            ("p95 wall secs", level["per_scan"]["wall_secs"]["p95"], base["per_scan"]["wall_secs"]["p95"], True),
+            ("max peak RSS MB", level["per_scan"]["peak_rss_mb"]["max"], base["per_scan"]["peak_rss_mb"]["max"], True)
+        ]
+        for name, value, base_value, lower_is_better in checks:
+            if base_value == 0:
+                continue
+            change = (value - base_value) / base_value
+            if (change > tolerance) if lower_is_better else (change < -tolerance):
+                regressions.append(f"concurrency {level['concurrency']}: {name} "
+                                   f"{base_value:.2f} -> {value:.2f} ({change:+.1%})")
+    return regressions
+
+
+def grype_version(env: Dict[str, str]) -> str:
+    try:
+        output = subprocess.run(["grype", "version", "--output", "json"], env=env,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output).get("version", "unknown")
+    except (subprocess.CalledProcessError, json.JSONDecodeError, FileNotFoundError):
+        return "unknown"
+
+
+def print_level(level: Dict):
+    print(f"\nConcurrency {level['concurrency']}: {level['scans']} scans "
+          f"({level['errors']} errors) in {level['wall_secs']:.1f}s, "
+          f"{level['scans_per_sec']:.2f} scans/s")
+    for metric, p in level["per_scan"].items():
+        print(f"\t{metric:>13}: p50 {p['p50']:10.2f}  p95 {p['p95']:10.2f}  max {p['max']:10.2f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="?", default=None,
+                        help="The path to the images CSV file")
+    parser.add_argument("--oci-dir", default=None,
+                        help="Scan the OCI archives (*.tar) and layouts in this directory instead")
+    parser.add_argument("--registry", default=None,
+                        help="Pull the CSV's images from this registry, e.g. localhost:5000")
+    parser.add_argument("--insecure-registry", action="store_true",
+                        help="Pull from the registry over plain HTTP")
+    parser.add_argument("--concurrency", "-c", type=int, nargs="+", default=[1, 2, 4],
+                        help="The concurrency levels to sweep")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="Skip the untimed scan that loads the grype DB into the page cache")
+    parser.add_argument("--output", "-o", default=None,
+                        help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", "-b", default=None,
+                        help="Compare against this earlier report")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="The relative change counted as a regression")
+    args = parser.parse_args()
+    if (args.images is None) == (args.oci_dir is None):
+        parser.error("Provide either an images CSV or --oci-dir")
+    return args
+
+
+def main():
+    args = parse_args()
+    env = dict(os.environ, **GRYPE_ENV)
+    if args.insecure_registry:
+        env["GRYPE_REGISTRY_INSECURE_USE_HTTP"] = "true"
+
+    targets = read_targets(args)
+    if len(targets) == 0:
+        sys.exit("No images to scan")
+    if not args.no_warmup:
+        scan(targets[0], env)
+
+    levels = []
+    for concurrency in args.concurrency:
+        level = run_level(targets, concurrency, env)
+        print_level(level)
+        levels.append(level)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "grype_version": grype_version(env),
+        "host": {"cpus": os.cpu_count(), "platform": platform.platform()},
+        "targets": len(targets),
+        "levels": levels,
+        "recommended": recommend(levels)
+    }
+    print(f"\nRecommended: {json.dumps(report['recommended'])}")
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
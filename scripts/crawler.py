@@ -0,0 +1,236 @@
+"""
+Async crawler for registry tags and Docker Hub search, shared by the
+`ls_*.py` scripts.
+
+Talks to the registry v2 API (`/v2/<repository>/tags/list`) and the
+Docker Hub search API directly over one pooled aiohttp session:
+
+- Follows `Link` (registry) and `next` (Docker Hub) pagination.
+- Fetches anonymous bearer tokens when a registry answers 401.
+- Retries 429 and 5xx responses after `Retry-After`, or with
+  exponential backoff if there is none.
+- Caches response bodies on disk with their `ETag` and `Last-Modified`
+  and revalidates them, so repeat runs only download pages that changed.
+
+Registries are given as host names (`mcr.microsoft.com`). Hosts with an
+explicit `http://` scheme are used as is, which is how the tests point
+the crawler at a local stand-in.
+"""
+
+# Standard lib
+from typing import Dict, List, Optional
+import os
+import re
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+from urllib.parse import urlencode, urljoin
+
+# 3rd party
+import aiohttp
+
+
+DOCKER_HUB_SEARCH_URL = "https://hub.docker.com/api/content/v1/products/search"
+CRAWLER_CACHE_DIR = os.environ.get("CRAWLER_CACHE_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "gallery-crawler"))
+
+# Registries whose API is not served from the registry's name
+REGISTRY_HOSTS = {"docker.io": "registry-1.docker.io"}
+
+
+class ResponseCache:
+    """
+    Response bodies and validators on disk, one JSON file per URL.
+    """
+    def __init__(self, root: str):
+        """
+        root (str): The cache directory.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def get(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, url: str, entry: Dict):
+        path = self._path(url)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+
+def registry_url(registry: str) -> str:
+    host = REGISTRY_HOSTS.get(registry, registry)
+    if host.startswith("http://") or host.startswith("https://"):
+        return host
+    return f"https://{host}"
+
+
+def next_link(link: Optional[str], url: str) -> Optional[str]:
+    """
+    Resolves the `rel="next"` URL of a `Link` header against `url`.
+    """
+    if link is None:
+        return None
+    match = re.search(r'<([^>]+)>\s*;\s*rel="?next"?', link)
+    return None if match is None else urljoin(url, match.group(1))
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RegistryCrawler:
+    """
+    Lists repositories and tags with bounded concurrency. Use as an
+    async context manager.
+    """
+    def __init__(self, cache_dir: str=CRAWLER_CACHE_DIR, concurrency: int=16,
+                 max_retries: int=5, max_backoff: float=60, page_size: int=1000,
+                 hub_search_url: str=DOCKER_HUB_SEARCH_URL):
+        """
+        cache_dir (str, optional): The response cache directory.
+        concurrency (int, optional): The maximum number of requests in flight.
+        max_retries (int, optional): Retries of a throttled or failed request.
+        max_backoff (float, optional): The upper bound of the backoff in seconds.
+        page_size (int, optional): Tags requested per page.
+        hub_search_url (str, optional): The Docker Hub search endpoint.
+        """
+        self.cache = ResponseCache(cache_dir)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.page_size = page_size
+        self.hub_search_url = hub_search_url
+        self.stats = {"requests": 0, "not_modified": 0, "retries": 0}
+        self._session: aiohttp.ClientSession = None
+        self._semaphore: asyncio.Semaphore = None
+
+    async def __aenter__(self) -> "RegistryCrawler":
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=60))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def _token(self, challenge: str) -> str:
+        """
+        Fetches an anonymous token for a `WWW-Authenticate: Bearer ...` challenge.
+        """
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm")
+        async with self._session.get(realm, params=params) as r:
+            r.raise_for_status()
+            data = await r.json(content_type=None)
+        return data.get("token") or data["access_token"]
+
+    async def fetch(self, url: str, headers: Dict[str, str]=None) -> Dict:
+        """
+        GETs `url`, revalidating a cached copy if there is one.
+
+        headers (Dict, optional): Headers shared by the pages of a listing.
+            An `Authorization` header is added when the registry asks for a token.
+
+        Returns:
+            A cache entry with the response `body`, `etag`, `last_modified` and `link`.
+        """
+        headers = {} if headers is None else headers
+        cached = self.cache.get(url)
+        validators = {}
+        if cached is not None:
+            if cached["etag"] is not None:
+                validators["If-None-Match"] = cached["etag"]
+            if cached["last_modified"] is not None:
+                validators["If-Modified-Since"] = cached["last_modified"]
+
+        attempt, authenticated = 0, False
+        while True:
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                async with self._session.get(url, headers={**headers, **validators}) as r:
+                    if r.status == 304 and cached is not None:
+                        self.stats["not_modified"] += 1
+                        return cached
+                    if r.status == 401 and not authenticated and "WWW-Authenticate" in r.headers:
+                        headers["Authorization"] = f"Bearer {await self._token(r.headers['WWW-Authenticate'])}"
+                        authenticated = True
+                        continue
+                    if (r.status == 429 or r.status >= 500) and attempt < self.max_retries:
+                        delay = retry_after(r.headers.get("Retry-After", None))
+                        if delay is None:
+                            delay = min(2 ** attempt, self.max_backoff)
+                    else:
+                        r.raise_for_status()
+                        entry = {"body": await r.text(),
+                                 "etag": r.headers.get("ETag", None),
+                                 "last_modified": r.headers.get("Last-Modified", None),
+                                 "link": r.headers.get("Link", None)}
+                        if entry["etag"] is not None or entry["last_modified"] is not None:
+                            self.cache.put(url, entry)
+                        return entry
+
+            # Back off without holding a request slot
+            logging.warning(f"HTTP {r.status} from {url}. Retrying in {delay:.1f}s")
+            self.stats["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def list_tags(self, registry: str, repository: str) -> List[str]:
+        if registry == "docker.io" and "/" not in repository:
+            repository = f"library/{repository}"
+        url = f"{registry_url(registry)}/v2/{repository}/tags/list?n={self.page_size}"
+        headers = {}
+        tags = []
+        while url is not None:
+            entry = await self.fetch(url, headers)
+            tags += json.loads(entry["body"]).get("tags", None) or []
+            url = next_link(entry["link"], url)
+        return tags
+
+    async def list_tags_many(self, registry: str, repositories: List[str]) -> Dict[str, List[str]]:
+        """
+        Lists the tags of `repositories` concurrently. Repositories that
+        fail are logged and left out.
+        """
+        results = await asyncio.gather(*[self.list_tags(registry, r) for r in repositories],
+                                       return_exceptions=True)
+        tags = {}
+        for repository, result in zip(repositories, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Could not list tags of {registry}/{repository}: {result}")
+            else:
+                tags[repository] = result
+        return tags
+
+    async def search_repositories(self, query: str, image_filter: str=None) -> List[str]:
+        """
+        Lists the Docker Hub repositories matching `query`.
+        """
+        params = {"page_size": 25, "q": query}
+        if image_filter:
+            params["image_filter"] = image_filter
+        url = f"{self.hub_search_url}?{urlencode(params)}"
+        headers = {"Accept": "application/json", "Search-Version": "v3"}
+
+        repositories = []
+        while url:
+            data = json.loads((await self.fetch(url, headers))["body"])
+            repositories += [d["name"] for d in data["summaries"]]
+            url = data["next"]
+        return repositories
@@ -4,17 +4,17 @@ See the Makefile for usage examples.
 """
 
 # Standard lib
-from typing import List, Dict, Tuple
+from typing import List, Dict
 import argparse
+import asyncio
 import re
-import multiprocessing as mp
 
 # 3rd party
-import requests
-from sh import ErrorReturnCode, crane
 from yaspin import yaspin
 from yaspin.spinners import Spinners
-from tqdm import tqdm
+
+# Local
+from crawler import RegistryCrawler
 
 
 def print_image(image: Dict):
@@ -40,49 +40,14 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--tags", "-t", required=False,
             default=None,
             help="Only list images with these tags. Tags should be spaced separated")
+    parser.add_argument("--concurrency", "-c", type=int, required=False,
+            default=16,
+            help="The maximum number of concurrent registry requests")
     return parser.parse_args()
 
 
-def search_repositories(query: str, image_filter: str=None) -> List[str]:
-    url = "https://hub.docker.com/api/content/v1/products/search"
-    
-    params = {
-        "page_size": 25,
-        "q": query
-    }
-
-    if image_filter:
-        params["image_filter"] = image_filter
-
-    headers = {
-        "Accept": "application/json",
-        "Search-Version": "v3"
-    }
-
-    repositories = []
-    while url != "":
-        r = requests.get(url, params=params, headers=headers)
-        data = r.json()
-        repositories += [d["name"] for d in data["summaries"]]
-        url = data["next"]
-    
-    return repositories
-
-
-def get_tags(repository: str) -> List[str]:
-    try:
-        return crane("ls", f"docker.io/{repository}").split("\n")
-    except ErrorReturnCode:
-        return []
-
-
-def get_images_from_repository(inputs: Tuple[str, argparse.Namespace]) -> List[str]:
-    repository, args = inputs
+def select_images(repository: str, tags: List[str], args: argparse.Namespace) -> List[str]:
     images = []
-    if args.repository_prefix:
-        if re.match(f"^{args.repository_prefix}/", repository) is None:
-            return []
-    tags = get_tags(repository)
     if args.tags:
         for required_tag in args.tags.split(" "):
             if required_tag in tags:
@@ -93,26 +58,27 @@ def get_images_from_repository(inputs: Tuple[str, argparse.Namespace]) -> List[s
     return images
 
 
-def flatten_list(l: List[List[str]]) -> List[str]:
-    new_list = []
-    for _l in l:
-        new_list += _l
-    return new_list
+async def list_images(args: argparse.Namespace) -> List[str]:
+    async with RegistryCrawler(concurrency=args.concurrency) as crawler:
+        with yaspin(Spinners.line, text="Searching Docker"):
+            repositories = await crawler.search_repositories(args.query, args.image_filter)
 
+        if args.repository_prefix:
+            repositories = [r for r in repositories
+                            if re.match(f"^{args.repository_prefix}/", r) is not None]
 
-def main():
-    args = parse_args()
+        with yaspin(Spinners.line, text=f"Collecting tags of {len(repositories)} repositories"):
+            tags = await crawler.list_tags_many("docker.io", repositories)
 
-    with yaspin(Spinners.line, text="Searching Docker"):
-        repositories = search_repositories(args.query, args.image_filter)
+    images = []
+    for repository in repositories:
+        images += select_images(repository, tags.get(repository, []), args)
+    return images
 
-    with mp.Pool(mp.cpu_count()) as pool:
-        inputs = [(r, args) for r in repositories]
-        images = list(tqdm(pool.imap_unordered(get_images_from_repository, inputs),
-                desc=f"Collecting tags",
-                total=len(repositories)))
 
-    images = flatten_list(images)
+def main():
+    args = parse_args()
+    images = asyncio.run(list_images(args))
 
     print() # Add an extra space between progress tracking UI and output
     for i in images:
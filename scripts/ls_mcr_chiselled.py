@@ -4,10 +4,11 @@ Lists MCR chiselled images.
 
 # Standard lib
 from typing import List, Dict
+import asyncio
 import re
 
-# 3rd party
-from sh import ErrorReturnCode, crane
+# Local
+from crawler import RegistryCrawler
 
 
 def has_arch(tag: str) -> bool:
@@ -39,37 +40,38 @@ def print_image(image: Dict):
     print(f"{publisher} {registry} {repository} {tag} {labels}")
 
 
+async def list_tags() -> Dict[str, List[str]]:
+    repositories = []
+    for image in ["runtime", "runtime-deps", "aspnet"]:
+        repositories += [f"dotnet/{image}", f"dotnet/nightly/{image}"]
+    async with RegistryCrawler() as crawler:
+        return await crawler.list_tags_many("mcr.microsoft.com", repositories)
+
+
 def main() -> List[Dict]:
     registry = "mcr.microsoft.com"
     images = []
+    tags_by_repository = asyncio.run(list_tags())
 
     for image in ["runtime", "runtime-deps", "aspnet"]:
         repository = f"dotnet/{image}"
-        try:
-            tags = crane("ls", f"{registry}/{repository}").split("\n")
-            for tag in tags:
-                if is_chiseled_tag(tag):
-                    print_image({
-                        "repository": repository,
-                        "tag": tag,
-                        "labels": ["chiselled", "mcr-dotnet"]
-                    })
-        except ErrorReturnCode:
-            pass
+        for tag in tags_by_repository.get(repository, []):
+            if is_chiseled_tag(tag):
+                print_image({
+                    "repository": repository,
+                    "tag": tag,
+                    "labels": ["chiselled", "mcr-dotnet"]
+                })
 
         repository = f"dotnet/nightly/{image}"
-        try:
-            tags = crane("ls", f"{registry}/{repository}").split("\n")
-            for tag in tags:
-                if is_chiseled_tag(tag):
-                    images.append({
-                        "registry": "mcr.microsoft.com",
-                        "repository": repository,
-                        "tag": "tag",
-                        "labels": ["chiseled", "mcr-dotnet"]
-                    })
-        except ErrorReturnCode:
-            pass
+        for tag in tags_by_repository.get(repository, []):
+            if is_chiseled_tag(tag):
+                images.append({
+                    "registry": registry,
+                    "repository": repository,
+                    "tag": tag,
+                    "labels": ["chiseled", "mcr-dotnet"]
+                })
 
     return images
 
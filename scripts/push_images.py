@@ -1,73 +1,197 @@
 """
-Pushes a CSV file of images to MongoDB for routine scanning.
+Syncs a CSV file of images to MongoDB for routine scanning.
+
+Images are keyed by registry, repository and tag, which is enforced
+with a unique index. New images are inserted, and the publisher and
+labels of existing images are updated. Images of the publishers in the
+CSV that it no longer lists are deleted, unless `--keep-missing` is
+given. Changes are applied with batched, unordered `bulk_write` calls.
 
 Run `python push_images.py --help` for usage.
 """
 
 # Standard lib
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
 import os
 import csv
+import time
 import argparse
+from dataclasses import dataclass, field
 
 # 3rd party
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, DeleteOne, ASCENDING
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
 
 
 MONGO_URI = os.environ["MONGO_URI"]
 MONGO_DB_NAME = "gallery"
 MONGO_COLLECTION_NAME = "images"
 
+BATCH_SIZE = 1000
+DUPLICATE_KEY_ERROR = 11000
 
-def image_str(image: Dict) -> str:
-    return f"{image['registry']}/{image['repository']}:{image['tag']}"
+ImageKey = Tuple[str, str, str]
 
 
-def fetch_image_names() -> List[str]:
-    client = MongoClient(MONGO_URI)
-    images = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].find()
-    return [image_str(img) for img in images]
+@dataclass
+class SyncReport:
+    inserted: List[ImageKey] = field(default_factory=list)
+    updated: List[ImageKey] = field(default_factory=list)
+    deleted: List[ImageKey] = field(default_factory=list)
+    unchanged: int = 0
+    duplicate_rows: int = 0
 
+    def __str__(self) -> str:
+        return (f"Inserted {len(self.inserted)}, updated {len(self.updated)}, "
+                f"deleted {len(self.deleted)}, unchanged {self.unchanged} images "
+                f"({self.duplicate_rows} duplicate rows in the CSV)")
 
-def is_in(sample: Dict, image_names: List[str]) -> bool:
-    return image_str(sample) in image_names
 
+def image_key(image: Dict) -> ImageKey:
+    return (image["registry"], image["repository"], image["tag"])
 
-def push_images(images: List[Dict]):
-    client = MongoClient(MONGO_URI)
-    client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].insert_many(images)
 
+def image_str(key: ImageKey) -> str:
+    return f"{key[0]}/{key[1]}:{key[2]}"
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("csv_file")
-    csv_file = parser.parse_args().csv_file
 
-    existing_images = fetch_image_names()
-
-    images = []
+def read_csv(csv_file: str) -> Iterator[Dict]:
     with open(csv_file, "r", encoding="utf-8") as f:
         reader = csv.reader(f)
-        for i, row in enumerate(reader):
-            if i == 0:
-                continue # Skip headers
-            registry = row[1]
-            repository = row[2]
-            tag = row[3]
-            img = {
+        next(reader, None) # Skip headers
+        for row in reader:
+            yield {
                 "publisher": row[0],
-                "registry": registry,
-                "repository": repository,
-                "tag": tag,
+                "registry": row[1],
+                "repository": row[2],
+                "tag": row[3],
                 "labels": row[4].split(",")
             }
-            if is_in(img, existing_images):
-                print(f"WARNING: Duplicate image {image_str(img)}")
-            else:
-                images.append(img)
 
-    push_images(images)
+
+def ensure_indexes(collection: Collection):
+    collection.create_index([("registry", ASCENDING), ("repository", ASCENDING), ("tag", ASCENDING)],
+                            unique=True)
+
+
+def fetch_existing(collection: Collection) -> Tuple[Dict[ImageKey, Dict], List]:
+    """
+    Reads the key, publisher and labels of every image.
+
+    Returns:
+        The images by key, and the `_id`s of duplicates of an earlier image.
+    """
+    existing, duplicate_ids = {}, []
+    projection = {"registry": 1, "repository": 1, "tag": 1, "publisher": 1, "labels": 1}
+    for image in collection.find({}, projection, batch_size=10000):
+        key = image_key(image)
+        if key in existing:
+            duplicate_ids.append(image["_id"])
+        else:
+            existing[key] = image
+    return existing, duplicate_ids
+
+
+def plan_sync(rows: Iterator[Dict], existing: Dict[ImageKey, Dict],
+              prune: bool) -> Tuple[List, SyncReport]:
+    """
+    Diffs the CSV rows against the existing images. Later rows
+    win over earlier rows with the same key.
+
+    Returns:
+        The write operations and a report of the changes they make.
+    """
+    report = SyncReport()
+    wanted: Dict[ImageKey, Dict] = {}
+    for row in rows:
+        key = image_key(row)
+        if key in wanted:
+            report.duplicate_rows += 1
+        wanted[key] = row
+
+    ops = []
+    for key, row in wanted.items():
+        image = existing.get(key, None)
+        if image is None:
+            report.inserted.append(key)
+        elif image.get("publisher") != row["publisher"] or image.get("labels") != row["labels"]:
+            report.updated.append(key)
+        else:
+            report.unchanged += 1
+            continue
+        # updated_at lets analyses tell that the catalog changed
+        ops.append(UpdateOne({"registry": key[0], "repository": key[1], "tag": key[2]},
+                             {"$set": {"publisher": row["publisher"], "labels": row["labels"]},
+                              "$currentDate": {"updated_at": True}},
+                             upsert=True))
+
+    if prune:
+        # Only prune publishers covered by this CSV, so per-publisher files can be synced separately
+        publishers = {row["publisher"] for row in wanted.values()}
+        for key, image in existing.items():
+            if key not in wanted and image.get("publisher") in publishers:
+                report.deleted.append(key)
+                ops.append(DeleteOne({"_id": image["_id"]}))
+
+    return ops, report
+
+
+def apply_ops(collection: Collection, ops: List):
+    """
+    Applies `ops` in unordered batches of `BATCH_SIZE`. Upserts that lose
+    a race with a concurrent sync fail the unique index and are ignored.
+    """
+    for i in range(0, len(ops), BATCH_SIZE):
+        try:
+            collection.bulk_write(ops[i:i + BATCH_SIZE], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err["code"] != DUPLICATE_KEY_ERROR for err in errors):
+                raise
+
+
+def sync(csv_file: str, collection: Collection, prune: bool=True, dry_run: bool=False) -> SyncReport:
+    existing, duplicate_ids = fetch_existing(collection)
+    ops, report = plan_sync(read_csv(csv_file), existing, prune)
+    if dry_run:
+        return report
+
+    # Duplicates from before the unique index existed would block creating it
+    if len(duplicate_ids) > 0:
+        print(f"WARNING: Removing {len(duplicate_ids)} duplicate images")
+        apply_ops(collection, [DeleteOne({"_id": _id}) for _id in duplicate_ids])
+    ensure_indexes(collection)
+    apply_ops(collection, ops)
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("csv_file")
+    parser.add_argument("--keep-missing", action="store_true",
+                        help="Do not delete images of the CSV's publishers that it does not list")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report the changes without applying them")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="List every changed image")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    start = time.perf_counter()
+    with MongoClient(MONGO_URI) as client:
+        report = sync(args.csv_file, client[MONGO_DB_NAME][MONGO_COLLECTION_NAME],
+                      prune=not args.keep_missing, dry_run=args.dry_run)
+
+    if args.verbose:
+        for change in ["inserted", "updated", "deleted"]:
+            for key in getattr(report, change):
+                print(f"{change.upper()}: {image_str(key)}")
+    print(f"{'Dry run' if args.dry_run else 'Synced'}: {report} in {time.perf_counter() - start:.2f}s")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -15,6 +15,8 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("images",
                         help="The path to the images CSV file")
+    parser.add_argument("--nprocs", "-n", type=int, default=4,
+                        help="The number of concurrent scans. See benchmark_scans.py to pick one")
     return parser.parse_args()
 
 
@@ -33,7 +35,7 @@ def main():
                       tag=row["tag"])
         images.append(img)
 
-    reports = ImageScanner().scan(images, nprocs=4, error_cb=handle_error)
+    reports = ImageScanner().scan(images, nprocs=args.nprocs, error_cb=handle_error)
     print(f"Generated {len(reports)} reports")
 
 
@@ -0,0 +1,169 @@
+"""
+Summarizes the spans written with `TRACE_EXPORTER=file` (see
+`src/common/tracing.py`). Each publish run is one trace. For each run,
+prints its wall time, the time per span name on its critical path, and
+the slowest scans.
+
+The critical path is the chain of spans that determined when the run
+finished. Time on it that no span covers, such as a task waiting in the
+queue, is reported as `wait`.
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple
+import json
+import argparse
+from collections import defaultdict
+
+
+WAIT = "wait"
+
+
+def load_spans(path: str) -> Dict[str, List[Dict]]:
+    """
+    Groups the spans in a TRACE_FILE by trace id.
+    """
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            span = json.loads(line)
+            traces[span["trace_id"]].append(span)
+    return traces
+
+
+def _finish_times(spans: Dict[str, Dict], children: Dict[str, List[Dict]]) -> Dict[str, float]:
+    """
+    The time each span's subtree finished. Scans outlive the publisher
+    spans that enqueued them, so this can be later than a span's end.
+    """
+    finish = {}
+
+    def visit(span: Dict) -> float:
+        end = span["end"]
+        for child in children.get(span["span_id"], []):
+            end = max(end, visit(child))
+        finish[span["span_id"]] = end
+        return end
+
+    for span in spans.values():
+        if span["span_id"] not in finish and span["parent_id"] not in spans:
+            visit(span)
+    return finish
+
+
+def critical_path(root: Dict, children: Dict[str, List[Dict]],
+                  finish: Dict[str, float]) -> List[Tuple[str, float]]:
+    """
+    Walks back from the end of `root`'s subtree, always following the
+    child that finished last.
+
+    Returns:
+        (span name or `wait`, seconds) segments. They add up to the wall time of the subtree.
+    """
+    segments = []
+
+    def attribute(span: Dict, start: float, end: float):
+        if end <= start:
+            return
+        inside = max(0.0, min(end, span["end"]) - max(start, span["start"]))
+        if inside > 0:
+            segments.append((span["name"], inside))
+        if end - start - inside > 0:
+            segments.append((WAIT, end - start - inside))
+
+    def visit(span: Dict):
+        cursor = finish[span["span_id"]]
+        for child in sorted(children.get(span["span_id"], []),
+                            key=lambda c: finish[c["span_id"]], reverse=True):
+            if cursor <= span["start"]:
+                break
+            if finish[child["span_id"]] > cursor:
+                continue
+            attribute(span, finish[child["span_id"]], cursor)
+            visit(child)
+            cursor = child["start"]
+        attribute(span, span["start"], cursor)
+
+    visit(root)
+    return segments
+
+
+def summarize(spans: List[Dict], top: int = 5) -> List[Dict]:
+    """
+    Summarizes every root span of a trace. A trace normally has one,
+    unless the root was not exported.
+    """
+    by_id = {s["span_id"]: s for s in spans}
+    children = defaultdict(list)
+    for span in spans:
+        if span["parent_id"] in by_id:
+            children[span["parent_id"]].append(span)
+    finish = _finish_times(by_id, children)
+
+    summaries = []
+    for root in [s for s in spans if s["parent_id"] not in by_id]:
+        path = defaultdict(float)
+        for name, secs in critical_path(root, children, finish):
+            path[name] += secs
+
+        scans = [s for s in spans if s["name"] == "scan"]
+        slowest = sorted(scans, key=lambda s: s["start"] - s["end"])[:top]
+        summaries.append({
+            "trace_id": root["trace_id"],
+            "root": root["name"],
+            "service": root["service"],
+            "start": root["start"],
+            "wall_secs": finish[root["span_id"]] - root["start"],
+            "spans": len(spans),
+            "scans": len(scans),
+            "errors": sum(1 for s in spans if s["status"] == "ERROR"),
+            "critical_path_secs": dict(sorted(path.items(), key=lambda p: -p[1])),
+            "slowest_scans": [{"image": s["attributes"].get("gallery.image"),
+                               "secs": s["end"] - s["start"]} for s in slowest]
+        })
+    return summaries
+
+
+def print_summary(summary: Dict):
+    print(f"\nTrace {summary['trace_id']} ({summary['service']}/{summary['root']})")
+    print(f"\tWall time: {summary['wall_secs']:.2f}s")
+    print(f"\tSpans: {summary['spans']}  Scans: {summary['scans']}  Errors: {summary['errors']}")
+    print("\tCritical path:")
+    for name, secs in summary["critical_path_secs"].items():
+        share = secs / summary["wall_secs"] if summary["wall_secs"] > 0 else 0
+        print(f"\t\t{name:>16}: {secs:8.2f}s ({share:6.1%})")
+    if len(summary["slowest_scans"]) > 0:
+        print("\tSlowest scans:")
+        for scan in summary["slowest_scans"]:
+            print(f"\t\t{scan['secs']:8.2f}s {scan['image']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace_file",
+                        help="The TRACE_FILE written by the services")
+    parser.add_argument("--top", type=int, default=5,
+                        help="The number of slowest scans to list per run")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the summaries as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    summaries = []
+    for spans in load_spans(args.trace_file).values():
+        summaries += summarize(spans, args.top)
+    summaries.sort(key=lambda s: s["start"])
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+        return
+    for summary in summaries:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+The remediation algorithm of `remediation.py` as a MongoDB
+aggregation, so only remediation rows leave the server instead of every
+scan with its full CVE list.
+
+Pipeline outline, per image:
+
+1) Reduce each CVE match to the fields that identify it
+   (`id`, `severity`, `fix_state` and the component) so matches
+   compare like `CVE` objects.
+2) Pair each scan with the matches of the scan before it
+   (`$setWindowFields` with `$shift`).
+3) Emit the matches that appeared and disappeared at each scan
+   (`$setDifference`). Scans without changes are dropped here, which
+   is most of them.
+4) Group the events by match. A match alternates between appearing
+   and disappearing, so zipping its appearance times with its
+   disappearance times gives its intervals. An interval without a
+   disappearance is residual.
+
+As in `_collect_image_remediations`, matches present in an image's first
+scan have no `first_seen_at`, and neither do their later reappearances.
+
+The window partitions and the final sort read the index on
+(registry, repository, tag, scan_start) that the Scanner creates on
+gallery.cves. Analyses are read-only and do not create it.
+
+Requires MongoDB 5.0 or later.
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple
+import os
+
+# 3rd party
+from gryft.scanning.types import CVE, Component
+from pymongo import MongoClient, ASCENDING
+from pymongo.collection import Collection
+from tqdm import tqdm
+
+# Local
+from .stat import RemediationTable, Remediation, concat
+from .fetch import fetch_images
+
+
+IMAGE_KEYS = ["registry", "repository", "tag"]
+SCAN_INDEX = [(k, ASCENDING) for k in IMAGE_KEYS] + [("scan_start", ASCENDING)]
+
+
+def _match(var: str) -> Dict:
+    """
+    The identifying fields of the CVE match in `$$<var>`.
+    """
+    fields = {k: f"$${var}.{k}" for k in ["id", "severity", "fix_state"]}
+    for k in ["name", "version", "type_"]:
+        fields[k] = {"$ifNull": [f"$${var}.component.{k}", None]}
+    return fields
+
+
+def remediation_pipeline(query: Dict=None) -> List[Dict]:
+    """
+    Builds the aggregation over the `cves` collection that returns one
+    row per remediation of the images matching `query`.
+    """
+    image = {k: f"${k}" for k in IMAGE_KEYS}
+    keep = {k: 1 for k in IMAGE_KEYS + ["scan_start"]}
+    is_first = {"$eq": ["$prev", None]}
+
+    def events(field: str, appeared: bool) -> Dict:
+        return {"$map": {"input": f"${field}", "as": "c",
+                         "in": {"cve": "$$c", "appeared": appeared}}}
+
+    def times(appeared: bool) -> Dict:
+        cond = "$$e.appeared" if appeared else {"$not": ["$$e.appeared"]}
+        return {"$map": {"input": {"$filter": {"input": "$events", "as": "e", "cond": cond}},
+                         "as": "e", "in": "$$e.t"}}
+
+    return [
+        {"$match": query or {}},
+        {"$project": {"_id": 0, **keep,
+                      "cves": {"$setUnion": [{"$map": {"input": {"$ifNull": ["$cves", []]},
+                                                       "as": "c", "in": _match("c")}}]}}},
+        {"$setWindowFields": {"partitionBy": image,
+                              "sortBy": {"scan_start": 1},
+                              "output": {"prev": {"$shift": {"output": "$cves", "by": -1,
+                                                             "default": None}}}}},
+        {"$project": {**keep,
+                      "first": is_first,
+                      "appeared": {"$cond": [is_first, "$cves",
+                                             {"$setDifference": ["$cves", "$prev"]}]},
+                      "disappeared": {"$cond": [is_first, [],
+                                                {"$setDifference": ["$prev", "$cves"]}]}}},
+        {"$match": {"$or": [{"appeared.0": {"$exists": True}},
+                            {"disappeared.0": {"$exists": True}}]}},
+        {"$project": {**keep, "first": 1,
+                      "events": {"$concatArrays": [events("appeared", True),
+                                                   events("disappeared", False)]}}},
+        {"$unwind": "$events"},
+        # $push keeps the order documents enter $group in
+        {"$sort": {**{k: 1 for k in IMAGE_KEYS}, "scan_start": 1}},
+        {"$group": {"_id": {**image, "cve": "$events.cve"},
+                    "initial": {"$max": "$first"},
+                    "events": {"$push": {"t": "$scan_start",
+                                         "appeared": "$events.appeared"}}}},
+        {"$project": {"initial": 1,
+                      "intervals": {"$zip": {"inputs": [times(True), times(False)],
+                                             "useLongestLength": True}}}},
+        {"$unwind": "$intervals"},
+        {"$project": {"_id": 0,
+                      **{k: f"$_id.{k}" for k in IMAGE_KEYS},
+                      "cve": "$_id.cve",
+                      "first_seen_at": {"$cond": ["$initial", None,
+                                                  {"$arrayElemAt": ["$intervals", 0]}]},
+                      "remediated_at": {"$arrayElemAt": ["$intervals", 1]}}},
+    ]
+
+
+def _to_remediation(row: Dict) -> Remediation:
+    match = row["cve"]
+    component = Component(name=match["name"], version=match["version"], type_=match["type_"])
+    cve = CVE(id=match["id"], severity=match["severity"],
+              fix_state=match["fix_state"], component=component)
+    return Remediation(cve=cve,
+                       first_seen_at=row["first_seen_at"],
+                       remediated_at=row["remediated_at"])
+
+
+def ensure_indexes(collection: Collection):
+    """
+    Creates the Scanner's history index on a collection of scans other
+    than gallery.cves, such as a test copy.
+    """
+    collection.create_index(SCAN_INDEX)
+
+
+def collect_remediations(collection: Collection,
+                         query: Dict=None) -> Dict[Tuple[str, str, str], List[Remediation]]:
+    """
+    Runs the remediation pipeline on `collection`.
+
+    Args:
+        collection (Collection): The scans, usually gallery.cves.
+        query (Dict, optional): Restricts the scans, e.g. to one image.
+
+    Returns:
+        The remediations of each image, keyed by (registry, repository, tag).
+        Images without remediations or residual matches are left out.
+    """
+    remediations = {}
+    rows = collection.aggregate(remediation_pipeline(query), allowDiskUse=True)
+    for row in rows:
+        key = tuple(row[k] for k in IMAGE_KEYS)
+        remediations.setdefault(key, []).append(_to_remediation(row))
+    return remediations
+
+
+def fetch_remediations(images: List[Dict]=None) -> RemediationTable:
+    """
+    Computes the remediations of every image in MongoDB, or only of
+    `images` if given. Returns the same table as `remediation.fetch_remediations`.
+    """
+    query = None
+    if images is not None:
+        if len(images) == 0:
+            return RemediationTable.empty()
+        query = {"$or": [{k: img[k] for k in IMAGE_KEYS} for img in images]}
+    images = fetch_images() if images is None else images
+
+    with MongoClient(os.environ["MONGO_URI"]) as client:
+        remediations = collect_remediations(client["gallery"]["cves"], query)
+
+    rtables = []
+    for img in tqdm(images, desc="Building tables"):
+        key = tuple(img[k] for k in IMAGE_KEYS)
+        rtables.append(RemediationTable.from_remediations(img, remediations.get(key, [])))
+    return concat(rtables)
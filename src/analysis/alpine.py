@@ -2,27 +2,48 @@
 Functions for detecting if a Chainguard image is
 alpine-based. These images should be omitted from
 the analysis.
+
+The scanner records the distro of every image in
+gallery.images (see `src/scanner/distro.py`), so this
+is a query rather than a scan. Images scanned before
+distros were recorded are filled in by running
+`python src/scanner/distro.py`.
 """
 
 # Standard lib
-from typing import List, Dict, Tuple
+from typing import List, Dict
+import os
 
 # 3rd party
+from pymongo import MongoClient
 from gryft.scanning.image import Image
-from gryft.scanning.scanner import ImageScanner
 
 # Local
 
 
-def print_error(e: Exception):
-    print(e)
+def list_cgr_alpine(images: List[Dict]=None) -> List[Image]:
+    """
+    Lists the cgr.dev images whose latest scan detected alpine.
+    If `images` is given, only those images are considered.
+    """
+    with MongoClient(os.environ["MONGO_URI"]) as client:
+        collection = client["gallery"]["images"]
+        alpine = list(collection.find({"registry": "cgr.dev", "distro.name": "alpine"},
+                                      {"registry": 1, "repository": 1, "tag": 1}))
+
+    if images is not None:
+        keys = {(img["registry"], img["repository"], img["tag"]) for img in images}
+        alpine = [img for img in alpine
+                  if (img["registry"], img["repository"], img["tag"]) in keys]
+    return [Image(img["registry"], img["repository"], img["tag"]) for img in alpine]
 
 
-def list_cgr_alpine(images: List[Dict]) -> List[Image]:
-    images = [Image(img["registry"], img["repository"], img["tag"]) for img in images
-              if img["registry"] == "cgr.dev"]
-    snapshots = ImageScanner().scan(images, error_cb=print_error)
-    return [snap.image for snap in snapshots
-            if (snap.distro == "alpine")
-            and (snap.image.registry == "cgr.dev")]
-    
\ No newline at end of file
+def list_missing_distro() -> List[Dict]:
+    """
+    Lists the cgr.dev images whose distro is not known yet. They are
+    not excluded by `list_cgr_alpine` until it is.
+    """
+    with MongoClient(os.environ["MONGO_URI"]) as client:
+        collection = client["gallery"]["images"]
+        return list(collection.find({"registry": "cgr.dev", "distro": {"$exists": False}},
+                                    {"registry": 1, "repository": 1, "tag": 1}))
@@ -0,0 +1,266 @@
+"""
+A cube of preaggregated remediation stats, so comparisons across
+registries, labels, severities, fix states and weeks of discovery do
+not recompute `cve_stats` and `_group_rtime` from the full table.
+
+Each cell is one combination of the dimensions:
+
+    registry, repository, tag, labels, severity, fix_state, week
+
+where `week` is the Monday of the week of `first_seen_at` (`NaT` for
+preexisting matches). A cell holds additive measures:
+
+    n_perpetual               first_seen_at and remediated_at unknown
+    n_preexisting_remediated  only first_seen_at unknown
+    n_discovered_residual     only remediated_at unknown
+    n_true_remediated         both known
+    n_rtime, rtime_sum, rtime_sumsq
+                              count, sum and sum of squares of the
+                              rtime of remediated matches
+
+and a t-digest of the same rtimes (see `sketch.py`) in `rtime_sketch`.
+
+Every count `cve_stats` reports is a sum of the first four, and the
+rtime mean and std follow from the next three, so any roll-up or slice
+is a sum over cells. Percentiles merge the digests of the cells. Slices
+are cached, so repeated queries are dictionary lookups.
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple, Union
+import math
+
+# 3rd party
+import numpy as np
+import pandas as pd
+
+# Local
+from .stat import RemediationTable
+from .sketch import TDigest
+
+
+DIMENSIONS = ["registry", "repository", "tag", "labels", "severity", "fix_state", "week"]
+IMAGE_DIMENSIONS = ["registry", "repository", "tag"]
+MEASURES = ["n_perpetual", "n_preexisting_remediated", "n_discovered_residual",
+            "n_true_remediated", "n_rtime", "rtime_sum", "rtime_sumsq"]
+CATEGORIES = ["preexisting", "discovered", "remediated", "true_remediated", "residual", "perpetual"]
+
+_CATEGORY_MEASURES = {
+    "preexisting": ["n_perpetual", "n_preexisting_remediated"],
+    "discovered": ["n_discovered_residual", "n_true_remediated"],
+    "remediated": ["n_preexisting_remediated", "n_true_remediated"],
+    "true_remediated": ["n_true_remediated"],
+    "residual": ["n_perpetual", "n_discovered_residual"],
+    "perpetual": ["n_perpetual"],
+}
+
+
+def cells_from_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregates the rows of a `RemediationTable` frame into cube cells.
+    """
+    known = df["first_seen_at"].notna()
+    remediated = df["remediated_at"].notna()
+    rtime = df["rtime"].where(remediated).astype(float)
+
+    cells = df[DIMENSIONS[:-1]].copy()
+    cells["week"] = pd.to_datetime(df["first_seen_at"]).dt.to_period("W").dt.start_time
+    cells["n_perpetual"] = (~known & ~remediated).astype(int)
+    cells["n_preexisting_remediated"] = (~known & remediated).astype(int)
+    cells["n_discovered_residual"] = (known & ~remediated).astype(int)
+    cells["n_true_remediated"] = (known & remediated).astype(int)
+    cells["n_rtime"] = rtime.notna().astype(int)
+    cells["rtime_sum"] = rtime.fillna(0)
+    cells["rtime_sumsq"] = rtime.fillna(0) ** 2
+    cells["rtime"] = rtime
+
+    grouped = cells.groupby(DIMENSIONS, dropna=False, as_index=False)
+    sums = grouped[MEASURES].sum()
+    sums["rtime_sketch"] = grouped["rtime"].agg(_sketch)["rtime"].to_numpy()
+    return sums
+
+
+def _sketch(rtime: pd.Series) -> TDigest:
+    if rtime.notna().any():
+        return TDigest.from_values(rtime.to_numpy())
+    return None
+
+
+def derive_stats(m) -> Dict:
+    """
+    Computes the stats of `cve_stats` and the rtime mean and std from
+    summed measures. Works on a `Dict` of sums or a `pd.DataFrame` of them.
+    """
+    stats = {f"n_{cat}": sum(m[k] for k in measures)
+             for cat, measures in _CATEGORY_MEASURES.items()}
+    total = stats["n_preexisting"] + stats["n_discovered"]
+    for cat in CATEGORIES:
+        stats[f"p_{cat}"] = stats[f"n_{cat}"] / total
+
+    n, s, ss = m["n_rtime"], m["rtime_sum"], m["rtime_sumsq"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(n > 0, s / np.maximum(n, 1), np.nan)
+        var = np.where(n > 1, np.maximum(ss - s * s / np.maximum(n, 1), 0) / np.maximum(n - 1, 1), np.nan)
+    stats["rtime_mean"] = mean if np.ndim(mean) else float(mean)
+    stats["rtime_std"] = np.sqrt(var) if np.ndim(var) else math.sqrt(var)
+    return stats
+
+
+class RemediationCube:
+    """
+    Preaggregated remediation stats over `DIMENSIONS`. Build one with
+    `from_table`, refresh images with `refresh`, and persist it with
+    `save` and `load`.
+    """
+    def __init__(self, cells: pd.DataFrame):
+        """
+        cells (pd.DataFrame): One row per cell with the `DIMENSIONS` and `MEASURES` columns.
+        """
+        self._cells = cells.reset_index(drop=True)
+        if "rtime_sketch" not in self._cells.columns:
+            self._cells["rtime_sketch"] = None
+        self._values = self._cells[MEASURES].to_numpy(dtype=float)
+        self._codes = {}
+        for dim in DIMENSIONS:
+            codes, uniques = pd.factorize(self._cells[dim], use_na_sentinel=True)
+            self._codes[dim] = (codes, uniques)
+        self._cache: Dict[Tuple, Dict] = {}
+        self._sketch_cache: Dict[Tuple, TDigest] = {}
+
+    @classmethod
+    def from_table(cls, table: RemediationTable) -> "RemediationCube":
+        return cls(cells_from_frame(table._df))
+
+    @classmethod
+    def load(cls, path: str) -> "RemediationCube":
+        return cls(pd.read_pickle(path))
+
+    def save(self, path: str):
+        self._cells.to_pickle(path)
+
+    def refresh(self, table: RemediationTable, images: List[Dict]=None) -> "RemediationCube":
+        """
+        Replaces the cells of recomputed images. This operation is not
+        in-place. A new `RemediationCube` object is returned.
+
+        Args:
+            table (RemediationTable): The new remediations of the images.
+            images (List[Dict], optional): The images to replace, with `registry`,
+                `repository` and `tag`. Defaults to the images in `table`, so pass
+                them if some have no remediations left.
+
+        Returns:
+            The refreshed `RemediationCube`
+        """
+        new = cells_from_frame(table._df)
+        if images is None:
+            keys = set(new[IMAGE_DIMENSIONS].itertuples(index=False, name=None))
+        else:
+            keys = {tuple(img[k] for k in IMAGE_DIMENSIONS) for img in images}
+
+        stale = pd.Series([k in keys for k in self._cells[IMAGE_DIMENSIONS].itertuples(index=False, name=None)],
+                          index=self._cells.index, dtype=bool)
+        return RemediationCube(pd.concat([self._cells[~stale], new], ignore_index=True))
+
+    def _mask(self, filters: Dict) -> np.ndarray:
+        mask = np.ones(len(self._cells), dtype=bool)
+        for dim, value in filters.items():
+            if dim not in self._codes:
+                raise ValueError(f"Unknown dimension: {dim}")
+            codes, uniques = self._codes[dim]
+            if dim == "labels":
+                # Matches `RemediationTable.filter`, which checks if the labels contain it
+                allowed = [i for i, u in enumerate(uniques) if isinstance(u, str) and value in u]
+            else:
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                allowed = [i for i, u in enumerate(uniques) if u in values]
+            mask &= np.isin(codes, allowed)
+        return mask
+
+    @staticmethod
+    def _key(filters: Dict) -> Tuple:
+        return tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple, set)) else v)
+                            for k, v in filters.items()))
+
+    def totals(self, **filters) -> Dict[str, float]:
+        """
+        Sums the measures of the cells matching `filters`, given as
+        `dimension=value` or `dimension=[values]`. `labels` matches cells
+        whose labels contain the value.
+        """
+        key = self._key(filters)
+        if key not in self._cache:
+            sums = self._values[self._mask(filters)].sum(axis=0)
+            self._cache[key] = {k: int(v) if k.startswith("n_") else v
+                                for k, v in zip(MEASURES, sums.tolist())}
+        return self._cache[key]
+
+    def cve_stats(self, **filters) -> Dict:
+        """
+        The same stats as `RemediationTable.cve_stats` for a slice of the cube.
+        """
+        stats = derive_stats(self.totals(**filters))
+        return {k: v for k, v in stats.items() if not k.startswith("rtime")}
+
+    def rtime_stats(self, **filters) -> Dict[str, float]:
+        """
+        The mean and std rtime of the remediated matches in a slice of the cube.
+        """
+        stats = derive_stats(self.totals(**filters))
+        return {"rtime_mean": stats["rtime_mean"], "rtime_std": stats["rtime_std"]}
+
+    def rtime_digest(self, **filters) -> TDigest:
+        """
+        The merged rtime digest of the cells matching `filters`.
+        """
+        key = self._key(filters)
+        if key not in self._sketch_cache:
+            sketches = self._cells["rtime_sketch"].to_numpy()[self._mask(filters)]
+            self._sketch_cache[key] = TDigest.merge_all(sketches)
+        return self._sketch_cache[key]
+
+    def rtime_quantile(self, q: Union[float, List[float]], **filters) -> Union[float, np.ndarray]:
+        """
+        Estimates rtime quantiles of the remediated matches in a slice of the cube.
+        """
+        return self.rtime_digest(**filters).quantile(q)
+
+    def rollup(self, groups: List[str], quantiles: List[float]=None, **filters) -> pd.DataFrame:
+        """
+        Rolls the cube up to `groups` after slicing it with `filters`.
+
+        Returns:
+            A `pd.DataFrame` with the `groups`, the summed measures, the
+            `cve_stats` columns, `rtime_mean` and `rtime_std`, and a
+            `rtime_p<percent>` column per quantile in `quantiles`.
+        """
+        cells = self._cells[self._mask(filters)]
+        grouped = cells.groupby(groups, dropna=False, as_index=False)
+        df = grouped[MEASURES].sum()
+        for key, value in derive_stats(df).items():
+            df[key] = value
+
+        if quantiles is not None:
+            digests = grouped["rtime_sketch"].agg(TDigest.merge_all)["rtime_sketch"]
+            estimates = np.array([np.atleast_1d(d.quantile(quantiles)) for d in digests])
+            for i, q in enumerate(quantiles):
+                df[f"rtime_p{q * 100:g}"] = estimates[:, i] if len(estimates) else []
+        return df
+
+    def image_summary(self) -> pd.DataFrame:
+        """
+        The same table as `RemediationTable.image_summary`.
+        """
+        df = self.rollup(IMAGE_DIMENSIONS)
+        remediated = df["n_preexisting_remediated"] + df["n_true_remediated"]
+        df = df[remediated > 0].reset_index(drop=True)
+
+        summary = df[IMAGE_DIMENSIONS].copy()
+        summary["rtime_mean"] = df["rtime_mean"]
+        summary["rtime_std"] = df["rtime_std"]
+        # As in `image_summary`, stats cover every tag of the repository
+        for i, row in summary.iterrows():
+            stats = self.cve_stats(registry=row["registry"], repository=row["repository"])
+            for key, value in stats.items():
+                summary.loc[i, key] = value
+        return summary
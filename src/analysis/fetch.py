@@ -86,3 +86,19 @@ def global_latest_scan() -> datetime:
         collection = client["gallery"]["cves"]
         scan = collection.find_one({}, sort=[("scan_start", DESCENDING)])
         return pd.to_datetime(scan["scan_start"])
+
+
+def data_watermark() -> Dict:
+    """
+    Fetch a summary of the dataset that changes whenever scans are added
+    or the image catalog changes: the latest `scan_start`, the number of
+    images and the latest `updated_at` of an image.
+    """
+    with MongoClient(os.environ["MONGO_URI"]) as client:
+        db = client["gallery"]
+        scan = db["cves"].find_one({}, {"scan_start": 1}, sort=[("scan_start", DESCENDING)])
+        image = db["images"].find_one({"updated_at": {"$exists": True}}, {"updated_at": 1},
+                                      sort=[("updated_at", DESCENDING)])
+        return {"latest_scan": None if scan is None else scan["scan_start"],
+                "n_images": db["images"].count_documents({}),
+                "images_updated_at": None if image is None else image["updated_at"]}
@@ -0,0 +1,361 @@
+"""
+A small DAG runner for the analysis stages of `notebooks/analysis.ipynb`,
+with cached intermediate tables, summaries and figures.
+
+Each `Stage` names its inputs, the upstream stages whose outputs are
+passed to it. A stage's cache key hashes its name, its params, the
+source of its function and of the modules it `depends` on, and the keys
+of its inputs. Stages that read gallery directly also hash the data
+watermark, which covers the latest `scan_start` and the image catalog
+(see `fetch.data_watermark`). A key therefore changes whenever
+anything upstream of the stage changes, and only those stages recompute.
+Outputs are pickled under `cache_dir` by key.
+
+Stages run on a thread pool as soon as their inputs are available, so
+independent table and figure stages run in parallel. Figures are built
+on `matplotlib.figure.Figure` rather than `pyplot`, which is not
+thread-safe.
+
+For example, from `src/`:
+
+    python -m analysis.pipeline --out figures
+"""
+
+# Standard lib
+from typing import Callable, Dict, List
+from types import ModuleType
+import os
+import sys
+import pickle
+import hashlib
+import inspect
+import argparse
+import json
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# 3rd party
+import pandas as pd
+from matplotlib.figure import Figure
+
+# Local
+from . import stat, remediation, aggregation, fetch
+from .stat import RemediationTable
+from .fetch import fetch_images, data_watermark
+
+
+DEFAULT_CACHE_DIR = ".analysis-cache"
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "4"))
+
+
+@dataclass
+class Stage:
+    """
+    A step of the analysis. `func` is called with the outputs of `inputs`,
+    in order, and `params` as keyword arguments.
+
+    name (str): The stage's name, unique in its pipeline.
+    func (Callable): Computes the stage's output.
+    inputs (List[str]): The names of the stages whose outputs `func` takes.
+    params (Dict): Keyword arguments of `func`. Must be JSON serializable.
+    depends (List[ModuleType]): Modules whose source is part of the code version.
+    reads_data (bool): `True` if `func` reads gallery, so its key includes the watermark.
+    """
+    name: str
+    func: Callable
+    inputs: List[str] = field(default_factory=list)
+    params: Dict = field(default_factory=dict)
+    depends: List[ModuleType] = field(default_factory=list)
+    reads_data: bool = False
+
+    def code_version(self) -> str:
+        sources = [inspect.getsource(self.func)] + [inspect.getsource(m) for m in self.depends]
+        return hashlib.sha256("\n".join(sources).encode()).hexdigest()
+
+
+class Pipeline:
+    """
+    Runs a DAG of `Stage`s, reusing cached outputs whose key is unchanged.
+    """
+    def __init__(self, stages: List[Stage], cache_dir: str=DEFAULT_CACHE_DIR,
+                 watermark: Callable=data_watermark, workers: int=PIPELINE_WORKERS):
+        """
+        stages (List[Stage]): The stages, in any order.
+        cache_dir (str, optional): Where outputs are cached.
+        watermark (Callable, optional): Returns the current data watermark.
+        workers (int, optional): The number of stages run at once.
+        """
+        self.stages = {s.name: s for s in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        for s in stages:
+            missing = [i for i in s.inputs if i not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {s.name} has unknown inputs: {missing}")
+        self.order = self._toposort()
+        self.cache_dir = cache_dir
+        self.watermark = watermark
+        self.workers = workers
+        self.computed: List[str] = []
+
+    def _toposort(self) -> List[str]:
+        order, state = [], {}
+
+        def visit(name: str):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"The pipeline has a cycle through {name}")
+            state[name] = "visiting"
+            for i in self.stages[name].inputs:
+                visit(i)
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def upstream(self, targets: List[str]) -> List[str]:
+        """
+        Lists the targets and every stage they depend on, in run order.
+        """
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending += self.stages[name].inputs
+        return [name for name in self.order if name in needed]
+
+    def keys(self, names: List[str]=None) -> Dict[str, str]:
+        """
+        Computes the cache key of each stage. The watermark is only fetched
+        if a stage reads data.
+        """
+        names = self.order if names is None else self.upstream(names)
+        watermark = None
+        if any(self.stages[n].reads_data for n in names):
+            watermark = str(self.watermark())
+
+        keys = {}
+        for name in names:
+            s = self.stages[name]
+            h = hashlib.sha256()
+            h.update(name.encode())
+            h.update(s.code_version().encode())
+            h.update(json.dumps(s.params, sort_keys=True, default=str).encode())
+            for i in s.inputs:
+                h.update(keys[i].encode())
+            if s.reads_data:
+                h.update(watermark.encode())
+            keys[name] = h.hexdigest()[:32]
+        return keys
+
+    def _path(self, name: str, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{name}-{key}.pkl")
+
+    def _load(self, name: str, key: str):
+        with open(self._path(name, key), "rb") as f:
+            return pickle.load(f)
+
+    def _save(self, name: str, key: str, output):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(name, key)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(output, f)
+        os.replace(path + ".tmp", path)
+
+    def run(self, targets: List[str]=None, force: List[str]=[]) -> Dict:
+        """
+        Computes the outputs of `targets`, all stages by default. Stages
+        with a cached output are loaded instead, unless they are in `force`.
+        Stages that are only needed by cached stages are neither loaded nor
+        computed. The names of the computed stages are kept in `computed`.
+
+        Returns:
+            The output of each target, keyed by name.
+        """
+        targets = self.order if targets is None else targets
+        keys = self.keys(targets)
+
+        # Walk back from the targets, stopping at cached stages
+        compute, load = set(), set(targets)
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in compute:
+                continue
+            if name not in force and os.path.exists(self._path(name, keys[name])):
+                continue
+            compute.add(name)
+            load.update(self.stages[name].inputs)
+            pending += self.stages[name].inputs
+        load -= compute
+
+        outputs = {name: self._load(name, keys[name]) for name in load}
+        self.computed = []
+        remaining = [name for name in self.order if name in compute]
+        running = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            while remaining or running:
+                for name in [n for n in remaining
+                             if all(i in outputs for i in self.stages[n].inputs)]:
+                    s = self.stages[name]
+                    args = [outputs[i] for i in s.inputs]
+                    running[pool.submit(s.func, *args, **s.params)] = name
+                    remaining.remove(name)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs[name] = future.result()
+                    self._save(name, keys[name], outputs[name])
+                    self.computed.append(name)
+
+        return {name: outputs[name] for name in targets}
+
+    def prune(self) -> int:
+        """
+        Removes cached outputs whose key is no longer current.
+
+        Returns:
+            The number of files removed.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        current = {os.path.basename(self._path(n, k)) for n, k in self.keys().items()}
+        stale = [f for f in os.listdir(self.cache_dir) if f.endswith(".pkl") and f not in current]
+        for f in stale:
+            os.remove(os.path.join(self.cache_dir, f))
+        return len(stale)
+
+
+# The stages of notebooks/analysis.ipynb
+
+LABELS = {"cgr-public": "Chainguard", "ubi": "RedHat UBI", "docker-official": "Docker Official"}
+SEVERE = ["critical", "high"]
+
+
+def _images() -> List[Dict]:
+    return [{k: v for k, v in img.items() if k != "_id"} for img in fetch_images()]
+
+
+def _remediations(images: List[Dict], engine: str) -> RemediationTable:
+    return remediation.fetch_remediations(engine, images=images)
+
+
+def _resolve(table: RemediationTable) -> RemediationTable:
+    # Considers all CVEs seen on day 1 introduced on day 1
+    resolved = table.resolve_edge_cases(remediated_at=False)
+    return RemediationTable(resolved._df[resolved._df["fix_state"] != "wont-fix"])
+
+
+def _omit(table: RemediationTable, repositories: List[str]) -> RemediationTable:
+    df = table._df
+    return RemediationTable(df[~df["repository"].isin(repositories)])
+
+
+def _summarize(table: RemediationTable, labels: List[str]) -> pd.DataFrame:
+    rows = []
+    for label in labels:
+        label_tab = table.filter(label=label)
+        rem_df = label_tab.remediated()
+        severe = rem_df[rem_df["severity"].isin(SEVERE)]["rtime"]
+        rows.append({"label": label,
+                     "n_discovered": label_tab.discovered().shape[0],
+                     "n_remediated": rem_df.shape[0],
+                     "rtime_mean_days": rem_df["rtime"].mean() / 24,
+                     "rtime_median_days": rem_df["rtime"].median() / 24,
+                     "severe_rtime_mean_days": severe.mean() / 24,
+                     "severe_rtime_median_days": severe.median() / 24})
+    return pd.DataFrame(rows)
+
+
+def _rtime_hists(table: RemediationTable, severities: List[str]=None) -> Figure:
+    """
+    Plots the remediation time histogram of each label, with Chainguard
+    overlaid on the others.
+    """
+    df = table._df
+    if severities is not None:
+        table = RemediationTable(df[df["severity"].isin(severities)])
+
+    colors = {"cgr-public": "purple", "ubi": "red", "docker-official": "blue"}
+    fig = Figure(figsize=(15, 5))
+    axes = fig.subplots(nrows=1, ncols=len(LABELS))
+    chainguard = table.filter(label="cgr-public").remediated()["rtime"] / 24
+    for ax, (label, title) in zip(axes, LABELS.items()):
+        ax.hist(table.filter(label=label).remediated()["rtime"] / 24, color=colors[label])
+        if label != "cgr-public":
+            ax.hist(chainguard, color=colors["cgr-public"])
+        ax.set_title(title)
+    fig.supxlabel("Days")
+    fig.supylabel("Num CVE Matches")
+    fig.tight_layout()
+    return fig
+
+
+def read_omit_list(path: str) -> List[str]:
+    """
+    Reads the repositories to omit, e.g. `notebooks/omit.csv`.
+    """
+    return sorted(pd.read_csv(path)["repository"].unique().tolist())
+
+
+def analysis_pipeline(omit: List[str], engine: str="python", cache_dir: str=DEFAULT_CACHE_DIR,
+                      workers: int=PIPELINE_WORKERS) -> Pipeline:
+    """
+    Builds the pipeline of `notebooks/analysis.ipynb`: fetch images,
+    compute remediations, resolve edge cases, omit alpine-based images,
+    then summarize and plot in parallel.
+
+    Args:
+        omit (List[str]): The repositories to omit, see `read_omit_list`.
+        engine (str, optional): The remediation engine, see `fetch_remediations`.
+    """
+    stages = [
+        Stage("images", _images, depends=[fetch], reads_data=True),
+        Stage("remediations", _remediations, ["images"], {"engine": engine},
+              depends=[remediation, aggregation, stat, fetch], reads_data=True),
+        Stage("resolved", _resolve, ["remediations"], depends=[stat, fetch], reads_data=True),
+        Stage("omitted", _omit, ["resolved"], {"repositories": omit}),
+        Stage("summary", _summarize, ["omitted"], {"labels": list(LABELS)}, depends=[stat]),
+        Stage("rtime_hist", _rtime_hists, ["omitted"], depends=[stat]),
+        Stage("severe_rtime_hist", _rtime_hists, ["omitted"], {"severities": SEVERE}, depends=[stat]),
+    ]
+    return Pipeline(stages, cache_dir=cache_dir, workers=workers)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the analysis stages, reusing cached outputs")
+    parser.add_argument("targets", nargs="*", help="The stages to run. All by default")
+    parser.add_argument("--omit", default="../notebooks/omit.csv",
+                        help="A CSV of repositories to omit")
+    parser.add_argument("--engine", default="python", choices=["python", "mongo"],
+                        help="The remediation engine")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Where outputs are cached")
+    parser.add_argument("--force", action="append", default=[],
+                        help="Recompute a stage even if it is cached. May be repeated")
+    parser.add_argument("--out", help="Write summaries as CSV and figures as PNG to this directory")
+    parser.add_argument("--prune", action="store_true", help="Remove stale cached outputs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pipeline = analysis_pipeline(read_omit_list(args.omit), args.engine, args.cache_dir)
+    outputs = pipeline.run(args.targets or None, force=args.force)
+    print(f"Computed {pipeline.computed or 'nothing'}, "
+          f"reused {[n for n in pipeline.upstream(list(outputs)) if n not in pipeline.computed]}")
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for name, output in outputs.items():
+            if isinstance(output, Figure):
+                output.savefig(os.path.join(args.out, f"{name}.png"))
+            elif isinstance(output, pd.DataFrame):
+                output.to_csv(os.path.join(args.out, f"{name}.csv"), index=False)
+    if args.prune:
+        print(f"Removed {pipeline.prune()} stale outputs", file=sys.stderr)
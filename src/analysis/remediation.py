@@ -62,6 +62,7 @@ from tqdm import tqdm
 # Local
 from .stat import RemediationTable, Remediation, concat
 from .fetch import fetch_images, fetch_chainguard_images
+from . import aggregation
 
 
 @dataclass(frozen=True)
@@ -220,14 +221,26 @@ def _image_handler(image: dict, client: MongoClient) -> pd.DataFrame:
     return RemediationTable.from_remediations(image, remediations)
 
 
-def fetch_remediations() -> RemediationTable:
+def fetch_remediations(engine: str="python", images: List[Dict]=None) -> RemediationTable:
     """
     Fetches all scans from gallery and computes remediations.
 
+    Args:
+        engine (str, optional): `python` to compute remediations here, or
+                                `mongo` to compute them with an aggregation
+                                in MongoDB (see `aggregation.py`).
+        images (List[Dict], optional): Only compute the remediations of these
+                                       images, e.g. a sample (see `sample.py`).
+
     Returns:
         A `RemediationTable` of the remediations found.
     """
-    images = fetch_images()
+    if engine == "mongo":
+        return aggregation.fetch_remediations(images)
+    if engine != "python":
+        raise ValueError(f"Unknown remediation engine: {engine}")
+
+    images = fetch_images() if images is None else images
 
     # Having some issues with Mongo and multiprocess requests
     # Use sync fetch for now
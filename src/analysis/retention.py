@@ -0,0 +1,160 @@
+"""
+Retention job for downsampling old hourly scans.
+
+Scans newer than the retention window are kept at full hourly
+resolution. Older scans are reduced to:
+
+1) The first scan of the image.
+2) Every scan whose CVE set differs from the scan before it.
+3) The first scan of each UTC day (daily checkpoint).
+
+The remediation algorithm in `remediation.py` only reads timestamps at
+which the CVE set of an image changes, so the output of
+`_collect_image_remediations` over the downsampled scans is identical
+to the output over the full history.
+
+Run `python -m analysis.retention --help` from `src/` for usage.
+"""
+
+# Standard lib
+from typing import Dict, List, Iterable, Set
+import os
+import argparse
+from datetime import datetime, date, timedelta, timezone
+from dataclasses import dataclass
+
+# 3rd party
+import bson
+from pymongo import MongoClient, ASCENDING
+from tqdm import tqdm
+
+# Local
+from .remediation import _extract_cves
+from .fetch import fetch_images
+
+
+DEFAULT_WINDOW_DAYS = 30
+DELETE_BATCH_SIZE = 1000
+
+
+@dataclass
+class RetentionReport:
+    """
+    Summarizes the effect of a retention run.
+
+    n_images (int): The number of images processed.
+    n_scanned (int): The number of scans older than the cutoff.
+    n_removed (int): The number of scans removed (or that would be removed).
+    bytes_scanned (int): The BSON size of the scans older than the cutoff.
+    bytes_removed (int): The BSON size of the removed scans.
+    """
+    n_images: int = 0
+    n_scanned: int = 0
+    n_removed: int = 0
+    bytes_scanned: int = 0
+    bytes_removed: int = 0
+
+    def __str__(self) -> str:
+        p_removed = self.n_removed / self.n_scanned if self.n_scanned else 0
+        p_bytes = self.bytes_removed / self.bytes_scanned if self.bytes_scanned else 0
+        return (f"Images: {self.n_images}\n"
+                f"Scans past cutoff: {self.n_scanned}\n"
+                f"Scans removed: {self.n_removed} ({p_removed:.1%} fewer reads)\n"
+                f"Bytes removed: {self.bytes_removed} ({p_bytes:.1%} of {self.bytes_scanned})")
+
+
+def _day(scan: Dict) -> date:
+    return scan["scan_start"].date()
+
+
+def _select_removable(scans: Iterable[Dict]) -> List[Dict]:
+    """
+    Selects the scans that can be removed without changing the
+    remediations of the image. Scans must come from the same image
+    and be provided in order by scan time.
+
+    Args:
+        scans (Iterable[Dict]): The scans to downsample.
+
+    Returns:
+        The `List` of removable scans.
+    """
+    removable = []
+    prev_cves: Set = None
+    prev_day = None
+
+    for s in scans:
+        cves = _extract_cves(s)
+        day = _day(s)
+        changed = (prev_cves is None) or (cves != prev_cves)
+        checkpoint = day != prev_day
+        if not (changed or checkpoint):
+            removable.append(s)
+        prev_cves = cves
+        prev_day = day
+
+    return removable
+
+
+def _delete(collection, ids: List):
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        collection.delete_many({"_id": {"$in": ids[i:i + DELETE_BATCH_SIZE]}})
+
+
+def apply_retention(window_days: int=DEFAULT_WINDOW_DAYS,
+                    dry_run: bool=True) -> RetentionReport:
+    """
+    Downsamples all scans older than `window_days`.
+
+    Args:
+        window_days (int, optional): The number of recent days kept at full resolution.
+        dry_run (bool, optional): If `True`, only reports what would be removed.
+
+    Returns:
+        A `RetentionReport` of the space and read savings.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=window_days)
+    report = RetentionReport()
+    images = fetch_images()
+
+    with MongoClient(os.environ["MONGO_URI"]) as client:
+        collection = client["gallery"]["cves"]
+        for img in tqdm(images, desc="Applying retention"):
+            query = {
+                "registry": img["registry"],
+                "repository": img["repository"],
+                "tag": img["tag"],
+                "scan_start": {"$lt": cutoff}
+            }
+            scans = list(collection.find(query).sort([("scan_start", ASCENDING)]))
+            removable = _select_removable(scans)
+
+            report.n_images += 1
+            report.n_scanned += len(scans)
+            report.n_removed += len(removable)
+            report.bytes_scanned += sum(len(bson.encode(s)) for s in scans)
+            report.bytes_removed += sum(len(bson.encode(s)) for s in removable)
+
+            if not dry_run:
+                _delete(collection, [s["_id"] for s in removable])
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--window-days", "-w", type=int,
+                        default=DEFAULT_WINDOW_DAYS,
+                        help="Keep full hourly resolution for this many recent days")
+    parser.add_argument("--apply", action="store_true",
+                        help="Delete the downsampled scans. Without this flag, only a dry-run report is printed")
+    args = parser.parse_args()
+
+    report = apply_retention(args.window_days, dry_run=not args.apply)
+    if not args.apply:
+        print("Dry run. No scans were removed.")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
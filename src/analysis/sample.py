@@ -0,0 +1,167 @@
+"""
+Approximate analyses over a sample of images, for a quick look before
+a full run.
+
+Images are sampled without replacement within strata of registry and
+labels, at least two per stratum, so every stratum is represented and
+has a sampling variance even at small fractions. Each sampled image
+stands for `weight` images of its stratum. Estimates of `cve_stats`
+and the rtime mean and std weight the images accordingly, and their
+confidence intervals come from a stratified bootstrap over sampled
+images, since matches of the same image are not independent. The
+bootstrap is the rescaled bootstrap of Rao and Wu (1988), which draws
+n_h - 1 images per stratum and rescales by the stratum's sampling
+fraction. The bootstrap replicates are one matrix product.
+
+For example:
+
+    table, sample = fetch_sample(fraction=0.05)
+    estimate_stats(table, sample)
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple
+import random
+from dataclasses import dataclass
+
+# 3rd party
+import numpy as np
+import pandas as pd
+
+# Local
+from .stat import RemediationTable
+from .cube import MEASURES, cells_from_frame, derive_stats
+from .fetch import fetch_images
+from .remediation import fetch_remediations
+
+
+IMAGE_KEYS = ["registry", "repository", "tag"]
+
+
+@dataclass
+class ImageSample:
+    """
+    A stratified sample of images.
+
+    images (List[Dict]): The sampled images.
+    strata (List[Tuple]): The stratum of each sampled image.
+    weights (np.ndarray): The number of images each sampled image stands for.
+    fraction (float): The requested sampling fraction.
+    """
+    images: List[Dict]
+    strata: List[Tuple]
+    weights: np.ndarray
+    fraction: float
+
+
+def stratum(image: Dict) -> Tuple[str, str]:
+    labels = image.get("labels", None) or []
+    if isinstance(labels, str):
+        labels = labels.split(",")
+    return image["registry"], ",".join(sorted(labels))
+
+
+def sample_images(images: List[Dict], fraction: float, seed: int=0) -> ImageSample:
+    """
+    Samples `fraction` of the images of every stratum, and at least two,
+    or all of a stratum with fewer. The same images, seed and fraction
+    give the same sample.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError(f"The sampling fraction must be in (0, 1], got {fraction}")
+
+    by_stratum: Dict[Tuple, List[Dict]] = {}
+    for img in images:
+        by_stratum.setdefault(stratum(img), []).append(img)
+
+    rng = random.Random(seed)
+    sampled, strata, weights = [], [], []
+    for key in sorted(by_stratum):
+        members = sorted(by_stratum[key], key=lambda img: tuple(img[k] for k in IMAGE_KEYS))
+        n = min(len(members), max(2, round(fraction * len(members))))
+        sampled += rng.sample(members, n)
+        strata += [key] * n
+        weights += [len(members) / n] * n
+    return ImageSample(sampled, strata, np.array(weights), fraction)
+
+
+def fetch_sample(fraction: float=0.1, seed: int=0,
+                 engine: str="python") -> Tuple[RemediationTable, ImageSample]:
+    """
+    Computes the remediations of a stratified sample of the images.
+
+    Returns:
+        The sample's `RemediationTable` and the `ImageSample`.
+    """
+    sample = sample_images(fetch_images(), fraction, seed)
+    return fetch_remediations(engine, images=sample.images), sample
+
+
+def _image_measures(table: RemediationTable, sample: ImageSample) -> np.ndarray:
+    """
+    Sums the cube measures of each sampled image. Images without
+    remediations are rows of zeros.
+    """
+    cells = cells_from_frame(table._df)
+    sums = cells.groupby(IMAGE_KEYS)[MEASURES].sum()
+    keys = pd.MultiIndex.from_tuples([tuple(img[k] for k in IMAGE_KEYS) for img in sample.images],
+                                     names=IMAGE_KEYS)
+    return sums.reindex(keys, fill_value=0).to_numpy(dtype=float)
+
+
+def _bootstrap_weights(sample: ImageSample, n_boot: int, seed: int) -> np.ndarray:
+    """
+    Draws the weight multiplier of each sampled image in each replicate
+    with the Rao-Wu rescaled bootstrap. Returns an `n_boot` x `n_images`
+    matrix.
+
+    Each replicate draws n_h - 1 of the n_h images of a stratum with
+    replacement. The counts are rescaled to n_h / (n_h - 1) per draw and
+    shrunk towards 1 by sqrt(1 - f_h), where f_h is the stratum's
+    sampling fraction, so a stratum sampled in full does not vary.
+    """
+    rng = np.random.default_rng(seed)
+    strata, _ = pd.factorize(pd.Series(sample.strata, dtype=object))
+    multipliers = np.ones((n_boot, len(sample.images)))
+    for s in np.unique(strata):
+        members = np.flatnonzero(strata == s)
+        n = len(members)
+        # A stratum of one image is sampled in full
+        if n < 2:
+            continue
+        counts = rng.multinomial(n - 1, np.full(n, 1 / n), size=n_boot)
+        scale = np.sqrt(np.clip(1 - 1 / sample.weights[members], 0, 1))
+        multipliers[:, members] = 1 - scale + scale * counts * n / (n - 1)
+    return multipliers
+
+
+def estimate_stats(table: RemediationTable, sample: ImageSample, n_boot: int=1000,
+                   confidence: float=0.95, seed: int=0) -> pd.DataFrame:
+    """
+    Estimates the `cve_stats` of all images and the rtime mean and std
+    of their remediated matches from a sample, with bootstrap intervals.
+    Counts are estimates for all images, not the sample.
+
+    Args:
+        table (RemediationTable): The remediations of the sampled images.
+        sample (ImageSample): The sample.
+        n_boot (int, optional): The number of bootstrap replicates.
+        confidence (float, optional): The confidence level of the intervals.
+        seed (int, optional): The bootstrap seed.
+
+    Returns:
+        A `pd.DataFrame` indexed by stat with `estimate`, `low` and `high` columns.
+    """
+    measures = _image_measures(table, sample)
+    replicates = (_bootstrap_weights(sample, n_boot, seed) * sample.weights) @ measures
+    with np.errstate(divide="ignore", invalid="ignore"):
+        estimate = derive_stats(dict(zip(MEASURES, sample.weights @ measures)))
+        boot = derive_stats(dict(zip(MEASURES, replicates.T)))
+
+    tail = (1 - confidence) / 2 * 100
+    rows = {}
+    for stat, value in estimate.items():
+        low, high = np.nanpercentile(boot[stat], [tail, 100 - tail]) \
+            if np.any(~np.isnan(boot[stat])) else (np.nan, np.nan)
+        rows[stat] = {"estimate": float(value), "low": low, "high": high}
+    return pd.DataFrame.from_dict(rows, orient="index")
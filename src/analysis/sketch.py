@@ -0,0 +1,263 @@
+"""
+Mergeable quantile sketches of remediation times.
+
+`TDigest` is a merging t-digest: values are summarized by at most about
+`compression` centroids, packed densely in the tails (with the k1 scale
+function), so extreme quantiles stay accurate. Digests built on
+different workers, or by earlier runs, merge into a digest of all their
+values, so percentiles do not need the rows they were built from.
+
+`RtimeSketches` keeps one digest of `rtime` per group of a
+`RemediationTable` and answers percentile queries for any slice of the
+groups by merging their digests.
+"""
+
+# Standard lib
+from typing import Dict, Iterable, List, Tuple, Union
+import math
+import pickle
+
+# 3rd party
+import numpy as np
+import pandas as pd
+
+# Local
+from .stat import RemediationTable
+
+
+DEFAULT_COMPRESSION = 200
+
+
+class TDigest:
+    """
+    A t-digest. Use `from_values` to build one and `merge` to combine them.
+    """
+    def __init__(self, compression: float=DEFAULT_COMPRESSION,
+                 means: np.ndarray=None, weights: np.ndarray=None,
+                 min_: float=math.inf, max_: float=-math.inf):
+        """
+        compression (float, optional): Bounds the number of centroids. Higher is more accurate.
+        means (np.ndarray, optional): The centroid means, sorted.
+        weights (np.ndarray, optional): The centroid weights.
+        min_ (float, optional): The smallest value seen.
+        max_ (float, optional): The largest value seen.
+        """
+        self.compression = compression
+        self.means = np.empty(0) if means is None else np.asarray(means, dtype=float)
+        self.weights = np.empty(0) if weights is None else np.asarray(weights, dtype=float)
+        self.min = min_
+        self.max = max_
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def _k(self, q: np.ndarray) -> np.ndarray:
+        return self.compression / (2 * math.pi) * np.arcsin(2 * q - 1)
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        """
+        Merges centroids whose midpoints fall in the same unit of the
+        scale function. Vectorized, so a batch of values costs one sort.
+        """
+        if len(means) == 0:
+            return
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        mid = (np.cumsum(weights) - weights / 2) / total
+        bucket = np.floor(self._k(mid) - self._k(np.zeros(1))).astype(np.int64)
+
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        merged_weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / merged_weights
+        self.weights = merged_weights
+
+    def update(self, values: Iterable[float]):
+        """
+        Adds values to the digest. NaNs are ignored.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+
+    @classmethod
+    def from_values(cls, values: Iterable[float],
+                    compression: float=DEFAULT_COMPRESSION) -> "TDigest":
+        digest = cls(compression)
+        digest.update(values)
+        return digest
+
+    @classmethod
+    def merge_all(cls, digests: Iterable["TDigest"],
+                  compression: float=DEFAULT_COMPRESSION) -> "TDigest":
+        """
+        Merges digests into a new one with a single compression pass.
+        """
+        digests = [d for d in digests if d is not None and len(d.weights) > 0]
+        merged = cls(compression)
+        if len(digests) == 0:
+            return merged
+        merged.min = min(d.min for d in digests)
+        merged.max = max(d.max for d in digests)
+        merged._compress(np.concatenate([d.means for d in digests]),
+                         np.concatenate([d.weights for d in digests]))
+        return merged
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        return TDigest.merge_all([self, other], self.compression)
+
+    def copy(self) -> "TDigest":
+        return TDigest(self.compression, self.means.copy(), self.weights.copy(), self.min, self.max)
+
+    def quantile(self, q: Union[float, List[float]]) -> Union[float, np.ndarray]:
+        """
+        Estimates quantiles by interpolating between centroid midpoints.
+        Returns NaN for an empty digest.
+        """
+        qs = np.asarray(q, dtype=float)
+        if len(self.weights) == 0:
+            return np.full(qs.shape, np.nan) if qs.ndim else math.nan
+
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.r_[0, centers, total]
+        values = np.r_[self.min, self.means, self.max]
+        result = np.interp(qs * total, positions, values)
+        return result if qs.ndim else float(result)
+
+    def to_dict(self) -> Dict:
+        return {"compression": self.compression,
+                "means": self.means.tolist(),
+                "weights": self.weights.tolist(),
+                "min": self.min,
+                "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "TDigest":
+        return cls(d["compression"], d["means"], d["weights"], d["min"], d["max"])
+
+
+def _matches(dim: str, actual, wanted) -> bool:
+    if dim == "labels":
+        # Matches `RemediationTable.filter`, which checks if the labels contain it
+        return isinstance(actual, str) and wanted in actual
+    if isinstance(wanted, (list, tuple, set)):
+        return actual in wanted
+    return actual == wanted
+
+
+class RtimeSketches:
+    """
+    A `TDigest` of the rtime of remediated matches per group.
+    """
+    def __init__(self, groups: List[str], compression: float=DEFAULT_COMPRESSION,
+                 digests: Dict[Tuple, TDigest]=None):
+        """
+        groups (List[str]): The columns of a `RemediationTable` to group by.
+        compression (float, optional): The compression of the digests.
+        digests (Dict, optional): The digest of each group, keyed by its values.
+        """
+        self.groups = list(groups)
+        self.compression = compression
+        self.digests = {} if digests is None else digests
+        self._cache: Dict[Tuple, TDigest] = {}
+
+    @classmethod
+    def from_table(cls, table: RemediationTable, groups: List[str],
+                   compression: float=DEFAULT_COMPRESSION) -> "RtimeSketches":
+        sketches = cls(groups, compression)
+        sketches.add_table(table)
+        return sketches
+
+    def add_table(self, table: RemediationTable):
+        """
+        Adds the remediated matches of a table, for example one image's
+        table at a time. Tables are read in one pass.
+        """
+        df = table.remediated()
+        df = df[df["rtime"].notna()]
+        for key, rtime in df.groupby(self.groups, dropna=False)["rtime"]:
+            key = key if isinstance(key, tuple) else (key,)
+            key = tuple(None if pd.isna(v) else v for v in key)
+            digest = self.digests.setdefault(key, TDigest(self.compression))
+            digest.update(rtime.to_numpy())
+        self._cache.clear()
+
+    def merge(self, other: "RtimeSketches") -> "RtimeSketches":
+        """
+        Merges sketches with the same groups, e.g. from parallel workers
+        or an earlier run. This operation is not in-place, and the
+        result shares no digests with the inputs.
+        """
+        if other.groups != self.groups:
+            raise ValueError(f"Cannot merge sketches grouped by {other.groups} into {self.groups}")
+        digests = {key: digest.copy() for key, digest in self.digests.items()}
+        for key, digest in other.digests.items():
+            digests[key] = digest.copy() if key not in digests else digests[key].merge(digest)
+        return RtimeSketches(self.groups, self.compression, digests)
+
+    def digest(self, **filters) -> TDigest:
+        """
+        The merged digest of the groups matching `filters`, given as
+        `group=value` or `group=[values]`.
+        """
+        unknown = set(filters) - set(self.groups)
+        if len(unknown) > 0:
+            raise ValueError(f"Not grouped by: {sorted(unknown)}")
+
+        key = tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple, set)) else v)
+                           for k, v in filters.items()))
+        if key not in self._cache:
+            index = {g: i for i, g in enumerate(self.groups)}
+            digests = [d for k, d in self.digests.items()
+                       if all(_matches(g, k[index[g]], v) for g, v in filters.items())]
+            self._cache[key] = TDigest.merge_all(digests, self.compression)
+        return self._cache[key]
+
+    def quantile(self, q: Union[float, List[float]], **filters) -> Union[float, np.ndarray]:
+        return self.digest(**filters).quantile(q)
+
+    def summary(self, quantiles: List[float]=[0.5, 0.9], groups: List[str]=None) -> pd.DataFrame:
+        """
+        Tabulates the count and `quantiles` of each group, rolled up to
+        `groups` (a subset of the sketch's groups) if given.
+
+        Returns:
+            A `pd.DataFrame` with the group columns, `n_rtime` and a
+            `rtime_p<percent>` column per quantile.
+        """
+        groups = self.groups if groups is None else groups
+        index = [self.groups.index(g) for g in groups]
+        rolled: Dict[Tuple, List[TDigest]] = {}
+        for key, digest in self.digests.items():
+            rolled.setdefault(tuple(key[i] for i in index), []).append(digest)
+
+        rows = []
+        for key, digests in rolled.items():
+            digest = TDigest.merge_all(digests, self.compression)
+            row = dict(zip(groups, key))
+            row["n_rtime"] = int(digest.count)
+            for q, value in zip(quantiles, np.atleast_1d(digest.quantile(quantiles))):
+                row[f"rtime_p{q * 100:g}"] = value
+            rows.append(row)
+        columns = groups + ["n_rtime"] + [f"rtime_p{q * 100:g}" for q in quantiles]
+        return pd.DataFrame(rows, columns=columns)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump({"groups": self.groups,
+                         "compression": self.compression,
+                         "digests": [(k, d.to_dict()) for k, d in self.digests.items()]}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "RtimeSketches":
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        digests = {k: TDigest.from_dict(d) for k, d in state["digests"]}
+        return cls(state["groups"], state["compression"], digests)
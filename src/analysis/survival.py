@@ -0,0 +1,192 @@
+"""
+Kaplan-Meier estimates of time-to-remediate that account for matches
+whose start or end was not observed, instead of filling them in like
+`RemediationTable.resolve_edge_cases`.
+
+Each match is a subject with an origin, an entry and an exit, in hours:
+
+- Discovered matches (`first_seen_at` known) start at `first_seen_at`
+  and enter at 0.
+- Preexisting matches (`first_seen_at=None`) were already present at
+  the image's first scan. Their origin is the first time the CVE was
+  discovered in any image, if that is earlier, and they enter the risk
+  set when the image was first scanned (left truncation). Without an
+  earlier discovery, they start at the image's first scan.
+- Remediated matches exit with an event at `remediated_at`. Residual
+  matches (`remediated_at=None`) exit without one at the latest scan
+  (right censoring).
+
+The product-limit estimate is computed per group with NumPy over the
+sorted entry, exit and event times.
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple
+from datetime import datetime
+from dataclasses import dataclass
+
+# 3rd party
+import numpy as np
+import pandas as pd
+
+# Local
+from .stat import RemediationTable
+from .fetch import global_latest_scan, image_first_scan, images_first_scan
+
+
+@dataclass
+class SurvivalCurve:
+    """
+    A Kaplan-Meier curve of the share of matches not yet remediated.
+
+    times (np.ndarray): The distinct remediation times, in hours.
+    survival (np.ndarray): The share not remediated just after each time.
+    at_risk (np.ndarray): The number of matches at risk at each time.
+    events (np.ndarray): The number of remediations at each time.
+    n (int): The number of matches.
+    """
+    times: np.ndarray
+    survival: np.ndarray
+    at_risk: np.ndarray
+    events: np.ndarray
+    n: int
+
+    def median(self) -> float:
+        """
+        The first time at which half the matches are remediated, or NaN
+        if fewer than half are by the end of the observations.
+        """
+        below = np.flatnonzero(self.survival <= 0.5)
+        return float(self.times[below[0]]) if len(below) > 0 else np.nan
+
+    def at(self, hours) -> np.ndarray:
+        """
+        The share of matches not yet remediated after `hours`.
+        """
+        i = np.searchsorted(self.times, np.asarray(hours, dtype=float), side="right")
+        return np.r_[1.0, self.survival][i]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({"time": self.times, "survival": self.survival,
+                             "at_risk": self.at_risk, "events": self.events})
+
+
+def kaplan_meier(entry: np.ndarray, exit: np.ndarray, event: np.ndarray) -> SurvivalCurve:
+    """
+    Computes the product-limit estimate for left-truncated, right-censored times.
+    A subject is at risk at time `t` if `entry < t <= exit`.
+
+    Args:
+        entry (np.ndarray): When each subject enters the risk set.
+        exit (np.ndarray): When each subject is remediated or censored.
+        event (np.ndarray): `True` if the subject was remediated at `exit`.
+
+    Returns:
+        A `SurvivalCurve`
+    """
+    entry, exit = np.asarray(entry, dtype=float), np.asarray(exit, dtype=float)
+    event = np.asarray(event, dtype=bool)
+    times, events = np.unique(exit[event], return_counts=True)
+
+    entered = np.searchsorted(np.sort(entry), times, side="left")
+    exited = np.searchsorted(np.sort(exit), times, side="left")
+    at_risk = entered - exited
+    survival = np.cumprod(1 - events / at_risk)
+    return SurvivalCurve(times, survival, at_risk, events, len(exit))
+
+
+def _hours(delta: pd.Series) -> np.ndarray:
+    return delta.dt.total_seconds().to_numpy() / 3600
+
+
+def survival_times(table: RemediationTable, first_scans: Dict[Tuple[str, str], datetime]=None,
+                   censor_at: datetime=None) -> pd.DataFrame:
+    """
+    Computes the entry, exit and event of every match of a table, in hours
+    from the match's origin. All rows are computed at once.
+
+    Args:
+        table (RemediationTable): The remediations, before `resolve_edge_cases`.
+        first_scans (Dict, optional): The first scan of each (registry, repository).
+                                      Fetched with `images_first_scan` if not given.
+                                      Images missing from it are fetched with `image_first_scan`.
+        censor_at (datetime, optional): When residual matches are censored.
+                                        Defaults to the latest scan.
+
+    Returns:
+        The table's `pd.DataFrame` with `entry`, `exit` and `event` columns.
+        Rows whose exit is not after their entry are dropped.
+    """
+    first_scans = images_first_scan() if first_scans is None else first_scans
+    censor_at = global_latest_scan() if censor_at is None else censor_at
+
+    df = table._df.copy()
+    first_seen = pd.to_datetime(df["first_seen_at"])
+    remediated = pd.to_datetime(df["remediated_at"])
+    scans = pd.DataFrame([(r, p, t) for (r, p), t in first_scans.items()],
+                         columns=["registry", "repository", "image_first_scan"])
+    image_first = df[["registry", "repository"]].merge(scans, how="left",
+                                                       on=["registry", "repository"])
+    image_first = pd.to_datetime(image_first["image_first_scan"]).set_axis(df.index)
+
+    # Images missing from `first_scans` are looked up one at a time, like `resolve_edge_cases`
+    missing = image_first.isna()
+    if missing.any():
+        images = df.loc[missing, ["registry", "repository", "tag"]].drop_duplicates(["registry", "repository"])
+        fallback = {(img["registry"], img["repository"]): image_first_scan(img)
+                    for img in images.to_dict("records")}
+        keys = pd.Series(list(zip(df["registry"], df["repository"])), index=df.index)
+        image_first = image_first.fillna(pd.to_datetime(keys[missing].map(fallback)))
+
+    # A preexisting match is at least as old as the first discovery of its CVE
+    cve_first = first_seen.groupby(df["id"]).transform("min")
+    origin = first_seen.fillna(cve_first.where(cve_first < image_first, image_first))
+    end = remediated.fillna(pd.Timestamp(censor_at))
+
+    df["entry"] = np.where(first_seen.isna(), _hours(image_first - origin), 0.0)
+    df["exit"] = _hours(end - origin)
+    df["event"] = remediated.notna().to_numpy()
+    return df[df["exit"] > df["entry"]]
+
+
+def survival_curves(table: RemediationTable, groups: List[str]=None,
+                    first_scans: Dict[Tuple[str, str], datetime]=None,
+                    censor_at: datetime=None) -> Dict[Tuple, SurvivalCurve]:
+    """
+    Estimates a survival curve for every group of a table in one pass.
+    See `survival_times` for `first_scans` and `censor_at`.
+
+    Args:
+        groups (List[str], optional): The columns to group by. Defaults to `["registry"]`.
+
+    Returns:
+        The `SurvivalCurve` of each group, keyed by the group's values.
+    """
+    groups = ["registry"] if groups is None else groups
+    df = survival_times(table, first_scans, censor_at)
+    entry, exit, event = df["entry"].to_numpy(), df["exit"].to_numpy(), df["event"].to_numpy()
+    curves = {}
+    for key, rows in df.groupby(groups, dropna=False).indices.items():
+        key = key if isinstance(key, tuple) else (key,)
+        curves[key] = kaplan_meier(entry[rows], exit[rows], event[rows])
+    return curves
+
+
+def median_rtime(table: RemediationTable, groups: List[str]=None,
+                 first_scans: Dict[Tuple[str, str], datetime]=None,
+                 censor_at: datetime=None) -> pd.DataFrame:
+    """
+    Tabulates the Kaplan-Meier median time-to-remediate of every group.
+    Takes the arguments of `survival_curves`.
+
+    Returns:
+        A `pd.DataFrame` with the group columns, the number of matches `n`,
+        the number remediated `n_remediated` and `median_rtime` in hours.
+    """
+    groups = ["registry"] if groups is None else groups
+    curves = survival_curves(table, groups, first_scans, censor_at)
+    rows = [{**dict(zip(groups, key)),
+             "n": c.n,
+             "n_remediated": int(c.events.sum()),
+             "median_rtime": c.median()} for key, c in curves.items()]
+    return pd.DataFrame(rows, columns=groups + ["n", "n_remediated", "median_rtime"])
@@ -0,0 +1,256 @@
+"""
+Seeded generator of synthetic scan histories for benchmarking the
+analysis.
+
+Scans have the shape of gallery.cves documents. Every image starts
+with a Poisson number of CVE matches and then changes in two ways:
+
+1) New advisories add matches at `discovery_rate` matches per day.
+2) Rebuilds, at `rebuild_rate` per scan, remediate each match with
+   probability `remediation_rate` and pull in half as many new ones
+   as they would remediate from a fresh image.
+
+Most consecutive scans of an image are therefore identical, as in the
+real data. Severities are drawn per CVE from `severity_mix` and fix
+states per match from `fix_state_mix`.
+
+Each image has its own random stream derived from the seed, so any
+image's history can be regenerated on its own and histories are
+streamed one scan at a time. Consecutive scans share their match
+dicts, which must not be modified.
+
+Run `python -m analysis.synthetic --help` from `src/` to load a history
+into MongoDB.
+"""
+
+# Standard lib
+from typing import Dict, List, Iterator, Tuple
+import os
+import math
+import random
+import argparse
+from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+
+# 3rd party
+from pymongo import MongoClient
+
+
+SEVERITY_MIX = {"critical": 0.03, "high": 0.17, "medium": 0.45,
+                "low": 0.25, "negligible": 0.05, "unknown": 0.05}
+FIX_STATE_MIX = {"fixed": 0.6, "not-fixed": 0.3, "wont-fix": 0.05, "unknown": 0.05}
+REGISTRIES = ["cgr.dev", "docker.io"]
+PACKAGE_TYPES = ["apk", "deb", "python", "java-archive", "go-module", "npm"]
+
+
+@dataclass
+class HistoryConfig:
+    """
+    Parameters of a synthetic scan history.
+
+    n_images (int): The number of images.
+    days (int): The length of the history.
+    interval_hours (int): The time between scans of an image.
+    start (datetime): The first scan time.
+    initial_cves (float): The mean number of matches at an image's first scan.
+    discovery_rate (float): The mean number of matches added per image per day.
+    rebuild_rate (float): The probability that an image was rebuilt before a scan.
+    remediation_rate (float): The share of matches a rebuild remediates.
+    late_start (float): The share of images first scanned after `start`.
+    n_cves (int): The size of the CVE ID pool.
+    n_packages (int): The size of the package pool.
+    severity_mix (Dict): Weights of the CVE severities.
+    fix_state_mix (Dict): Weights of the match fix states.
+    seed (int): The random seed.
+    """
+    n_images: int = 1000
+    days: int = 90
+    interval_hours: int = 1
+    start: datetime = datetime(2024, 1, 1)
+    initial_cves: float = 40
+    discovery_rate: float = 1
+    rebuild_rate: float = 0.02
+    remediation_rate: float = 0.3
+    late_start: float = 0.1
+    n_cves: int = 5000
+    n_packages: int = 500
+    severity_mix: Dict[str, float] = field(default_factory=lambda: dict(SEVERITY_MIX))
+    fix_state_mix: Dict[str, float] = field(default_factory=lambda: dict(FIX_STATE_MIX))
+    seed: int = 0
+
+    @property
+    def n_scans(self) -> int:
+        """
+        The number of scans of an image that is scanned from `start`.
+        """
+        return self.days * 24 // self.interval_hours
+
+    @property
+    def end(self) -> datetime:
+        """
+        The last scan time.
+        """
+        return self.start + timedelta(hours=(self.n_scans - 1) * self.interval_hours)
+
+
+def _poisson(rng: random.Random, lam: float) -> int:
+    if lam <= 0:
+        return 0
+    if lam > 30:
+        return max(0, round(rng.gauss(lam, math.sqrt(lam))))
+    # Knuth's method
+    threshold, k, p = math.exp(-lam), 0, rng.random()
+    while p > threshold:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+class _Pools:
+    """
+    The CVEs and packages matches are drawn from. Shared by all images.
+    """
+    def __init__(self, config: HistoryConfig):
+        rng = random.Random(f"{config.seed}:pools")
+        severities, weights = zip(*config.severity_mix.items())
+        self.cves = [(f"CVE-{2014 + i % 10}-{10000 + i}", s)
+                     for i, s in enumerate(rng.choices(severities, weights, k=config.n_cves))]
+        self.packages = [(f"pkg-{i}", rng.choice(PACKAGE_TYPES)) for i in range(config.n_packages)]
+        self.fix_states, self.fix_weights = zip(*config.fix_state_mix.items())
+
+    def match(self, rng: random.Random) -> Dict:
+        cve_id, severity = rng.choice(self.cves)
+        name, type_ = rng.choice(self.packages)
+        return {
+            "id": cve_id,
+            "severity": severity,
+            "fix_state": rng.choices(self.fix_states, self.fix_weights)[0],
+            "component": {
+                "name": name,
+                "version": f"{rng.randint(0, 5)}.{rng.randint(0, 20)}.{rng.randint(0, 9)}",
+                "type_": type_
+            }
+        }
+
+
+def synthetic_images(config: HistoryConfig) -> List[Dict]:
+    """
+    Generates the images of a history as gallery.images documents.
+    """
+    rng = random.Random(f"{config.seed}:images")
+    images = []
+    for i in range(config.n_images):
+        registry = REGISTRIES[i % len(REGISTRIES)]
+        images.append({
+            "registry": registry,
+            "repository": f"synthetic/image-{i}",
+            "tag": "latest",
+            "labels": ["chainguard" if registry == "cgr.dev" else "docker",
+                       rng.choice(["base", "runtime", "devel"])]
+        })
+    return images
+
+
+def _first_scan_offset(config: HistoryConfig, index: int) -> int:
+    """
+    The number of scans an image misses at the start of the history.
+    """
+    rng = random.Random(f"{config.seed}:offset:{index}")
+    if rng.random() >= config.late_start:
+        return 0
+    return rng.randrange(config.n_scans)
+
+
+def image_scans(config: HistoryConfig, image: Dict, index: int,
+                pools: _Pools=None) -> Iterator[Dict]:
+    """
+    Streams the scans of the `index`-th image in order by `scan_start`.
+    """
+    pools = _Pools(config) if pools is None else pools
+    rng = random.Random(f"{config.seed}:scans:{index}")
+    discovery = config.discovery_rate * config.interval_hours / 24
+
+    matches = [pools.match(rng) for _ in range(_poisson(rng, config.initial_cves))]
+    for n in range(_first_scan_offset(config, index), config.n_scans):
+        if rng.random() < config.rebuild_rate:
+            kept = [m for m in matches if rng.random() >= config.remediation_rate]
+            added = _poisson(rng, config.remediation_rate * config.initial_cves / 2)
+            matches = kept + [pools.match(rng) for _ in range(added)]
+        added = _poisson(rng, discovery)
+        if added > 0:
+            matches = matches + [pools.match(rng) for _ in range(added)]
+
+        yield {**image,
+               "scan_start": config.start + timedelta(hours=n * config.interval_hours),
+               "cves": matches}
+
+
+def synthetic_history(config: HistoryConfig) -> Iterator[Tuple[Dict, Iterator[Dict]]]:
+    """
+    Streams every image with an iterator over its scans.
+    """
+    pools = _Pools(config)
+    for index, image in enumerate(synthetic_images(config)):
+        yield image, image_scans(config, image, index, pools)
+
+
+def first_scans(config: HistoryConfig) -> Dict[Tuple[str, str], datetime]:
+    """
+    The first scan time of every image, keyed like `fetch.images_first_scan`.
+    """
+    return {(image["registry"], image["repository"]):
+            config.start + timedelta(hours=_first_scan_offset(config, i) * config.interval_hours)
+            for i, image in enumerate(synthetic_images(config))}
+
+
+def load(config: HistoryConfig, client: MongoClient, db_name: str, batch_size: int=1000) -> int:
+    """
+    Inserts a history into the `images` and `cves` collections of `db_name`.
+
+    Returns:
+        The number of scans inserted.
+    """
+    db = client[db_name]
+    n_scans = 0
+    for image, scans in synthetic_history(config):
+        db["images"].insert_one(dict(image))
+        batch = []
+        for scan in scans:
+            batch.append(scan)
+            if len(batch) == batch_size:
+                db["cves"].insert_many(batch, ordered=False)
+                n_scans += len(batch)
+                batch = []
+        if len(batch) > 0:
+            db["cves"].insert_many(batch, ordered=False)
+            n_scans += len(batch)
+    return n_scans
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load a synthetic scan history into MongoDB")
+    parser.add_argument("--images", type=int, default=100, help="The number of images")
+    parser.add_argument("--days", type=int, default=30, help="The length of the history in days")
+    parser.add_argument("--rebuild-rate", type=float, default=0.02,
+                        help="The probability that an image was rebuilt before a scan")
+    parser.add_argument("--discovery-rate", type=float, default=1,
+                        help="The mean number of matches added per image per day")
+    parser.add_argument("--seed", type=int, default=0, help="The random seed")
+    parser.add_argument("--db", default="gallery_synthetic",
+                        help="The database to load into. Never the production database")
+    parser.add_argument("--drop", action="store_true",
+                        help="Drop the database before loading")
+    args = parser.parse_args()
+    if args.db == "gallery":
+        parser.error("Refusing to load synthetic scans into the gallery database")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = HistoryConfig(n_images=args.images, days=args.days, rebuild_rate=args.rebuild_rate,
+                           discovery_rate=args.discovery_rate, seed=args.seed)
+    with MongoClient(os.environ["MONGO_URI"]) as client:
+        if args.drop:
+            client.drop_database(args.db)
+        print(f"Inserted {load(config, client, args.db)} scans into {args.db}")
@@ -0,0 +1,123 @@
+"""
+Queries over the open CVE rollups the scanner maintains in
+gallery.open_cves (see `src/scanner/rollup.py`).
+
+Rollups hold the open matches of each image at its latest scan in each
+hour and day, so a trend is one small aggregation no matter how long
+the scan history is. For example, the open critical matches of each
+cgr.dev image per day:
+
+    open_cves(registry="cgr.dev", severities=["critical"], by=["repository"])
+
+Run `python src/scanner/rollup.py` to build rollups for scans stored
+before they were maintained.
+"""
+
+# Standard lib
+from typing import List
+import os
+from datetime import datetime
+
+# 3rd party
+import pandas as pd
+from pymongo import MongoClient
+from pymongo.collection import Collection
+
+# Local
+
+
+ROLLUP_DIMENSIONS = ["registry", "repository", "tag", "severity", "fix_state"]
+
+# Flattens {<severity>: {<fix_state>: n}} into [{severity, fix_state, n}]
+_FLAT_COUNTS = {
+    "$reduce": {
+        "input": {"$objectToArray": "$counts"},
+        "initialValue": [],
+        "in": {"$concatArrays": ["$$value", {
+            "$map": {"input": {"$objectToArray": "$$this.v"},
+                     "as": "f",
+                     "in": {"severity": "$$this.k", "fix_state": "$$f.k", "n": "$$f.v"}}
+        }]}
+    }
+}
+
+
+def trend_pipeline(granularity: str="day", start: datetime=None, end: datetime=None,
+                   registry: str=None, repository: str=None, tag: str=None,
+                   severities: List[str]=None, fix_states: List[str]=None,
+                   by: List[str]=None) -> List[dict]:
+    """
+    Builds the aggregation over gallery.open_cves behind `open_cves`.
+    """
+    by = [] if by is None else by
+    unknown = set(by) - set(ROLLUP_DIMENSIONS)
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown dimensions: {sorted(unknown)}")
+
+    query = {"granularity": granularity}
+    if start is not None or end is not None:
+        query["bucket"] = {}
+        if start is not None:
+            query["bucket"]["$gte"] = start
+        if end is not None:
+            query["bucket"]["$lt"] = end
+    for key, value in [("registry", registry), ("repository", repository), ("tag", tag)]:
+        if value is not None:
+            query[key] = value
+
+    pipeline = [{"$match": query}]
+    group = {"bucket": "$bucket", **{k: f"${k}" for k in by if k in ["registry", "repository", "tag"]}}
+
+    if severities is None and fix_states is None and "severity" not in by and "fix_state" not in by:
+        # The total is stored, so the counts need not be unpacked
+        pipeline.append({"$group": {"_id": group, "open": {"$sum": "$total"}}})
+    else:
+        pipeline += [{"$project": {"bucket": 1, "registry": 1, "repository": 1, "tag": 1,
+                                   "c": _FLAT_COUNTS}},
+                     {"$unwind": "$c"}]
+        if severities is not None:
+            pipeline.append({"$match": {"c.severity": {"$in": severities}}})
+        if fix_states is not None:
+            pipeline.append({"$match": {"c.fix_state": {"$in": fix_states}}})
+        group.update({k: f"$c.{k}" for k in by if k in ["severity", "fix_state"]})
+        pipeline.append({"$group": {"_id": group, "open": {"$sum": "$c.n"}}})
+
+    pipeline.append({"$sort": {"_id.bucket": 1}})
+    return pipeline
+
+
+def open_cves(granularity: str="day", start: datetime=None, end: datetime=None,
+              registry: str=None, repository: str=None, tag: str=None,
+              severities: List[str]=None, fix_states: List[str]=None,
+              by: List[str]=None, collection: Collection=None) -> pd.DataFrame:
+    """
+    Counts the open CVE matches per hour or day.
+
+    Args:
+        granularity (str, optional): `hour` or `day`.
+        start (datetime, optional): The first bucket.
+        end (datetime, optional): The bucket after the last.
+        registry (str, optional): The registry to count.
+        repository (str, optional): The repository to count.
+        tag (str, optional): The tag to count.
+        severities (List[str], optional): The severities to count.
+        fix_states (List[str], optional): The fix states to count.
+        by (List[str], optional): Dimensions to break the counts down by, from
+                                  `registry`, `repository`, `tag`, `severity` and `fix_state`.
+        collection (Collection, optional): The rollups. Defaults to gallery.open_cves.
+
+    Returns:
+        A `pd.DataFrame` with a `bucket` column, a column per `by` dimension,
+        and the `open` count, sorted by `bucket`.
+    """
+    pipeline = trend_pipeline(granularity, start, end, registry, repository, tag,
+                              severities, fix_states, by)
+    if collection is None:
+        with MongoClient(os.environ["MONGO_URI"]) as client:
+            results = list(client["gallery"]["open_cves"].aggregate(pipeline))
+    else:
+        results = list(collection.aggregate(pipeline))
+
+    columns = ["bucket"] + (by or []) + ["open"]
+    rows = [{**d["_id"], "open": d["open"]} for d in results]
+    return pd.DataFrame(rows, columns=columns)
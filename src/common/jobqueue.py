@@ -0,0 +1,172 @@
+"""
+The MongoDB work queue between the publisher and scanner workers
+(`QUEUE_BACKEND=mongo`). The publisher pushes scan jobs with
+`MongoJobPusher` and scanner workers (`src/scanner/worker.py`) claim
+them in batches with `MongoJobClaimer`.
+
+Jobs live in gallery.scan_queue:
+
+    {_id, data, state: "ready" | "dead", visible_at, attempts, lease_id,
+     created_at, trace, last_error}
+
+The `_id` of a job is its idempotency key when one is provided, so the
+same image is only queued once per scheduling window.
+
+A claimed job stays invisible until `visible_at`. If a worker dies
+without acknowledging it, the job becomes visible again and is retried.
+A job is deleted when acknowledged. Failed jobs are retried with
+exponential backoff and marked `dead` after `max_attempts`.
+
+This module is shared by the publisher and scanner images.
+"""
+
+# Standard lib
+from typing import Dict, List
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# 3rd party
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+# Local
+from tracing import inject
+
+
+JOB_QUEUE_COLLECTION_NAME = "scan_queue"
+
+READY = "ready"
+DEAD = "dead"
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def new_job(data: Dict, now: datetime, trace: Dict[str, str]) -> Dict:
+    """
+    Builds the document of a job that is visible at `now`.
+    """
+    job = {"data": data,
+           "state": READY,
+           "visible_at": now,
+           "attempts": 0,
+           "lease_id": None,
+           "created_at": now,
+           "trace": trace}
+    if data.get("idempotency_key", None) is not None:
+        job["_id"] = data["idempotency_key"]
+    return job
+
+
+def ensure_indexes(collection: Collection):
+    collection.create_index([("state", ASCENDING), ("visible_at", ASCENDING)])
+    collection.create_index("lease_id")
+
+
+class MongoJobPusher:
+    """
+    The push side of the queue, used by the publisher.
+    """
+    def __init__(self, collection: Collection):
+        """
+        collection (Collection): The collection holding queued jobs.
+        """
+        self.collection = collection
+
+    def push_many(self, items: List[Dict]):
+        """
+        Enqueues `items` with a single `insert_many`. Items whose
+        idempotency key is already queued are skipped.
+        """
+        if len(items) == 0:
+            return
+        now = datetime.now(timezone.utc)
+        trace = inject()
+        jobs = [new_job(data, now, trace) for data in items]
+
+        try:
+            self.collection.insert_many(jobs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err["code"] != DUPLICATE_KEY_ERROR for err in errors):
+                raise
+
+
+class MongoJobClaimer:
+    """
+    The claim side of the queue, used by scanner workers.
+    """
+    def __init__(self, collection: Collection, visibility_timeout: float,
+                 max_attempts: int=16, max_backoff: float=300):
+        """
+        collection (Collection): The collection holding queued jobs.
+        visibility_timeout (float): Seconds a claimed job stays hidden from other workers.
+        max_attempts (int, optional): Attempts before a job is marked `dead`.
+        max_backoff (float, optional): The upper bound of the retry backoff in seconds.
+        """
+        self.collection = collection
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+
+    def ensure_indexes(self):
+        ensure_indexes(self.collection)
+
+    def claim(self, n: int) -> List[Dict]:
+        """
+        Claims up to `n` visible jobs under one lease in three round trips,
+        whatever `n` is: find candidates, lease them with one `update_many`,
+        and read back the ones this lease won. Candidates claimed by another
+        worker in between no longer match the update and are skipped, so
+        fewer than `n` jobs may be returned while more are visible.
+
+        Returns:
+            The claimed jobs. Empty if the queue has no visible jobs.
+        """
+        lease_id = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        visible = {"state": READY, "visible_at": {"$lte": now}}
+        candidates = [job["_id"] for job in self.collection.find(visible, {"_id": 1})
+                                                          .sort("visible_at", ASCENDING)
+                                                          .limit(n)]
+        if len(candidates) == 0:
+            return []
+
+        self.collection.update_many(
+            {"_id": {"$in": candidates}, **visible},
+            {"$set": {"lease_id": lease_id,
+                      "visible_at": now + timedelta(seconds=self.visibility_timeout)},
+             "$inc": {"attempts": 1}})
+        return list(self.collection.find({"lease_id": lease_id}).sort("created_at", ASCENDING))
+
+    def ack(self, job: Dict):
+        """
+        Deletes a finished job. Does nothing if the lease has expired
+        and another worker claimed the job.
+        """
+        self.collection.delete_one({"_id": job["_id"], "lease_id": job["lease_id"]})
+
+    def fail(self, job: Dict, error: str):
+        """
+        Makes a failed job visible again after a backoff, or marks it
+        `dead` once it has used all of its attempts.
+        """
+        update = {"last_error": error, "lease_id": None}
+        if job["attempts"] >= self.max_attempts:
+            update["state"] = DEAD
+        else:
+            backoff = min(2 ** job["attempts"], self.max_backoff)
+            update["visible_at"] = datetime.now(timezone.utc) + timedelta(seconds=backoff)
+        self.collection.update_one({"_id": job["_id"], "lease_id": job["lease_id"]},
+                                   {"$set": update})
+
+    def defer(self, job: Dict, delay: float):
+        """
+        Releases a job without counting the attempt, making it visible
+        again after `delay` seconds.
+        """
+        self.collection.update_one(
+            {"_id": job["_id"], "lease_id": job["lease_id"]},
+            {"$set": {"lease_id": None,
+                      "visible_at": datetime.now(timezone.utc) + timedelta(seconds=delay)},
+             "$inc": {"attempts": -1}})
@@ -0,0 +1,141 @@
+"""
+Tracing across the publisher -> scanner -> parser hops.
+
+Trace context travels in W3C `traceparent` headers on Cloud Tasks
+requests and in the `trace` field of MongoDB queue jobs, so one publish
+run is a single trace covering every scan it enqueued.
+
+Spans are exported when TRACE_EXPORTER is set:
+
+    file  Appends one JSON span per line to TRACE_FILE.
+          Summarize with `python scripts/trace_report.py <TRACE_FILE>`.
+    otlp  Sends spans to the OTLP/HTTP collector at OTEL_EXPORTER_OTLP_ENDPOINT.
+
+Otherwise spans are no-ops and OpenTelemetry is never imported, to
+keep cold starts short.
+
+This module is shared by the publisher and scanner images.
+"""
+
+# Standard lib
+from typing import Dict, Iterator, Mapping
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+# 3rd party
+# opentelemetry is imported on first use, and only if TRACE_EXPORTER is set
+
+
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", None)
+TRACE_FILE = os.environ.get("TRACE_FILE", "spans.jsonl")
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class _NoopSpan:
+    """
+    Stands in for a span when tracing is off.
+    """
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_attributes(self, attributes: Dict):
+        pass
+
+    def record_exception(self, exception: Exception):
+        pass
+
+
+class _Tracer:
+    """
+    Starts spans on the OpenTelemetry "gallery" tracer, or no-op spans
+    when TRACE_EXPORTER is unset.
+    """
+    @contextmanager
+    def start_as_current_span(self, name: str, context=None, attributes: Dict=None) -> Iterator:
+        if TRACE_EXPORTER is None:
+            yield _NoopSpan()
+            return
+
+        from opentelemetry import trace
+        with trace.get_tracer("gallery").start_as_current_span(
+                name, context=context, attributes=attributes) as span:
+            yield span
+
+
+tracer = _Tracer()
+
+
+def span_to_json(span) -> str:
+    """
+    Formats a finished span as one line of the TRACE_FILE.
+    """
+    context = span.get_span_context()
+    return json.dumps({
+        "trace_id": format(context.trace_id, "032x"),
+        "span_id": format(context.span_id, "016x"),
+        "parent_id": None if span.parent is None else format(span.parent.span_id, "016x"),
+        "name": span.name,
+        "service": span.resource.attributes.get("service.name"),
+        "start": span.start_time / 1e9,
+        "end": span.end_time / 1e9,
+        "status": span.status.status_code.name,
+        "attributes": dict(span.attributes)
+    }) + "\n"
+
+
+def setup_tracing(service_name: str):
+    """
+    Installs the span exporter selected by TRACE_EXPORTER. Safe to call
+    more than once. OTEL_SERVICE_NAME overrides `service_name`.
+    """
+    global _configured
+    with _configure_lock:
+        if _configured or TRACE_EXPORTER is None:
+            return
+
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+        if TRACE_EXPORTER == "file":
+            exporter = ConsoleSpanExporter(out=open(TRACE_FILE, "a", encoding="utf-8"),
+                                           formatter=span_to_json)
+        elif TRACE_EXPORTER == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter()
+        else:
+            raise ValueError(f"Unknown TRACE_EXPORTER `{TRACE_EXPORTER}`")
+
+        service_name = os.environ.get("OTEL_SERVICE_NAME", service_name)
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _configured = True
+
+
+def inject(carrier: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Adds the current trace context to `carrier` (HTTP headers or a job field).
+    """
+    carrier = {} if carrier is None else carrier
+    if TRACE_EXPORTER is not None:
+        from opentelemetry import propagate
+        propagate.inject(carrier)
+    return carrier
+
+
+def extract(carrier: Mapping[str, str]):
+    """
+    Reads the trace context written by `inject`. Returns an empty
+    context, which starts a new trace, if there is none, or `None`
+    when tracing is off.
+    """
+    if TRACE_EXPORTER is None:
+        return None
+    from opentelemetry import propagate
+    return propagate.extract({} if carrier is None else carrier)
@@ -1,46 +1,176 @@
 # Standard lib
-from typing import Dict
+from typing import Dict, List, Callable
 import os
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 import uuid
+import hashlib
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 # 3rd party
-from google.cloud import tasks_v2
-import google.oauth2.id_token
-import google.auth.transport.requests
-from pymongo import MongoClient
-from pymongo.cursor import Cursor
+# google-cloud-tasks, google-auth and pymongo are imported on first use
+# to keep cold starts short
 from flask import Flask, jsonify
 
 # Local
-from monitor import ProgressMonitor, ProgressReport
+from tracing import tracer, setup_tracing, inject
 
 
 MONGO_DB_NAME = "gallery"
 MONGO_COLLECTION_NAME = "images"
-MONGO_URI = os.environ["MONGO_URI"] # TODO: Better error handling for missing env
+MONGO_PACKAGES_COLLECTION_NAME = "packages"
+MONGO_DB_UPDATES_COLLECTION_NAME = "db_updates"
+MONGO_RUNS_COLLECTION_NAME = "publish_runs"
+MONGO_SHARDS_COLLECTION_NAME = "publish_shards"
+MONGO_URI = os.environ.get("MONGO_URI", None)
 
-CLOUD_PROJECT_NAME = os.environ["CLOUD_PROJECT_NAME"] 
-CLOUD_QUEUE_LOCATION = os.environ["CLOUD_QUEUE_LOCATION"]
-CLOUD_QUEUE_NAME = os.environ["CLOUD_QUEUE_NAME"]
+CLOUD_PROJECT_NAME = os.environ.get("CLOUD_PROJECT_NAME", None)
+CLOUD_QUEUE_LOCATION = os.environ.get("CLOUD_QUEUE_LOCATION", None)
+CLOUD_QUEUE_NAME = os.environ.get("CLOUD_QUEUE_NAME", None)
 
-SCANNER_URL = os.environ["SCANNER_URL"]
+SCANNER_URL = os.environ.get("SCANNER_URL", None)
+
+# "cloud-tasks" pushes one HTTP task per image to the scanner.
+# "mongo" queues jobs in MongoDB for scanner workers to claim.
+QUEUE_BACKEND = os.environ.get("QUEUE_BACKEND", "cloud-tasks")
+QUEUE_BATCH_SIZE = 500
+
+# Each publish run is split into `_id`-range shards of the catalog
+# that PUBLISH_WORKERS threads enqueue in parallel
+PUBLISH_SHARD_SIZE = int(os.environ.get("PUBLISH_SHARD_SIZE", 2000))
+PUBLISH_WORKERS = int(os.environ.get("PUBLISH_WORKERS", 8))
+SHARD_LEASE_SECS = float(os.environ.get("SHARD_LEASE_SECS", 300))
+
+# A claimed grype DB update is retried by a later /rescan if it is not
+# completed within this lease
+DB_UPDATE_LEASE_SECS = float(os.environ.get("DB_UPDATE_LEASE_SECS", 300))
+
+# Identity tokens are valid for an hour
+AUTH_TOKEN_TTL_SECS = 45 * 60
+
+# Package index entries not refreshed by a scan within this window are
+# ignored when selecting images to rescan
+PACKAGE_INDEX_MAX_AGE = timedelta(days=2)
 
 app = Flask(__name__)
+_mongo_client = None
+_mongo_client_lock = threading.Lock()
+_auth_token = (None, 0.0)
+_auth_token_lock = threading.Lock()
+
+setup_tracing("publisher")
+
+
+def missing_env() -> List[str]:
+    """
+    Lists the required environment variables that are not set.
+    """
+    required = ["MONGO_URI"]
+    if QUEUE_BACKEND == "cloud-tasks":
+        required += ["CLOUD_PROJECT_NAME", "CLOUD_QUEUE_LOCATION",
+                     "CLOUD_QUEUE_NAME", "SCANNER_URL"]
+    return [name for name in required if globals()[name] is None]
+
+
+def get_mongo_client():
+    """
+    Returns the process-wide `MongoClient`, creating it on first use.
+    """
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is None:
+            from pymongo import MongoClient
+            _mongo_client = MongoClient(MONGO_URI)
+        return _mongo_client
 
 
 def get_auth_token() -> str:
-    audience = SCANNER_URL
-    client = google.auth.transport.requests.Request()
-    id_token = google.oauth2.id_token.fetch_id_token(client, audience)
-    return id_token
+    """
+    Returns an identity token for the scanner. Tokens are reused
+    for `AUTH_TOKEN_TTL_SECS` instead of being fetched per task.
+    """
+    import google.oauth2.id_token
+    import google.auth.transport.requests
+
+    global _auth_token
+    with _auth_token_lock:
+        id_token, fetched_at = _auth_token
+        if id_token is None or time.monotonic() - fetched_at > AUTH_TOKEN_TTL_SECS:
+            audience = SCANNER_URL
+            client = google.auth.transport.requests.Request()
+            id_token = google.oauth2.id_token.fetch_id_token(client, audience)
+            _auth_token = (id_token, time.monotonic())
+        return id_token
+
+
+def get_catalog(client):
+    from shards import ShardedCatalog
+
+    db = client[MONGO_DB_NAME]
+    catalog = ShardedCatalog(db[MONGO_COLLECTION_NAME],
+                             db[MONGO_RUNS_COLLECTION_NAME],
+                             db[MONGO_SHARDS_COLLECTION_NAME],
+                             shard_size=PUBLISH_SHARD_SIZE,
+                             lease_secs=SHARD_LEASE_SECS)
+    catalog.ensure_indexes()
+    return catalog
 
 
-def fetch_images(client) -> Cursor:
+def claim_db_update(client) -> Dict:
+    """
+    Leases the oldest unprocessed grype DB update recorded by the scanner
+    for `DB_UPDATE_LEASE_SECS`. Updates whose lease expired, e.g. after a
+    crash, are claimed again. Returns `None` if there is none.
+    """
+    from pymongo import ASCENDING
+
+    now = datetime.now(timezone.utc)
+    collection = client[MONGO_DB_NAME][MONGO_DB_UPDATES_COLLECTION_NAME]
+    return collection.find_one_and_update(
+        {"processed": False,
+         "$or": [{"leased_until": {"$exists": False}}, {"leased_until": {"$lt": now}}]},
+        {"$set": {"leased_until": now + timedelta(seconds=DB_UPDATE_LEASE_SECS)}},
+        sort=[("recorded_at", ASCENDING)])
+
+
+def complete_db_update(update: Dict, client):
+    """
+    Marks a claimed grype DB update processed once its images are enqueued.
+    Images enqueued again after an expired lease keep their idempotency keys,
+    so they are not scanned twice.
+    """
+    collection = client[MONGO_DB_NAME][MONGO_DB_UPDATES_COLLECTION_NAME]
+    collection.update_one({"_id": update["_id"]},
+                          {"$set": {"processed": True, "processed_at": datetime.now(timezone.utc)},
+                           "$unset": {"leased_until": ""}})
+
+
+def fetch_affected_images(packages: List[Dict], client) -> List[Dict]:
+    """
+    Looks up the images containing any of `packages` in the package index.
+    Packages match on name, version and type.
+    """
+    if len(packages) == 0:
+        return []
     db = client[MONGO_DB_NAME]
-    collection = db[MONGO_COLLECTION_NAME]
-    return collection.find()
+    since = datetime.now(timezone.utc) - PACKAGE_INDEX_MAX_AGE
+    exact = [{"name": p["name"], "version": p["version"], "type_": p["type_"]} for p in packages]
+    pipeline = [
+        {"$match": {"$or": exact, "last_seen": {"$gte": since}}},
+        {"$group": {"_id": {"registry": "$registry",
+                            "repository": "$repository",
+                            "tag": "$tag"}}}
+    ]
+    from shards import IMAGE_PROJECTION
+
+    keys = [r["_id"] for r in db[MONGO_PACKAGES_COLLECTION_NAME].aggregate(pipeline)]
+    if len(keys) == 0:
+        return []
+    return list(db[MONGO_COLLECTION_NAME].find({"$or": keys}, IMAGE_PROJECTION))
 
 
 def validate_image(image: Dict):
@@ -48,17 +178,40 @@ def validate_image(image: Dict):
     pass
 
 
+def scheduling_window(now: datetime=None) -> str:
+    """
+    The hourly scheduling window a publish run belongs to.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    return now.strftime("%Y%m%d%H")
+
+
+def get_idempotency_key(image: Dict, window: str) -> str:
+    """
+    Derives a deterministic key from an image and scheduling window.
+    Used as the task name and stored with the scan so retries and
+    duplicate publishes are rejected.
+    """
+    name = f"{image['registry']}/{image['repository']}:{image['tag']}@{window}"
+    return hashlib.sha256(name.encode()).hexdigest()[:32]
+
+
 def push_task(data: Dict, client):
     """
-    Push `record` to cloud tasks.
+    Push `record` to cloud tasks. Tasks named after an existing
+    task are rejected by the queue and skipped.
     """
-    task_id = str(uuid.uuid4())
+    from google.cloud import tasks_v2
+    from google.api_core.exceptions import AlreadyExists
+
+    task_id = data.get("idempotency_key", None) or str(uuid.uuid4())
     task_path = client.task_path(CLOUD_PROJECT_NAME, CLOUD_QUEUE_LOCATION, CLOUD_QUEUE_NAME, task_id)
 
-    headers = {
+    headers = inject({
         "Content-type": "application/json",
         "Authorization": f"Bearer {get_auth_token()}"
-    }
+    })
 
     task = tasks_v2.Task(
         http_request=tasks_v2.HttpRequest(
@@ -69,25 +222,169 @@ def push_task(data: Dict, client):
         name=task_path
     )
 
-    client.create_task(
-        tasks_v2.CreateTaskRequest(
-            parent=client.queue_path(CLOUD_PROJECT_NAME, CLOUD_QUEUE_LOCATION, CLOUD_QUEUE_NAME),
-            task=task,
+    try:
+        client.create_task(
+            tasks_v2.CreateTaskRequest(
+                parent=client.queue_path(CLOUD_PROJECT_NAME, CLOUD_QUEUE_LOCATION, CLOUD_QUEUE_NAME),
+                task=task,
+            )
         )
-    )
+    except AlreadyExists:
+        pass
 
 
-@app.route("/", methods=["POST"])
-def main():
-    images = fetch_images(MongoClient(MONGO_URI))
+class CloudTasksQueue:
+    """
+    Pushes each item as a Cloud Tasks HTTP task to the scanner.
+    """
+    def __init__(self):
+        from google.cloud import tasks_v2
+        self.client = tasks_v2.CloudTasksClient()
+
+    def push_many(self, items: List[Dict]):
+        for data in items:
+            push_task(data, self.client)
+
+
+def get_queue(client):
+    if QUEUE_BACKEND == "mongo":
+        from jobqueue import MongoJobPusher, JOB_QUEUE_COLLECTION_NAME
+        return MongoJobPusher(client[MONGO_DB_NAME][JOB_QUEUE_COLLECTION_NAME])
+    if QUEUE_BACKEND == "cloud-tasks":
+        return CloudTasksQueue()
+    raise ValueError(f"Unknown QUEUE_BACKEND `{QUEUE_BACKEND}`")
+
+
+def enqueue_images(images, queue, window: str,
+                   checkpoint: Callable[[Dict, int], None]=None) -> int:
+    """
+    Pushes scan jobs for `images` in batches of `QUEUE_BATCH_SIZE`.
+    Each job carries an idempotency key derived from `window`.
+    `checkpoint` is called with the last image and size of each pushed batch.
+
+    Returns:
+        The number of images enqueued.
+    """
+    n_images = 0
+    batch = []
+    img = None
     for img in images:
         validate_image(img)
-        scan_args = {
-            "registry": img["registry"],
-            "repository": img["repository"],
-            "tag": img["tag"],
-            "labels": img["labels"]
-        }
-        push_task(scan_args, tasks_v2.CloudTasksClient())
-
-    return jsonify({"message": "success"}), 200
+        batch.append(get_scan_args(img, window))
+        if len(batch) >= QUEUE_BATCH_SIZE:
+            push_batch(batch, queue)
+            if checkpoint is not None:
+                checkpoint(img, len(batch))
+            n_images += len(batch)
+            batch = []
+    push_batch(batch, queue)
+    if checkpoint is not None and len(batch) > 0:
+        checkpoint(img, len(batch))
+    return n_images + len(batch)
+
+
+def publish_shards(catalog, queue, window: str) -> int:
+    """
+    Claims and enqueues shards of `window` until none are left.
+
+    Returns:
+        The number of images enqueued.
+    """
+    from shards import LeaseLost
+
+    n_images = 0
+    shard = catalog.claim(window)
+    while shard is not None:
+        with tracer.start_as_current_span("shard", attributes={"gallery.shard": shard["_id"]}):
+            try:
+                n_images += enqueue_images(
+                    catalog.read(shard, QUEUE_BATCH_SIZE), queue, window,
+                    checkpoint=lambda img, n: catalog.checkpoint(shard, img["_id"], n))
+                catalog.complete(shard)
+            except LeaseLost as e:
+                # Another worker resumed the shard from its last checkpoint
+                logging.warning(str(e))
+        shard = catalog.claim(window)
+    return n_images
+
+
+def push_batch(batch: List[Dict], queue):
+    if len(batch) == 0:
+        return
+    # Scans continue the trace from the span of the batch that enqueued them
+    with tracer.start_as_current_span("enqueue_batch", attributes={"gallery.images": len(batch)}):
+        queue.push_many(batch)
+
+
+def get_scan_args(image: Dict, window: str) -> Dict:
+    return {
+        "registry": image["registry"],
+        "repository": image["repository"],
+        "tag": image["tag"],
+        "labels": image["labels"],
+        "idempotency_key": get_idempotency_key(image, window)
+    }
+
+
+def error(message: str, status_code: int):
+    return jsonify({"error": message}), status_code
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    missing = missing_env()
+    if len(missing) > 0:
+        return error(f"Missing environment variables: {', '.join(missing)}", 503)
+    return jsonify({"message": "ready"}), 200
+
+
+@app.route("/", methods=["POST"])
+def main():
+    missing = missing_env()
+    if len(missing) > 0:
+        return error(f"Missing environment variables: {', '.join(missing)}", 500)
+
+    window = scheduling_window()
+    with tracer.start_as_current_span("publish", attributes={"gallery.window": window}) as span:
+        client = get_mongo_client()
+        catalog = get_catalog(client)
+        catalog.plan(window)
+        queue = get_queue(client)
+
+        # Each worker needs its own copy of the context to continue the trace
+        with ThreadPoolExecutor(PUBLISH_WORKERS) as pool:
+            futures = [pool.submit(contextvars.copy_context().run,
+                                   publish_shards, catalog, queue, window)
+                       for _ in range(PUBLISH_WORKERS)]
+            n_images = sum(f.result() for f in futures)
+        progress = catalog.progress(window)
+        span.set_attribute("gallery.images", n_images)
+
+    # Shards still `ready` are leased by a concurrent or interrupted run
+    # and are picked up by the next call for this window
+    return jsonify({"message": "success", "images": n_images, "progress": progress}), 200
+
+
+@app.route("/rescan", methods=["POST"])
+def rescan():
+    """
+    Enqueues only the images affected by grype DB updates
+    recorded since the last call.
+    """
+    missing = missing_env()
+    if len(missing) > 0:
+        return error(f"Missing environment variables: {', '.join(missing)}", 500)
+
+    with tracer.start_as_current_span("rescan") as span:
+        client = get_mongo_client()
+        queue = get_queue(client)
+        n_images = 0
+        update = claim_db_update(client)
+        while update is not None:
+            n_images += enqueue_images(fetch_affected_images(update["packages"], client), queue,
+                                       f"db-{update['_id']}")
+            complete_db_update(update, client)
+            update = claim_db_update(client)
+        span.set_attribute("gallery.images", n_images)
+
+    return jsonify({"message": "success", "images": n_images}), 200
@@ -0,0 +1,174 @@
+"""
+Splits a publish run over the image catalog into `_id`-range shards so
+that several workers, or several publisher requests, can enqueue it in
+parallel and an interrupted run resumes where it stopped.
+
+Run documents in gallery.publish_runs fix the shard bounds of a window:
+
+    {_id: window, bounds: [ObjectId, ...], created_at}
+
+Shard documents in gallery.publish_shards:
+
+    {_id: "<window>:<n>", window, lower, upper, last_id, images,
+     state: "ready" | "done", lease_id, leased_until, created_at}
+
+A shard covers `lower <= _id < upper` (`None` is unbounded). Workers
+claim shards with a lease and checkpoint `last_id` after every batch.
+A shard whose lease expired is claimed again and continues after
+`last_id`. Jobs are idempotent per window, so re-enqueueing the images
+of a batch that was pushed but not checkpointed is harmless.
+"""
+
+# Standard lib
+from typing import Dict, Iterable, List
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# 3rd party
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+
+# The fields `get_scan_args` reads
+IMAGE_PROJECTION = {"registry": 1, "repository": 1, "tag": 1, "labels": 1}
+
+# Run and shard documents are only needed while a run is in progress
+CHECKPOINT_TTL_SECS = 7 * 24 * 3600
+
+
+class LeaseLost(RuntimeError):
+    """
+    Raised when a shard's lease expired and another worker claimed it.
+    """
+
+
+class ShardedCatalog:
+    """
+    Plans, claims and checkpoints the shards of publish runs.
+    """
+    def __init__(self, images: Collection, runs: Collection, shards: Collection,
+                 shard_size: int, lease_secs: float):
+        """
+        images (Collection): The image catalog.
+        runs (Collection): The collection holding run documents.
+        shards (Collection): The collection holding shard documents.
+        shard_size (int): The number of images per shard.
+        lease_secs (float): Seconds a claimed shard is held without a checkpoint.
+        """
+        self.images = images
+        self.runs = runs
+        self.shards = shards
+        self.shard_size = shard_size
+        self.lease_secs = lease_secs
+
+    def ensure_indexes(self):
+        self.shards.create_index([("window", ASCENDING), ("state", ASCENDING)])
+        self.runs.create_index("created_at", expireAfterSeconds=CHECKPOINT_TTL_SECS)
+        self.shards.create_index("created_at", expireAfterSeconds=CHECKPOINT_TTL_SECS)
+
+    def _bounds(self) -> List:
+        """
+        Every `shard_size`-th `_id` of the catalog. Only reads the `_id` index.
+        """
+        bounds = []
+        cursor = self.images.find({}, {"_id": 1}, sort=[("_id", ASCENDING)], batch_size=10000)
+        for i, image in enumerate(cursor):
+            if i > 0 and i % self.shard_size == 0:
+                bounds.append(image["_id"])
+        return bounds
+
+    def plan(self, window: str) -> int:
+        """
+        Creates the shards of `window` unless they exist. Concurrent
+        calls agree on the bounds stored by the first one.
+
+        Returns:
+            The number of shards.
+        """
+        now = datetime.now(timezone.utc)
+        run = self.runs.find_one({"_id": window})
+        if run is None:
+            try:
+                self.runs.insert_one({"_id": window, "bounds": self._bounds(), "created_at": now})
+            except DuplicateKeyError:
+                pass
+            run = self.runs.find_one({"_id": window})
+        bounds = run["bounds"]
+
+        edges = [None] + bounds + [None]
+        ops = [UpdateOne({"_id": f"{window}:{n}"},
+                         {"$setOnInsert": {"window": window,
+                                           "lower": edges[n],
+                                           "upper": edges[n + 1],
+                                           "last_id": None,
+                                           "images": 0,
+                                           "state": "ready",
+                                           "lease_id": None,
+                                           "leased_until": now,
+                                           "created_at": now}},
+                         upsert=True)
+               for n in range(len(edges) - 1)]
+        self.shards.bulk_write(ops, ordered=False)
+        return len(ops)
+
+    def claim(self, window: str) -> Dict:
+        """
+        Claims an unfinished shard of `window` whose lease is free.
+        Returns `None` if there is none.
+        """
+        now = datetime.now(timezone.utc)
+        return self.shards.find_one_and_update(
+            {"window": window, "state": "ready", "leased_until": {"$lte": now}},
+            {"$set": {"lease_id": uuid.uuid4().hex,
+                      "leased_until": now + timedelta(seconds=self.lease_secs)}},
+            return_document=ReturnDocument.AFTER)
+
+    def read(self, shard: Dict, batch_size: int) -> Iterable[Dict]:
+        """
+        Streams the projected images of a shard after its checkpoint, in `_id` order.
+        """
+        id_range = {}
+        if shard["last_id"] is not None:
+            id_range["$gt"] = shard["last_id"]
+        elif shard["lower"] is not None:
+            id_range["$gte"] = shard["lower"]
+        if shard["upper"] is not None:
+            id_range["$lt"] = shard["upper"]
+        query = {"_id": id_range} if len(id_range) > 0 else {}
+        return self.images.find(query, IMAGE_PROJECTION,
+                                sort=[("_id", ASCENDING)], batch_size=batch_size)
+
+    def checkpoint(self, shard: Dict, last_id, n_images: int):
+        """
+        Records that the images of a shard up to `last_id` were enqueued
+        and extends the lease.
+
+        Raises:
+            `LeaseLost` if another worker claimed the shard.
+        """
+        result = self.shards.update_one(
+            {"_id": shard["_id"], "lease_id": shard["lease_id"]},
+            {"$set": {"last_id": last_id,
+                      "leased_until": datetime.now(timezone.utc) + timedelta(seconds=self.lease_secs)},
+             "$inc": {"images": n_images}})
+        if result.matched_count == 0:
+            raise LeaseLost(f"Lost the lease on shard {shard['_id']}")
+
+    def complete(self, shard: Dict):
+        self.shards.update_one({"_id": shard["_id"], "lease_id": shard["lease_id"]},
+                               {"$set": {"state": "done", "lease_id": None}})
+
+    def progress(self, window: str) -> Dict:
+        """
+        Counts the shards of `window` by state and the images enqueued so far.
+        """
+        pipeline = [
+            {"$match": {"window": window}},
+            {"$group": {"_id": "$state", "shards": {"$sum": 1}, "images": {"$sum": "$images"}}}
+        ]
+        progress = {"ready": 0, "done": 0, "images": 0}
+        for state in self.shards.aggregate(pipeline):
+            progress[state["_id"]] = state["shards"]
+            progress["images"] += state["images"]
+        return progress
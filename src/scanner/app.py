@@ -2,23 +2,68 @@
 from typing import Dict, Tuple, List
 import os
 import json
+import tempfile
 from datetime import datetime, timezone
 import logging
+import threading
 from dataclasses import dataclass, asdict
 
 # 3rd Party
 # import google.cloud.logging
-from pymongo import MongoClient
-from sh import grype, ErrorReturnCode
-from gryft.scanning.report import GrypeReport
+# sh and gryft are imported on first use to keep cold starts short
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import DuplicateKeyError
 from flask import Flask, request, jsonify
 
+# Local
+from blob import LocalBlobStore
+from grypedb import GrypeDB, get_db
+from index import update_package_index, record_db_update, read_sbom
+from distro import report_distro, report_digest, record_distro
+from rollup import update_rollups
+from ratelimit import RegistryRateLimiter, Throttled
+from layercache import get_layer_cache
+from tracing import tracer, setup_tracing, extract
+
 
 MONGO_DB_NAME = "gallery"
 MONGO_COLLECTION_NAME = "cves"
+MONGO_RATE_LIMITS_COLLECTION_NAME = "rate_limits"
 MONGO_URI = os.environ.get("MONGO_URI", None)
 
+# If set, raw grype output is written to BLOB_DIR and parsed
+# by the parser service instead of inline.
+PARSE_QUEUE_NAME = os.environ.get("PARSE_QUEUE_NAME", None)
+BLOB_DIR = os.environ.get("BLOB_DIR", "/tmp/gallery-blobs")
+
+SCAN_TIMEOUT_SECS = float(os.environ.get("SCAN_TIMEOUT_SECS", 600))
+
+# Only scans that carry an idempotency key are covered by the unique index
+IDEMPOTENCY_INDEX = {
+    "keys": "idempotency_key",
+    "unique": True,
+    "partialFilterExpression": {"idempotency_key": {"$type": "string"}}
+}
+
+# Marks a stored scan whose package index, distro and rollup writes are
+# not done yet, with the SBOM packages they need. A retry of the scan
+# finishes them. Removed once they are written.
+PENDING_WRITES_FIELD = "pending_writes"
+
+# The history of each image in time order, which the remediation
+# aggregation of src/analysis/aggregation.py reads
+SCAN_HISTORY_INDEX = {
+    "keys": [("registry", ASCENDING), ("repository", ASCENDING), ("tag", ASCENDING),
+             ("scan_start", ASCENDING)]
+}
+
 app = Flask(__name__)
+_indexes_ensured = False
+_mongo_client: MongoClient = None
+_mongo_client_lock = threading.Lock()
+_rate_limiter: RegistryRateLimiter = None
+
+setup_tracing("scanner")
 
 
 @dataclass
@@ -27,6 +72,7 @@ class ScanArgs:
     repository: str
     tag: str
     labels: List[str]
+    idempotency_key: str = None
 
 
 def parse_args(json_data: Dict) -> ScanArgs:
@@ -50,7 +96,8 @@ def parse_args(json_data: Dict) -> ScanArgs:
         raise ValueError("Missing `labels` field"
                          )
     return ScanArgs(registry=registry, repository=repository,
-                    tag=tag, labels=labels)
+                    tag=tag, labels=labels,
+                    idempotency_key=json_data.get("idempotency_key", None))
 
 
 def error(e: Exception, status_code: int) -> Tuple[Dict, int]:
@@ -58,19 +105,91 @@ def error(e: Exception, status_code: int) -> Tuple[Dict, int]:
     return jsonify({"error": str(e)}), status_code
 
 
-def scan_image(args: ScanArgs) -> Dict:
+def grype_db() -> GrypeDB:
+    return get_db(on_update=record_db_update)
+
+
+def get_rate_limiter(client: MongoClient) -> RegistryRateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RegistryRateLimiter(client[MONGO_DB_NAME][MONGO_RATE_LIMITS_COLLECTION_NAME])
+    return _rate_limiter
+
+
+def span_attributes(args: ScanArgs) -> Dict[str, str]:
+    return {"gallery.image": f"{args.registry}/{args.repository}:{args.tag}",
+            "gallery.idempotency_key": args.idempotency_key or ""}
+
+
+def get_mongo_client() -> MongoClient:
+    """
+    Returns the process-wide `MongoClient`, creating it on first use.
+    Returns `None` if MONGO_URI is not set.
+    """
+    global _mongo_client
+    if MONGO_URI is None:
+        return None
+    with _mongo_client_lock:
+        if _mongo_client is None:
+            _mongo_client = MongoClient(MONGO_URI)
+        return _mongo_client
+
+
+def grype_outputs(sbom_path: str) -> List[str]:
+    """
+    The report goes to stdout and the image's CycloneDX SBOM, which lists
+    every package for the package index, to `sbom_path`.
+    """
+    return ["--output", "json", "--output", f"cyclonedx-json={sbom_path}"]
+
+
+def run_grype(args: ScanArgs) -> Tuple[str, List[Dict]]:
+    """
+    Scans an image.
+
+    Returns:
+        The raw grype report and the image's packages (see `index.sbom_packages`).
+    """
+    from sh import grype, ErrorReturnCode, TimeoutException
+
     endpoint = f"{args.registry}/{args.repository}:{args.tag}"
+    cache = get_layer_cache()
+    layout = None
+    if cache is not None:
+        with tracer.start_as_current_span("layer_cache"):
+            layout = cache.prepare(args.registry, args.repository, args.tag)
+        endpoint = f"oci-dir:{layout}"
     try:
-        # TODO: Add timeout
-        json_str = grype(endpoint, "--output", "json")
-        return json.loads(json_str)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sbom_path = os.path.join(tmp_dir, "sbom.json")
+            raw = str(grype(endpoint, *grype_outputs(sbom_path), _timeout=SCAN_TIMEOUT_SECS,
+                            _env=grype_db().env()))
+            return raw, read_sbom(sbom_path)
     except ErrorReturnCode as e:
         raise RuntimeError(f"Error running grype: {e.stderr}")
+    except TimeoutException:
+        raise RuntimeError(f"grype timed out after {SCAN_TIMEOUT_SECS}s")
+    finally:
+        if layout is not None:
+            cache.release(layout)
 
 
-def store_scan(scan: Dict, scan_start: datetime, scan_duration: float, args: ScanArgs, client: MongoClient):
-    db = client[MONGO_DB_NAME]
-    collection = db[MONGO_COLLECTION_NAME]
+def scan_image(args: ScanArgs) -> Dict:
+    raw, _ = run_grype(args)
+    return json.loads(raw)
+
+
+def db_built(scan: Dict) -> str:
+    """
+    Reads the build timestamp of the grype DB used for a scan from the
+    report descriptor. Newer grype versions nest it under `status`.
+    """
+    db = scan.get("descriptor", {}).get("db", {}) or {}
+    return db.get("built", None) or (db.get("status", {}) or {}).get("built", None)
+
+
+def build_document(scan: Dict, scan_start: datetime, scan_duration: float, args: ScanArgs) -> Dict:
+    from gryft.scanning.report import GrypeReport
 
     report = GrypeReport.from_json(scan)
     cves = [asdict(cve) for cve in report.cves]
@@ -78,30 +197,189 @@ def store_scan(scan: Dict, scan_start: datetime, scan_duration: float, args: Sca
     document = {
         "scan_start": scan_start,
         "scan_duration_secs": scan_duration,
+        "grype_db_built": db_built(scan),
+        "distro": report_distro(scan),
+        "digest": report_digest(scan),
         "cves": cves
     }
 
     for key, value in asdict(args).items():
         document[key] = value
-    collection.insert_one(document)
+    return document
+
+
+def ensure_indexes(client: MongoClient):
+    global _indexes_ensured
+    if not _indexes_ensured:
+        client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].create_index(**IDEMPOTENCY_INDEX)
+        client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].create_index(**SCAN_HISTORY_INDEX)
+        _indexes_ensured = True
+
+
+def scan_exists(args: ScanArgs, client: MongoClient) -> bool:
+    """
+    Checks if the scan for `args.idempotency_key` was already stored.
+    """
+    if args.idempotency_key is None:
+        return False
+    collection = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME]
+    return collection.find_one({"idempotency_key": args.idempotency_key},
+                               projection={"_id": 1}) is not None
+
+
+def mark_pending(document: Dict, packages: List[Dict]=None) -> Dict:
+    """
+    Marks a scan document to be inserted as having its side writes pending.
+    """
+    document[PENDING_WRITES_FIELD] = {"packages": packages or []}
+    return document
+
+
+def write_side_effects(document: Dict, client: MongoClient, packages: List[Dict]=None):
+    """
+    Updates the package index, the distro and the rollups from a stored
+    scan, then clears its pending mark. The writes are idempotent upserts,
+    so they can be repeated after a failure.
+    """
+    with tracer.start_as_current_span("package_index"):
+        update_package_index(document, client, packages)
+        record_distro(document, client)
+    with tracer.start_as_current_span("rollup"):
+        update_rollups(document, client)
+    client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].update_one(
+        {"_id": document["_id"]}, {"$unset": {PENDING_WRITES_FIELD: ""}})
+
+
+def resume_side_effects(idempotency_key: str, client: MongoClient):
+    """
+    Finishes the side writes of an already stored scan, if an earlier
+    attempt failed after inserting it.
+    """
+    if idempotency_key is None:
+        return
+    document = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].find_one(
+        {"idempotency_key": idempotency_key, PENDING_WRITES_FIELD: {"$exists": True}})
+    if document is not None:
+        logging.warning(f"Finishing the pending writes of scan {idempotency_key}")
+        write_side_effects(document, client, document[PENDING_WRITES_FIELD]["packages"])
+
+
+def store_scan(scan: Dict, scan_start: datetime, scan_duration: float, args: ScanArgs, client: MongoClient,
+               packages: List[Dict]=None):
+    db = client[MONGO_DB_NAME]
+    collection = db[MONGO_COLLECTION_NAME]
+    with tracer.start_as_current_span("parse"):
+        document = mark_pending(build_document(scan, scan_start, scan_duration, args), packages)
+    ensure_indexes(client)
+    try:
+        with tracer.start_as_current_span("insert"):
+            collection.insert_one(document)
+    except DuplicateKeyError:
+        logging.info(f"Scan {args.idempotency_key} already stored")
+        resume_side_effects(args.idempotency_key, client)
+        return
+    write_side_effects(document, client, packages)
+
+
+def enqueue_parse(raw: str, scan_start: datetime, scan_duration: float, args: ScanArgs,
+                  packages: List[Dict]=None):
+    """
+    Writes the raw grype output to the blob store and enqueues
+    a task for the parser service.
+    """
+    # Imported here so inline mode does not need Cloud Tasks
+    from google.cloud import tasks_v2
+    from tasks import push_parse_task
+
+    meta = {
+        "scan_start": scan_start.isoformat(),
+        "scan_duration_secs": scan_duration,
+        "args": asdict(args),
+        "packages": packages or []
+    }
+    key = LocalBlobStore(BLOB_DIR).put_scan(raw, meta)
+    # The idempotency key tells a redelivered task from a lost blob, see parser.main
+    push_parse_task({"blob": key, "idempotency_key": args.idempotency_key},
+                    tasks_v2.CloudTasksClient())
+
+
+def process_scan(args: ScanArgs, client: MongoClient=None):
+    """
+    Scans an image and stores the result, or hands it to the
+    parser service in two-stage mode. Retries of a stored scan
+    are skipped before running grype.
+
+    Raises:
+        `Throttled` if the registry's pull rate limit was not available in time.
+    """
+    if client is None:
+        client = get_mongo_client()
+
+    if client is not None and scan_exists(args, client):
+        logging.info(f"Scan {args.idempotency_key} already stored")
+        resume_side_effects(args.idempotency_key, client)
+        return
+
+    if client is not None:
+        with tracer.start_as_current_span("rate_limit"):
+            get_rate_limiter(client).acquire(args.registry)
+
+    scan_start = datetime.now(timezone.utc)
+    with tracer.start_as_current_span("grype") as span:
+        raw, packages = run_grype(args)
+        span.set_attribute("gallery.report_bytes", len(raw))
+    scan_end = datetime.now(timezone.utc)
+    scan_duration = (scan_end - scan_start).total_seconds()
+
+    if PARSE_QUEUE_NAME is not None:
+        with tracer.start_as_current_span("enqueue_parse"):
+            enqueue_parse(raw, scan_start, scan_duration, args, packages)
+        return
+
+    with tracer.start_as_current_span("decode"):
+        scan = json.loads(raw)
+    if client is None:
+        raise ValueError("MONGO_URI not provided")
+
+    with tracer.start_as_current_span("store_scan"):
+        store_scan(scan, scan_start, scan_duration, args, client, packages)
 
 
 @app.route("/", methods=["POST"])
 def main():
     try:
         args = parse_args(request.json)
-        scan_start = datetime.now(timezone.utc)
-        scan = scan_image(args)
-        scan_end = datetime.now(timezone.utc)
-        scan_duration = (scan_end - scan_start).total_seconds()
-        
-        if MONGO_URI is None:
-            raise ValueError("MONGO_URI not provided")
-        client = MongoClient(MONGO_URI)
-
-        store_scan(scan, scan_start, scan_duration, args, client)
-
+        with tracer.start_as_current_span("scan", context=extract(request.headers),
+                                          attributes=span_attributes(args)):
+            process_scan(args)
+    except Throttled as e:
+        # Defer instead of failing. Cloud Tasks retries with its own backoff, see the
+        # to-scan queue's retry_config. Other HTTP clients can honor Retry-After.
+        response, status_code = error(e, 503)
+        return response, status_code, {"Retry-After": str(int(e.retry_after) + 1)}
     except Exception as e:
         return error(e, 400)
     
     return jsonify({"message": "success"}), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness check. Loads the grype DB if it is not loaded yet.
+    """
+    if MONGO_URI is None and PARSE_QUEUE_NAME is None:
+        return error(ValueError("MONGO_URI not provided"), 503)
+    try:
+        built = grype_db().built
+    except Exception as e:
+        return error(e, 503)
+    return jsonify({"message": "ready", "grype_db_built": built}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    rate_limits = {} if _rate_limiter is None else _rate_limiter.metrics()
+    cache = get_layer_cache()
+    layer_cache = {} if cache is None else cache.metrics()
+    return jsonify({"rate_limits": rate_limits, "layer_cache": layer_cache}), 200
@@ -0,0 +1,287 @@
+"""
+Asyncio serving mode for the scanner. A single instance runs several
+grype subprocesses at once, bounded by `MAX_CONCURRENT_SCANS`.
+
+Runs from the scanner image with:
+
+    APP_MODULE=async_app
+    WORKER_CLASS=uvicorn.workers.UvicornWorker
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timezone
+
+# 3rd Party
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import Quart, request, jsonify
+
+# Local
+from app import (ScanArgs, parse_args, build_document, enqueue_parse, grype_db, grype_outputs, span_attributes,
+                 MONGO_DB_NAME, MONGO_COLLECTION_NAME, MONGO_URI,
+                 PARSE_QUEUE_NAME, SCAN_TIMEOUT_SECS, IDEMPOTENCY_INDEX, SCAN_HISTORY_INDEX,
+                 PENDING_WRITES_FIELD, mark_pending,
+                 MONGO_RATE_LIMITS_COLLECTION_NAME)
+from index import package_index_ops, read_sbom, PACKAGE_INDEX_COLLECTION_NAME
+from distro import distro_ops
+from rollup import rollup_ops, ROLLUPS_COLLECTION_NAME, ensure_indexes as ensure_rollup_indexes
+from ratelimit import RegistryRateLimiter, Throttled
+from layercache import get_layer_cache
+from tracing import tracer, extract
+
+
+MAX_CONCURRENT_SCANS = int(os.environ.get("MAX_CONCURRENT_SCANS", os.cpu_count() or 1))
+READ_CHUNK_SIZE = 64 * 1024
+
+app = Quart(__name__)
+
+_semaphore: asyncio.Semaphore = None
+_client: AsyncIOMotorClient = None
+_rate_limiter: RegistryRateLimiter = None
+
+
+@app.before_serving
+async def startup():
+    global _semaphore, _client, _rate_limiter
+    _semaphore = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
+    await asyncio.to_thread(grype_db)
+    if MONGO_URI is not None:
+        _client = AsyncIOMotorClient(MONGO_URI)
+        await _client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].create_index(**IDEMPOTENCY_INDEX)
+        await _client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].create_index(**SCAN_HISTORY_INDEX)
+        # Bucket updates are single round trips, so a sync client in a thread is enough
+        sync_client = MongoClient(MONGO_URI)
+        _rate_limiter = RegistryRateLimiter(sync_client[MONGO_DB_NAME][MONGO_RATE_LIMITS_COLLECTION_NAME])
+        await asyncio.to_thread(ensure_rollup_indexes, sync_client)
+
+
+@app.after_serving
+async def shutdown():
+    if _client is not None:
+        _client.close()
+
+
+def error(e: Exception, status_code: int):
+    logging.error("Error: " + str(e))
+    return jsonify({"error": str(e)}), status_code
+
+
+async def _read_stream(stream: asyncio.StreamReader) -> bytes:
+    chunks = []
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _communicate(proc: asyncio.subprocess.Process) -> Tuple[bytes, bytes]:
+    stdout, stderr = await asyncio.gather(_read_stream(proc.stdout),
+                                          _read_stream(proc.stderr))
+    await proc.wait()
+    return stdout, stderr
+
+
+async def run_grype(args: ScanArgs) -> Tuple[str, List[Dict]]:
+    """
+    Runs grype in a subprocess. The subprocess is killed if the scan
+    exceeds `SCAN_TIMEOUT_SECS` or the request is cancelled.
+
+    Returns:
+        The raw grype report and the image's packages.
+    """
+    endpoint = f"{args.registry}/{args.repository}:{args.tag}"
+    cache = get_layer_cache()
+    if cache is not None:
+        layout = await asyncio.to_thread(cache.prepare, args.registry, args.repository, args.tag)
+        try:
+            return await _run_grype(f"oci-dir:{layout}")
+        finally:
+            cache.release(layout)
+    return await _run_grype(endpoint)
+
+
+async def _run_grype(endpoint: str) -> Tuple[str, List[Dict]]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sbom_path = os.path.join(tmp_dir, "sbom.json")
+        raw = await _run_grype_process(endpoint, sbom_path)
+        return raw, read_sbom(sbom_path)
+
+
+async def _run_grype_process(endpoint: str, sbom_path: str) -> str:
+    proc = await asyncio.create_subprocess_exec(
+        "grype", endpoint, *grype_outputs(sbom_path),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=grype_db().env())
+
+    try:
+        stdout, stderr = await asyncio.wait_for(_communicate(proc),
+                                                timeout=SCAN_TIMEOUT_SECS)
+    except asyncio.TimeoutError:
+        raise RuntimeError(f"grype timed out after {SCAN_TIMEOUT_SECS}s")
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"Error running grype: {stderr.decode(errors='replace')}")
+    return stdout.decode()
+
+
+async def scan_exists(args: ScanArgs) -> bool:
+    if _client is None or args.idempotency_key is None:
+        return False
+    collection = _client[MONGO_DB_NAME][MONGO_COLLECTION_NAME]
+    return await collection.find_one({"idempotency_key": args.idempotency_key},
+                                     projection={"_id": 1}) is not None
+
+
+async def acquire_pull(registry: str):
+    """
+    Waits for a pull token without blocking the event loop.
+    See `RegistryRateLimiter.acquire`.
+    """
+    if _rate_limiter is None:
+        return
+    start = time.monotonic()
+    while True:
+        wait = await asyncio.to_thread(_rate_limiter.try_acquire, registry)
+        waited = time.monotonic() - start
+        if wait == 0:
+            _rate_limiter.record(registry, waited, throttled=False)
+            return
+        if waited + wait > _rate_limiter.max_wait:
+            _rate_limiter.record(registry, waited, throttled=True)
+            raise Throttled(registry, wait)
+        await asyncio.sleep(wait)
+
+
+async def store_scan(raw: str, scan_start: datetime, scan_duration: float, args: ScanArgs,
+                     packages: List[Dict]=None):
+    if _client is None:
+        raise ValueError("MONGO_URI not provided")
+
+    # Parsing is CPU bound. Keep it off the event loop.
+    with tracer.start_as_current_span("parse"):
+        document = await asyncio.to_thread(build_document, json.loads(raw),
+                                           scan_start, scan_duration, args)
+    mark_pending(document, packages)
+    try:
+        with tracer.start_as_current_span("insert"):
+            await _client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].insert_one(document)
+    except DuplicateKeyError:
+        logging.info(f"Scan {args.idempotency_key} already stored")
+        await resume_side_effects(args.idempotency_key)
+        return
+    await write_side_effects(document, packages)
+
+
+async def write_side_effects(document: Dict, packages: List[Dict]=None):
+    """
+    See `app.write_side_effects`.
+    """
+    db = _client[MONGO_DB_NAME]
+    ops = {PACKAGE_INDEX_COLLECTION_NAME: package_index_ops(document, packages),
+           ROLLUPS_COLLECTION_NAME: rollup_ops(document),
+           **distro_ops(document)}
+    with tracer.start_as_current_span("package_index"):
+        await asyncio.gather(*[db[name].bulk_write(o, ordered=False)
+                               for name, o in ops.items() if len(o) > 0])
+    await db[MONGO_COLLECTION_NAME].update_one({"_id": document["_id"]},
+                                               {"$unset": {PENDING_WRITES_FIELD: ""}})
+
+
+async def resume_side_effects(idempotency_key: str):
+    """
+    See `app.resume_side_effects`.
+    """
+    if _client is None or idempotency_key is None:
+        return
+    document = await _client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].find_one(
+        {"idempotency_key": idempotency_key, PENDING_WRITES_FIELD: {"$exists": True}})
+    if document is not None:
+        logging.warning(f"Finishing the pending writes of scan {idempotency_key}")
+        await write_side_effects(document, document[PENDING_WRITES_FIELD]["packages"])
+
+
+async def process_scan(args: ScanArgs):
+    if await scan_exists(args):
+        logging.info(f"Scan {args.idempotency_key} already stored")
+        await resume_side_effects(args.idempotency_key)
+        return
+
+    # Take a slot before the pull token, so a token is not spent waiting for a slot
+    with tracer.start_as_current_span("semaphore"):
+        await _semaphore.acquire()
+    try:
+        with tracer.start_as_current_span("rate_limit"):
+            await acquire_pull(args.registry)
+        scan_start = datetime.now(timezone.utc)
+        with tracer.start_as_current_span("grype"):
+            raw, packages = await run_grype(args)
+        scan_end = datetime.now(timezone.utc)
+    finally:
+        _semaphore.release()
+    scan_duration = (scan_end - scan_start).total_seconds()
+
+    if PARSE_QUEUE_NAME is not None:
+        with tracer.start_as_current_span("enqueue_parse"):
+            await asyncio.to_thread(enqueue_parse, raw, scan_start, scan_duration, args, packages)
+    else:
+        with tracer.start_as_current_span("store_scan"):
+            await store_scan(raw, scan_start, scan_duration, args, packages)
+
+
+@app.route("/", methods=["POST"])
+async def main():
+    try:
+        args = parse_args(await request.get_json())
+        with tracer.start_as_current_span("scan", context=extract(request.headers),
+                                          attributes=span_attributes(args)):
+            await process_scan(args)
+
+    except Throttled as e:
+        # See `app.main`
+        response, status_code = error(e, 503)
+        return response, status_code, {"Retry-After": str(int(e.retry_after) + 1)}
+    except Exception as e:
+        return error(e, 400)
+
+    return jsonify({"message": "success"}), 200
+
+
+@app.route("/ready", methods=["GET"])
+async def ready():
+    """
+    Readiness check. Reports the pinned grype DB and whether the
+    MongoDB client was started.
+    """
+    if MONGO_URI is None and PARSE_QUEUE_NAME is None:
+        return error(ValueError("MONGO_URI not provided"), 503)
+    if MONGO_URI is not None and _client is None:
+        return error(RuntimeError("MongoDB client not started"), 503)
+    try:
+        built = (await asyncio.to_thread(grype_db)).built
+    except Exception as e:
+        return error(e, 503)
+    return jsonify({"message": "ready", "grype_db_built": built,
+                    "mongo_client": None if _client is None else "started"}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    rate_limits = {} if _rate_limiter is None else _rate_limiter.metrics()
+    cache = get_layer_cache()
+    layer_cache = {} if cache is None else cache.metrics()
+    return jsonify({"rate_limits": rate_limits, "layer_cache": layer_cache}), 200
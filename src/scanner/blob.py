@@ -0,0 +1,92 @@
+"""
+Blob storage for raw grype reports waiting to be parsed.
+
+The store is a plain directory. On Cloud Run it is a Cloud Storage
+bucket mounted as a volume, so the scanner and parser services share it.
+Each scan is written as two files:
+
+    <key>.grype.json  The raw grype output.
+    <key>.meta.json   The scan metadata. Written last, so a blob is only
+                      visible to the parser once it is complete.
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple
+import os
+import json
+import uuid
+
+
+RAW_SUFFIX = ".grype.json"
+META_SUFFIX = ".meta.json"
+
+
+class LocalBlobStore:
+    """
+    Stores raw grype reports in a local directory.
+    """
+    def __init__(self, root: str):
+        """
+        root (str): The directory to store blobs in. Created if it does not exist.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.root, key + suffix)
+
+    def _write(self, path: str, data: str):
+        # Write to a temp file and rename so readers never see partial files
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put_scan(self, raw: str, meta: Dict) -> str:
+        """
+        Stores a raw grype report and its metadata.
+
+        Args:
+            raw (str): The raw grype JSON output.
+            meta (Dict): The scan metadata. Must be JSON serializable.
+
+        Returns:
+            The key of the new blob.
+        """
+        key = uuid.uuid4().hex
+        self._write(self._path(key, RAW_SUFFIX), raw)
+        self._write(self._path(key, META_SUFFIX), json.dumps(meta))
+        return key
+
+    def get_scan(self, key: str) -> Tuple[str, Dict]:
+        """
+        Loads a raw grype report and its metadata.
+
+        Args:
+            key (str): The key of the blob.
+
+        Returns:
+            A `Tuple` of the raw grype output and the metadata.
+        """
+        with open(self._path(key, RAW_SUFFIX), "r", encoding="utf-8") as f:
+            raw = f.read()
+        with open(self._path(key, META_SUFFIX), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return raw, meta
+
+    def delete(self, key: str):
+        """
+        Deletes a blob. Missing files are ignored.
+        """
+        for suffix in [META_SUFFIX, RAW_SUFFIX]:
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def pending(self) -> List[str]:
+        """
+        Lists the keys of all complete blobs in the store.
+        """
+        return sorted(name[:-len(META_SUFFIX)] for name in os.listdir(self.root)
+                      if name.endswith(META_SUFFIX))
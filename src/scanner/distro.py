@@ -0,0 +1,213 @@
+"""
+Records the distro of scanned images so analyses can exclude, for
+example, alpine-based images with a query instead of a scan.
+
+Scan documents carry the distro grype detected and the manifest digest:
+
+    {..., distro: {name, version}, digest}
+
+gallery.distros caches the distro of each digest:
+
+    {_id: digest, name, version, source: "grype" | "os-release", detected_at}
+
+and gallery.images holds the latest distro of each image:
+
+    {registry, repository, tag, ..., distro: {name, version}, digest}
+
+Images scanned before distros were recorded are backfilled without a
+scan by reading `/etc/os-release` from their layers, base layer first.
+Layers are streamed and the download stops at the os-release file, so
+usually only the start of the base layer is pulled. A digest that is
+already cached is not read again.
+
+Run `python distro.py` to backfill gallery.images.
+"""
+
+# Standard lib
+from typing import Dict, List, Optional
+import os
+import json
+import logging
+import tarfile
+import subprocess
+from datetime import datetime, timezone
+
+# 3rd Party
+from pymongo import MongoClient, UpdateOne, ASCENDING
+
+
+MONGO_DB_NAME = "gallery"
+IMAGES_COLLECTION_NAME = "images"
+DISTROS_COLLECTION_NAME = "distros"
+MONGO_URI = os.environ.get("MONGO_URI", None)
+
+OS_RELEASE_PATHS = {"etc/os-release", "usr/lib/os-release"}
+OCI_PLATFORM = os.environ.get("OCI_PLATFORM", "linux/amd64")
+
+_indexes_ensured = False
+
+
+def report_distro(scan: Dict) -> Optional[Dict]:
+    """
+    Reads the distro grype detected from a report. Returns `None` if it found none.
+    """
+    distro = scan.get("distro", None) or {}
+    if not distro.get("name", None):
+        return None
+    return {"name": distro["name"], "version": distro.get("version", None)}
+
+
+def report_digest(scan: Dict) -> Optional[str]:
+    target = (scan.get("source", None) or {}).get("target", None)
+    # Directory sources have a path as their target
+    if not isinstance(target, dict):
+        return None
+    return target.get("manifestDigest", None)
+
+
+def parse_os_release(text: str) -> Optional[Dict]:
+    fields = {}
+    for line in text.splitlines():
+        if "=" not in line or line.startswith("#"):
+            continue
+        key, value = line.split("=", 1)
+        fields[key.strip()] = value.strip().strip("\"'")
+    if "ID" not in fields:
+        return None
+    return {"name": fields["ID"], "version": fields.get("VERSION_ID", None)}
+
+
+def _layer_os_release(ref: str, digest: str) -> Optional[str]:
+    """
+    Streams a layer and returns its os-release file, stopping the
+    download as soon as the file is read.
+    """
+    proc = subprocess.Popen(["crane", "blob", f"{ref}@{digest}"],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|*") as layer:
+            for member in layer:
+                if member.name.lstrip("./") in OS_RELEASE_PATHS and member.isfile():
+                    return layer.extractfile(member).read().decode(errors="replace")
+        return None
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def image_digest(registry: str, repository: str, tag: str) -> str:
+    from sh import crane
+
+    return str(crane("digest", "--platform", OCI_PLATFORM, f"{registry}/{repository}:{tag}")).strip()
+
+
+def detect_distro(registry: str, repository: str, digest: str) -> Optional[Dict]:
+    """
+    Reads the distro from `/etc/os-release` in the image's layers,
+    without pulling the rest of the image once it is found.
+
+    Layers are read from the base up, since the base image provides
+    the os-release file. An upper layer that rewrites it, which is rare,
+    is not seen.
+
+    Returns:
+        The distro, or `None` if there is no os-release file.
+    """
+    from sh import crane
+
+    ref = f"{registry}/{repository}"
+    manifest = json.loads(str(crane("manifest", f"{ref}@{digest}")))
+
+    for layer in manifest["layers"]:
+        text = _layer_os_release(ref, layer["digest"])
+        if text is not None:
+            return parse_os_release(text)
+    return None
+
+
+def distro_ops(document: Dict) -> Dict[str, List[UpdateOne]]:
+    """
+    Builds the writes that record a scan document's distro. Without a
+    digest only the image is updated, since the cache is keyed by digest.
+
+    Returns:
+        `UpdateOne` operations for `bulk_write`, by collection name.
+    """
+    image = {"registry": document["registry"],
+             "repository": document["repository"],
+             "tag": document["tag"]}
+    update = {"distro": document["distro"]}
+    if document.get("digest", None) is not None:
+        update["digest"] = document["digest"]
+    ops = {IMAGES_COLLECTION_NAME: [UpdateOne(image, {"$set": update})]}
+    if document["distro"] is not None and "digest" in update:
+        ops[DISTROS_COLLECTION_NAME] = [UpdateOne(
+            {"_id": document["digest"]},
+            {"$setOnInsert": {**document["distro"],
+                              "source": "grype",
+                              "detected_at": datetime.now(timezone.utc)}},
+            upsert=True)]
+    return ops
+
+
+def ensure_indexes(client: MongoClient):
+    client[MONGO_DB_NAME][IMAGES_COLLECTION_NAME].create_index(
+        [("registry", ASCENDING), ("distro.name", ASCENDING)])
+
+
+def record_distro(document: Dict, client: MongoClient):
+    global _indexes_ensured
+    if not _indexes_ensured:
+        ensure_indexes(client)
+        _indexes_ensured = True
+
+    for collection, ops in distro_ops(document).items():
+        client[MONGO_DB_NAME][collection].bulk_write(ops, ordered=False)
+
+
+def cached_distro(registry: str, repository: str, digest: str,
+                  client: MongoClient) -> Optional[Dict]:
+    """
+    Looks up the distro of a digest, reading its layers on a cache miss.
+    Digests without an os-release file are cached with a `None` name.
+    """
+    collection = client[MONGO_DB_NAME][DISTROS_COLLECTION_NAME]
+    cached = collection.find_one({"_id": digest})
+    if cached is None:
+        distro = detect_distro(registry, repository, digest) or {"name": None, "version": None}
+        cached = {**distro, "source": "os-release", "detected_at": datetime.now(timezone.utc)}
+        collection.update_one({"_id": digest}, {"$setOnInsert": cached}, upsert=True)
+    if cached["name"] is None:
+        return None
+    return {"name": cached["name"], "version": cached["version"]}
+
+
+def backfill(client: MongoClient) -> int:
+    """
+    Sets the distro of every image that has none from its digest's
+    cache entry, reading os-release only for uncached digests.
+
+    Returns:
+        The number of images updated.
+    """
+    ensure_indexes(client)
+    collection = client[MONGO_DB_NAME][IMAGES_COLLECTION_NAME]
+    n_updated = 0
+    images = list(collection.find({"distro": {"$exists": False}},
+                                  {"registry": 1, "repository": 1, "tag": 1}))
+    for image in images:
+        try:
+            digest = image_digest(image["registry"], image["repository"], image["tag"])
+            distro = cached_distro(image["registry"], image["repository"], digest, client)
+        except Exception as e:
+            logging.error(f"Error detecting the distro of "
+                          f"{image['registry']}/{image['repository']}:{image['tag']}: {e}")
+            continue
+        collection.update_one({"_id": image["_id"]}, {"$set": {"distro": distro, "digest": digest}})
+        n_updated += 1
+    return n_updated
+
+
+if __name__ == "__main__":
+    with MongoClient(MONGO_URI) as client:
+        print(f"Updated the distro of {backfill(client)} images")
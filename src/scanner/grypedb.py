@@ -0,0 +1,208 @@
+"""
+Manages the grype vulnerability DB used by the scanner.
+
+The DB is downloaded once (at image build time or on first use) and
+pinned for every scan. Scans run with DB update checks disabled, so no
+scan pays for a download. A background thread downloads new DBs into a
+fresh directory and swaps the pinned DB atomically once it is valid.
+
+Layout:
+
+    <GRYPE_DB_ROOT>/<timestamp>/  One grype cache dir per download.
+
+Run `python grypedb.py` to download a DB into GRYPE_DB_ROOT.
+"""
+
+# Standard lib
+from typing import Dict, Optional, Callable
+import os
+import json
+import shutil
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+
+GRYPE_DB_ROOT = os.environ.get("GRYPE_DB_ROOT", "/var/lib/grype-db")
+GRYPE_DB_REFRESH_SECS = float(os.environ.get("GRYPE_DB_REFRESH_SECS", 6 * 3600))
+
+
+def _parse_status(output: str) -> Dict[str, str]:
+    """
+    Parses the output of `grype db status`. Handles both the
+    JSON and the `Key: value` text formats.
+    """
+    try:
+        return {k.lower(): str(v) for k, v in json.loads(output).items()}
+    except ValueError:
+        status = {}
+        for line in output.splitlines():
+            if ":" in line:
+                key, value = line.split(":", 1)
+                status[key.strip().lower()] = value.strip()
+        return status
+
+
+class GrypeDB:
+    """
+    A pinned grype DB with atomic background refreshes.
+    """
+    def __init__(self, root: str, on_update: Callable[[str, str, str], None]=None):
+        """
+        root (str): The directory holding one sub-directory per downloaded DB.
+        on_update (Callable, optional): Called with the old cache dir, new cache dir and
+                                        build time after a refresh pins a new DB.
+        """
+        self.root = root
+        self.on_update = on_update
+        self._lock = threading.Lock()
+        self._cache_dir: Optional[str] = None
+        self._built: Optional[str] = None
+        self._refresher: Optional[threading.Thread] = None
+        self._history = []
+
+    @property
+    def built(self) -> Optional[str]:
+        with self._lock:
+            return self._built
+
+    def env(self) -> Dict[str, str]:
+        """
+        The environment for a grype subprocess that uses the pinned DB
+        and never checks for updates.
+        """
+        with self._lock:
+            cache_dir = self._cache_dir
+        env = dict(os.environ)
+        env.update({
+            "GRYPE_DB_AUTO_UPDATE": "false",
+            "GRYPE_DB_VALIDATE_AGE": "false",
+            "GRYPE_CHECK_FOR_APP_UPDATE": "false"
+        })
+        if cache_dir is not None:
+            env["GRYPE_DB_CACHE_DIR"] = cache_dir
+        return env
+
+    def _status(self, cache_dir: str) -> Optional[Dict[str, str]]:
+        from sh import grype, ErrorReturnCode
+
+        env = dict(os.environ, GRYPE_DB_CACHE_DIR=cache_dir)
+        try:
+            status = _parse_status(str(grype("db", "status", _env=env)))
+        except ErrorReturnCode:
+            return None
+        if status.get("status", "valid") != "valid":
+            return None
+        return status
+
+    def _swap(self, cache_dir: str, built: str):
+        with self._lock:
+            self._cache_dir, self._built = cache_dir, built
+
+        # Keep the previous DB for scans that are still running.
+        # Only DBs pinned by this process are removed.
+        self._history.append(cache_dir)
+        while len(self._history) > 2:
+            shutil.rmtree(self._history.pop(0), ignore_errors=True)
+
+    def load(self) -> bool:
+        """
+        Pins the newest valid DB already on disk.
+
+        Returns:
+            `True` if a DB was found.
+        """
+        if not os.path.isdir(self.root):
+            return False
+        for name in sorted(os.listdir(self.root), reverse=True):
+            cache_dir = os.path.join(self.root, name)
+            status = self._status(cache_dir)
+            if status is not None:
+                self._swap(cache_dir, status.get("built"))
+                return True
+        return False
+
+    def refresh(self) -> bool:
+        """
+        Downloads the latest DB into a new directory and pins it if it
+        is valid and newer than the pinned DB.
+
+        Returns:
+            `True` if the pinned DB changed.
+        """
+        from sh import grype, ErrorReturnCode
+
+        # Microseconds keep a refresh from reusing, and then removing, the pinned DB's dir
+        name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        cache_dir = os.path.join(self.root, name)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        try:
+            grype("db", "update", _env=dict(os.environ, GRYPE_DB_CACHE_DIR=cache_dir))
+        except ErrorReturnCode as e:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            raise RuntimeError(f"Error updating grype DB: {e.stderr}")
+
+        status = self._status(cache_dir)
+        if (status is None) or (status.get("built") == self.built):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            return False
+
+        with self._lock:
+            previous = self._cache_dir
+        self._swap(cache_dir, status.get("built"))
+        logging.info(f"Pinned grype DB built at {status.get('built')}")
+
+        if self.on_update is not None:
+            try:
+                self.on_update(previous, cache_dir, status.get("built"))
+            except Exception as e:
+                logging.error(f"Error handling grype DB update: {e}")
+        return True
+
+    def load_or_refresh(self):
+        if not self.load():
+            self.refresh()
+
+    def _refresh_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error refreshing grype DB: {e}")
+
+    def start_refresher(self, interval: float):
+        """
+        Starts a daemon thread that refreshes the DB every `interval`
+        seconds. Does nothing if `interval` is not positive.
+        """
+        if interval <= 0 or self._refresher is not None:
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop,
+                                           args=(interval,), daemon=True)
+        self._refresher.start()
+
+
+_db: Optional[GrypeDB] = None
+_db_lock = threading.Lock()
+
+
+def get_db(on_update: Callable[[str, str, str], None]=None) -> GrypeDB:
+    """
+    Returns the process-wide `GrypeDB`, loading it and starting the
+    refresher on first use. `on_update` is only used on first use.
+    """
+    global _db
+    with _db_lock:
+        if _db is None:
+            db = GrypeDB(GRYPE_DB_ROOT, on_update=on_update)
+            db.load_or_refresh()
+            db.start_refresher(GRYPE_DB_REFRESH_SECS)
+            _db = db
+        return _db
+
+
+if __name__ == "__main__":
+    GrypeDB(GRYPE_DB_ROOT).refresh()
@@ -0,0 +1,354 @@
+"""
+Inverted index from packages to the images they appear in, and the
+record of grype DB updates used to trigger targeted rescans.
+
+gallery.packages holds one document per (package, image) pair:
+
+    {name, version, type_, registry, repository, tag, last_seen}
+
+Every package of the image is indexed, from the CycloneDX SBOM grype
+writes next to its report, so a new advisory for a package that never
+matched before still finds the images that contain it.
+
+gallery.db_updates holds one document per grype DB build:
+
+    {_id: built, packages: [{name, version, type_}, ...], processed: False}
+
+The first scanner instance to pin a new DB diffs the advisories of the
+old and new DBs. It looks up the indexed packages with the changed
+names, keeps those whose type fits the advisory's namespace and whose
+version is inside its constraint, and records them. The publisher
+claims the record and enqueues only the images that contain those
+exact packages. Constraints that cannot be parsed match every version.
+Only v5 DBs are diffed. For other schemas an error is logged and no
+update is recorded, so affected images wait for their scheduled scan.
+
+Run `python index.py` to rebuild the index from stored scans. Stored
+scans only hold matched packages, so a rebuilt index is completed by
+the next scan of each image.
+"""
+
+# Standard lib
+from typing import Dict, List, Optional, Set, Tuple
+import os
+import re
+import glob
+import json
+import sqlite3
+import logging
+from datetime import datetime, timezone
+
+# 3rd Party
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+
+MONGO_DB_NAME = "gallery"
+MONGO_COLLECTION_NAME = "cves"
+PACKAGE_INDEX_COLLECTION_NAME = "packages"
+DB_UPDATES_COLLECTION_NAME = "db_updates"
+MONGO_URI = os.environ.get("MONGO_URI", None)
+
+SUPPORTED_SCHEMA_VERSION = 5
+_ADVISORY_COLUMNS = "id, package_name, namespace, version_constraint, fix_state"
+# Rows in either DB but not both, i.e. their symmetric difference
+CHANGED_ADVISORIES_QUERY = " UNION ".join(
+    f"SELECT package_name, namespace, version_constraint FROM "
+    f"(SELECT {_ADVISORY_COLUMNS} FROM {a}.vulnerability "
+    f"EXCEPT SELECT {_ADVISORY_COLUMNS} FROM {b}.vulnerability)"
+    for a, b in [("main", "old"), ("old", "main")])
+
+INDEX_KEYS = ["name", "version", "type_", "registry", "repository", "tag"]
+PACKAGE_KEYS = INDEX_KEYS[:3]
+
+# Package types of language advisory namespaces, e.g. github:language:python
+LANGUAGE_TYPES = {
+    "python": ["python"],
+    "java": ["java-archive", "jenkins-plugin"],
+    "javascript": ["npm"],
+    "go": ["go-module"],
+    "ruby": ["gem"],
+    "rust": ["rust-crate"],
+    "dotnet": ["dotnet"],
+    "php": ["php-composer", "php-pecl"],
+}
+
+# Package types of distro advisory namespaces, e.g. wolfi:distro:wolfi:rolling
+DISTRO_TYPES = {
+    "alpine": ["apk"], "wolfi": ["apk"], "chainguard": ["apk"],
+    "debian": ["deb"], "ubuntu": ["deb"],
+    "redhat": ["rpm"], "amazon": ["rpm"], "oracle": ["rpm"], "sles": ["rpm"],
+    "mariner": ["rpm"], "azurelinux": ["rpm"], "rocky": ["rpm"], "almalinux": ["rpm"],
+}
+
+_CONSTRAINT = re.compile(r"^\s*(<=|>=|<|>|=|==)?\s*(\S+)\s*$")
+
+_indexes_ensured = False
+
+
+def _component(entry: Dict) -> Tuple:
+    return tuple(entry.get(k, None) for k in PACKAGE_KEYS)
+
+
+def sbom_packages(sbom: Dict) -> List[Dict]:
+    """
+    Lists the packages of a CycloneDX SBOM written by grype. The type is
+    syft's package type, as in `cves[].component.type_`, or else the purl type.
+    Components with neither, like the distro itself, are skipped.
+    """
+    packages = []
+    for component in sbom.get("components", None) or []:
+        properties = {p["name"]: p.get("value", None) for p in component.get("properties", None) or []}
+        type_ = properties.get("syft:package:type", None)
+        purl = component.get("purl", None)
+        if type_ is None and purl is not None and purl.startswith("pkg:"):
+            type_ = purl[4:].split("/", 1)[0]
+        if component.get("name", None) and type_ is not None:
+            packages.append({"name": component["name"],
+                             "version": component.get("version", None),
+                             "type_": type_})
+    return packages
+
+
+def read_sbom(path: str) -> List[Dict]:
+    """
+    Reads the packages of the SBOM at `path`. Returns an empty `List` if
+    grype did not write one.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return sbom_packages(json.load(f))
+    except FileNotFoundError:
+        return []
+
+
+def package_index_ops(document: Dict, packages: List[Dict]=None) -> List[UpdateOne]:
+    """
+    Builds the upserts that add a scan document's packages to the index.
+
+    Args:
+        document (Dict): A scan document as built by `build_document`.
+        packages (List[Dict], optional): The image's packages, see `sbom_packages`.
+                                         The matched components are always indexed.
+
+    Returns:
+        A `List` of `UpdateOne` operations for `bulk_write`.
+    """
+    ops = []
+    seen = set()
+    components = [cve.get("component", None) or {} for cve in document["cves"]]
+    for component in (packages or []) + components:
+        key = _component(component)
+        if key[0] is None or key in seen:
+            continue
+        seen.add(key)
+
+        entry = dict(zip(INDEX_KEYS, key + (document["registry"],
+                                            document["repository"],
+                                            document["tag"])))
+        ops.append(UpdateOne(entry, {"$set": {"last_seen": document["scan_start"]}},
+                             upsert=True))
+    return ops
+
+
+def ensure_indexes(client: MongoClient):
+    db = client[MONGO_DB_NAME]
+    db[PACKAGE_INDEX_COLLECTION_NAME].create_index([(k, ASCENDING) for k in INDEX_KEYS],
+                                                   unique=True)
+    db[PACKAGE_INDEX_COLLECTION_NAME].create_index("last_seen")
+
+
+def update_package_index(document: Dict, client: MongoClient, packages: List[Dict]=None):
+    global _indexes_ensured
+    if not _indexes_ensured:
+        ensure_indexes(client)
+        _indexes_ensured = True
+
+    ops = package_index_ops(document, packages)
+    if len(ops) > 0:
+        client[MONGO_DB_NAME][PACKAGE_INDEX_COLLECTION_NAME].bulk_write(ops, ordered=False)
+
+
+def rebuild_package_index(client: MongoClient) -> int:
+    """
+    Builds the index from the latest stored scan of every image.
+
+    Returns:
+        The number of scans indexed.
+    """
+    ensure_indexes(client)
+    pipeline = [
+        {"$sort": {"scan_start": DESCENDING}},
+        {"$group": {"_id": {"registry": "$registry",
+                            "repository": "$repository",
+                            "tag": "$tag"},
+                    "scan": {"$first": "$$ROOT"}}}
+    ]
+    n_indexed = 0
+    cursor = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].aggregate(pipeline, allowDiskUse=True)
+    for result in cursor:
+        update_package_index(result["scan"], client)
+        n_indexed += 1
+    return n_indexed
+
+
+class UnsupportedSchema(ValueError):
+    """
+    Raised when a grype DB is missing or not of the schema `changed_advisories` reads.
+    """
+
+
+def _db_path(cache_dir: str) -> str:
+    """
+    Finds the grype DB file in a cache dir and checks its schema version.
+    """
+    paths = glob.glob(os.path.join(cache_dir, "*", "vulnerability.db"))
+    if len(paths) == 0:
+        raise UnsupportedSchema(f"No grype DB found in {cache_dir}")
+    with sqlite3.connect(f"file:{paths[0]}?mode=ro", uri=True) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        # v5 records its schema in the `id` table, v6 replaced it with `db_metadata`
+        version = conn.execute("SELECT schema_version FROM id").fetchone()[0] if "id" in tables else None
+    if version != SUPPORTED_SCHEMA_VERSION:
+        raise UnsupportedSchema(f"Grype DB {paths[0]} has schema {version or 'unknown'}, "
+                                f"only v{SUPPORTED_SCHEMA_VERSION} can be compared")
+    return paths[0]
+
+
+def changed_advisories(old_cache_dir: str, new_cache_dir: str) -> Set[Tuple[str, str, str]]:
+    """
+    Finds the advisories added to or removed from a grype DB, including
+    those whose constraint or fix state changed. The DBs are diffed by
+    SQLite, so neither advisory table is loaded into memory.
+
+    Returns:
+        A `Set` of (package name, namespace, version constraint).
+
+    Raises:
+        `UnsupportedSchema` if either DB is missing or not a v5 DB.
+    """
+    old_path, new_path = _db_path(old_cache_dir), _db_path(new_cache_dir)
+    with sqlite3.connect(f"file:{new_path}?mode=ro", uri=True) as conn:
+        conn.execute("ATTACH DATABASE ? AS old", (f"file:{old_path}?mode=ro",))
+        rows = conn.execute(CHANGED_ADVISORIES_QUERY)
+        return set(rows)
+
+
+def namespace_types(namespace: str) -> Optional[List[str]]:
+    """
+    The package types an advisory namespace applies to, or `None` if it
+    applies to any type, like CPE advisories.
+    """
+    parts = (namespace or "").split(":")
+    if len(parts) >= 3 and parts[1] == "language":
+        return LANGUAGE_TYPES.get(parts[2], None)
+    if len(parts) >= 3 and parts[1] == "distro":
+        return DISTRO_TYPES.get(parts[2], None)
+    return None
+
+
+def version_key(version: str) -> Tuple:
+    """
+    A sort key for versions of any ecosystem: an optional `epoch:` prefix,
+    then runs of digits compared as numbers and runs of letters as text.
+    """
+    epoch = 0
+    if re.match(r"^\d+:", version):
+        epoch, version = version.split(":", 1)
+    tokens = re.findall(r"\d+|[A-Za-z]+", version)
+    return (int(epoch),) + tuple((0, int(t), "") if t.isdigit() else (1, 0, t) for t in tokens)
+
+
+def version_matches(version: str, constraint: str) -> bool:
+    """
+    Checks if `version` is inside a grype version constraint, such as
+    `>= 1.0, < 1.4 || < 0.9`. Returns `True` if either cannot be parsed,
+    so a rescan is never skipped on a constraint this does not understand.
+    """
+    if not version or not constraint or constraint.strip() in ["", "none"]:
+        return True
+    try:
+        current = version_key(version)
+        for alternative in constraint.split("||"):
+            inside = True
+            for clause in alternative.split(","):
+                match = _CONSTRAINT.match(clause)
+                if match is None:
+                    return True
+                op, bound = match.group(1) or "=", version_key(match.group(2))
+                inside &= {"<": current < bound, "<=": current <= bound,
+                           ">": current > bound, ">=": current >= bound,
+                           "=": current == bound, "==": current == bound}[op]
+            if inside:
+                return True
+    except ValueError:
+        return True
+    return False
+
+
+def affected_packages(advisories: Set[Tuple[str, str, str]], indexed: List[Dict]) -> List[Dict]:
+    """
+    Selects the indexed packages that changed advisories apply to, by
+    name, type and version.
+
+    Args:
+        advisories (Set): (package name, namespace, version constraint), see `changed_advisories`.
+        indexed (List[Dict]): Distinct indexed packages with `name`, `version` and `type_`.
+
+    Returns:
+        The affected packages, sorted.
+    """
+    by_name = {}
+    for name, namespace, constraint in advisories:
+        by_name.setdefault(name, []).append((namespace_types(namespace), constraint))
+
+    affected = set()
+    for package in indexed:
+        for types, constraint in by_name.get(package["name"], []):
+            if (types is None or package["type_"] in types) and \
+               version_matches(package["version"], constraint):
+                affected.add(_component(package))
+                break
+    return [dict(zip(PACKAGE_KEYS, key)) for key in sorted(affected, key=lambda k: tuple(map(str, k)))]
+
+
+def indexed_packages(names: List[str], client: MongoClient) -> List[Dict]:
+    """
+    Lists the distinct indexed packages named any of `names`.
+    """
+    pipeline = [
+        {"$match": {"name": {"$in": names}}},
+        {"$group": {"_id": {k: f"${k}" for k in PACKAGE_KEYS}}}
+    ]
+    collection = client[MONGO_DB_NAME][PACKAGE_INDEX_COLLECTION_NAME]
+    return [r["_id"] for r in collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+def record_db_update(old_cache_dir: str, new_cache_dir: str, built: str):
+    """
+    Records a grype DB update for the publisher. Only the first instance
+    to record a given build succeeds, the rest are ignored.
+    """
+    if MONGO_URI is None or old_cache_dir is None:
+        return
+
+    # Raised errors are logged by `GrypeDB.refresh`, no targeted rescan is recorded
+    advisories = changed_advisories(old_cache_dir, new_cache_dir)
+
+    with MongoClient(MONGO_URI) as client:
+        names = sorted({name for name, _, _ in advisories})
+        packages = affected_packages(advisories, indexed_packages(names, client))
+        try:
+            client[MONGO_DB_NAME][DB_UPDATES_COLLECTION_NAME].insert_one({
+                "_id": built,
+                "packages": packages,
+                "recorded_at": datetime.now(timezone.utc),
+                "processed": False
+            })
+        except DuplicateKeyError:
+            pass
+
+
+if __name__ == "__main__":
+    with MongoClient(MONGO_URI) as client:
+        print(f"Indexed {rebuild_package_index(client)} images")
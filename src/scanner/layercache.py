@@ -0,0 +1,210 @@
+"""
+Content-addressed cache of image blobs shared by consecutive scans in
+one scanner instance.
+
+Blobs (config and layers) are fetched with `crane` into
+
+    <OCI_CACHE_DIR>/blobs/sha256/<digest>
+
+For each scan, a throwaway OCI layout is assembled under
+`<OCI_CACHE_DIR>/layouts/` from hard links to the cached blobs, and grype
+scans it with `oci-dir:`. Layers shared between images (wolfi-base,
+debian, ubuntu, ...) are only downloaded once per instance.
+
+The cache is bounded by OCI_CACHE_MAX_BYTES and evicts the least
+recently used blobs. Checking for a blob and linking it happen under the
+same lock as eviction, so a blob cannot be evicted in between. Blobs
+linked into a layout are pinned until it is released: evicting them
+would free nothing, so eviction skips them but counts their bytes, along
+with those of evicted blobs that layouts still hold. On Cloud Run the
+disk is in-memory, so the bound counts against the instance's memory
+limit.
+"""
+
+# Standard lib
+from typing import Dict, List
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+
+OCI_CACHE_DIR = os.environ.get("OCI_CACHE_DIR", None)
+OCI_CACHE_MAX_BYTES = int(os.environ.get("OCI_CACHE_MAX_BYTES", 4 * 1024 ** 3))
+OCI_PLATFORM = os.environ.get("OCI_PLATFORM", "linux/amd64")
+
+
+class LayerCache:
+    """
+    An LRU, content-addressed blob cache that builds OCI layouts for grype.
+    """
+    def __init__(self, root: str, max_bytes: int, platform: str=OCI_PLATFORM):
+        """
+        root (str): The cache directory.
+        max_bytes (int): The size the cache is trimmed to after each fetch.
+        platform (str, optional): The platform to pull from multi-arch images.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.platform = platform
+        self.blob_dir = os.path.join(root, "blobs", "sha256")
+        self.layout_dir = os.path.join(root, "layouts")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.layout_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest.split(":", 1)[1])
+
+    def _fetch_manifest(self, ref: str) -> bytes:
+        from sh import crane, ErrorReturnCode
+
+        try:
+            return crane("manifest", "--platform", self.platform, ref).stdout
+        except ErrorReturnCode as e:
+            raise RuntimeError(f"Error fetching manifest of {ref}: {e.stderr}")
+
+    def _download(self, repo: str, digest: str, path: str):
+        from sh import crane, ErrorReturnCode
+
+        try:
+            with open(path, "wb") as f:
+                crane("blob", f"{repo}@{digest}", _out=f)
+        except ErrorReturnCode as e:
+            raise RuntimeError(f"Error fetching blob {digest}: {e.stderr}")
+
+    def _fetch_blob(self, repo: str, digest: str, layout: str):
+        """
+        Links a blob into `layout`, downloading it first on a miss. The
+        link is made under the lock, so eviction cannot remove the blob
+        between the check and the link.
+        """
+        path = self._blob_path(digest)
+        target = os.path.join(layout, "blobs", "sha256", digest.split(":", 1)[1])
+        with self._lock:
+            try:
+                os.link(path, target)
+                os.utime(path)
+                self.hits += 1
+                return
+            except FileNotFoundError:
+                pass
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            self._download(repo, digest, tmp_path)
+            with self._lock:
+                os.replace(tmp_path, path)
+                os.link(path, target)
+                self.misses += 1
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _layout_only_bytes(self, blob_inodes: set) -> int:
+        """
+        Sums the files held only by layouts, i.e. blobs evicted while in use.
+        """
+        total = 0
+        for layout in os.scandir(self.layout_dir):
+            blob_dir = os.path.join(layout.path, "blobs", "sha256")
+            if not os.path.isdir(blob_dir):
+                continue
+            for entry in os.scandir(blob_dir):
+                stat = entry.stat()
+                if stat.st_ino not in blob_inodes:
+                    total += stat.st_size
+        return total
+
+    def evict(self):
+        """
+        Removes the least recently used blobs that no layout links to, until
+        the cache and the files held only by layouts fit in `max_bytes`.
+        """
+        with self._lock:
+            entries = [(e, e.stat()) for e in os.scandir(self.blob_dir)
+                       if e.is_file() and not e.name.endswith(".tmp")]
+            entries.sort(key=lambda e: e[1].st_mtime)
+            total = sum(stat.st_size for _, stat in entries) + \
+                    self._layout_only_bytes({stat.st_ino for _, stat in entries})
+            for entry, stat in entries:
+                if total <= self.max_bytes:
+                    break
+                # Pinned by a layout, removing it would free nothing
+                if stat.st_nlink > 1:
+                    continue
+                total -= stat.st_size
+                os.remove(entry.path)
+
+    def prepare(self, registry: str, repository: str, tag: str) -> str:
+        """
+        Fetches any missing blobs of an image and assembles an OCI layout.
+
+        Returns:
+            The path of the layout. Release it with `release` after scanning.
+        """
+        repo = f"{registry}/{repository}"
+        manifest_bytes = self._fetch_manifest(f"{repo}:{tag}")
+        manifest = json.loads(manifest_bytes)
+        digests: List[str] = [manifest["config"]["digest"]] + \
+                             [layer["digest"] for layer in manifest["layers"]]
+
+        layout = os.path.join(self.layout_dir, uuid.uuid4().hex)
+        os.makedirs(os.path.join(layout, "blobs", "sha256"))
+        try:
+            for digest in digests:
+                self._fetch_blob(repo, digest, layout)
+        except Exception:
+            self.release(layout)
+            raise
+
+        manifest_digest = "sha256:" + hashlib.sha256(manifest_bytes).hexdigest()
+        with open(os.path.join(layout, "blobs", "sha256", manifest_digest.split(":", 1)[1]), "wb") as f:
+            f.write(manifest_bytes)
+
+        index: Dict = {
+            "schemaVersion": 2,
+            "manifests": [{
+                "mediaType": manifest.get("mediaType", "application/vnd.oci.image.manifest.v1+json"),
+                "digest": manifest_digest,
+                "size": len(manifest_bytes),
+                "annotations": {"org.opencontainers.image.ref.name": f"{repo}:{tag}"}
+            }]
+        }
+        with open(os.path.join(layout, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        with open(os.path.join(layout, "oci-layout"), "w", encoding="utf-8") as f:
+            json.dump({"imageLayoutVersion": "1.0.0"}, f)
+
+        self.evict()
+        return layout
+
+    def release(self, layout: str):
+        shutil.rmtree(layout, ignore_errors=True)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+_cache: LayerCache = None
+_cache_lock = threading.Lock()
+
+
+def get_layer_cache() -> LayerCache:
+    """
+    Returns the process-wide `LayerCache`, or `None` if OCI_CACHE_DIR is not set.
+    """
+    global _cache
+    if OCI_CACHE_DIR is None:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LayerCache(OCI_CACHE_DIR, OCI_CACHE_MAX_BYTES)
+            logging.info(f"Using OCI layer cache at {OCI_CACHE_DIR}")
+        return _cache
@@ -0,0 +1,196 @@
+"""
+The parser service. Loads raw grype reports written by the scanner,
+converts them to scan documents, and bulk-inserts them into MongoDB.
+
+Runs from the scanner image with `APP_MODULE=parser`.
+"""
+
+# Standard lib
+from typing import Dict, List, Tuple
+import os
+import json
+import logging
+from datetime import datetime
+
+# 3rd party
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from flask import Flask, request, jsonify
+
+# Local
+from app import (ScanArgs, build_document, ensure_indexes, error, mark_pending,
+                 write_side_effects, resume_side_effects,
+                 MONGO_DB_NAME, MONGO_COLLECTION_NAME, MONGO_URI, BLOB_DIR)
+from blob import LocalBlobStore
+from tracing import tracer, extract
+
+
+PARSE_BATCH_SIZE = int(os.environ.get("PARSE_BATCH_SIZE", 100))
+DUPLICATE_KEY_ERROR = 11000
+
+app = Flask(__name__)
+
+
+class MissingBlobs(FileNotFoundError):
+    """
+    Raised when blobs to parse are not in the store.
+    """
+    def __init__(self, keys: List[str]):
+        super().__init__(f"Blobs not found: {', '.join(keys)}")
+        self.keys = keys
+
+
+def parse_keys(json_data: Dict) -> List[str]:
+    if json_data is None:
+        raise ValueError("No JSON data was provided")
+
+    if "blob" in json_data:
+        return [json_data["blob"]]
+    if "blobs" in json_data:
+        return list(json_data["blobs"])
+    raise ValueError("Missing `blob` or `blobs` field")
+
+
+def load_document(key: str, store: LocalBlobStore) -> Tuple[Dict, List[Dict]]:
+    """
+    Builds the scan document of a blob, marked as having its side
+    writes pending.
+
+    Returns:
+        The document and the image's packages for the package index.
+    """
+    raw, meta = store.get_scan(key)
+    document = build_document(json.loads(raw),
+                              datetime.fromisoformat(meta["scan_start"]),
+                              meta["scan_duration_secs"],
+                              ScanArgs(**meta["args"]))
+    packages = meta.get("packages", [])
+    return mark_pending(document, packages), packages
+
+
+def parse_blobs(keys: List[str], store: LocalBlobStore, client: MongoClient) -> int:
+    """
+    Parses blobs in batches of `PARSE_BATCH_SIZE` and inserts them
+    with one `insert_many` per batch. Blobs are deleted once inserted.
+    Scans whose idempotency key is already stored are skipped, after
+    finishing any side writes that an earlier delivery left pending.
+
+    Returns:
+        The number of documents inserted.
+
+    Raises:
+        `MissingBlobs` after parsing the others if any blob is not in the store.
+    """
+    collection = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME]
+    ensure_indexes(client)
+    n_inserted = 0
+    missing = []
+
+    for i in range(0, len(keys), PARSE_BATCH_SIZE):
+        batch = keys[i:i + PARSE_BATCH_SIZE]
+        documents = []
+        packages = []
+        parsed = []
+        with tracer.start_as_current_span("parse", attributes={"gallery.blobs": len(batch)}):
+            for key in batch:
+                try:
+                    document, document_packages = load_document(key, store)
+                    documents.append(document)
+                    packages.append(document_packages)
+                    parsed.append(key)
+                except FileNotFoundError:
+                    logging.warning(f"Blob {key} not found")
+                    missing.append(key)
+
+        if len(documents) > 0:
+            duplicates = set()
+            try:
+                with tracer.start_as_current_span("insert", attributes={"gallery.documents": len(documents)}):
+                    collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(err["code"] != DUPLICATE_KEY_ERROR for err in errors):
+                    raise
+                duplicates = {err["index"] for err in errors}
+
+            for j, document in enumerate(documents):
+                if j in duplicates:
+                    resume_side_effects(document["idempotency_key"], client)
+                else:
+                    write_side_effects(document, client, packages[j])
+                    n_inserted += 1
+
+        for key in parsed:
+            store.delete(key)
+
+    if len(missing) > 0:
+        raise MissingBlobs(missing)
+    return n_inserted
+
+
+def already_parsed(json_data: Dict, client: MongoClient) -> bool:
+    """
+    Checks if the scan of a task was stored by an earlier delivery,
+    which then deleted its blob.
+    """
+    key = json_data.get("idempotency_key", None)
+    if key is None:
+        return False
+    return client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].find_one(
+        {"idempotency_key": key}, projection={"_id": 1}) is not None
+
+
+@app.route("/", methods=["POST"])
+def main():
+    try:
+        keys = parse_keys(request.json)
+
+        if MONGO_URI is None:
+            raise ValueError("MONGO_URI not provided")
+        client = MongoClient(MONGO_URI)
+
+        with tracer.start_as_current_span("parse_blobs", context=extract(request.headers)):
+            try:
+                n_inserted = parse_blobs(keys, LocalBlobStore(BLOB_DIR), client)
+            except MissingBlobs:
+                # Anything else is a lost scan. Fail so the task is retried and the loss is reported.
+                if not already_parsed(request.json, client):
+                    raise
+                n_inserted = 0
+
+    except Exception as e:
+        return error(e, 400)
+
+    return jsonify({"message": "success", "inserted": n_inserted}), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness check. The blob store must be mounted.
+    """
+    if MONGO_URI is None:
+        return error(ValueError("MONGO_URI not provided"), 503)
+    if not os.path.isdir(BLOB_DIR):
+        return error(FileNotFoundError(f"BLOB_DIR {BLOB_DIR} not found"), 503)
+    return jsonify({"message": "ready", "blob_dir": BLOB_DIR}), 200
+
+
+@app.route("/drain", methods=["POST"])
+def drain():
+    """
+    Parses every pending blob in the store. Useful for batch
+    runs on a schedule instead of one task per scan.
+    """
+    try:
+        if MONGO_URI is None:
+            raise ValueError("MONGO_URI not provided")
+        client = MongoClient(MONGO_URI)
+
+        store = LocalBlobStore(BLOB_DIR)
+        n_inserted = parse_blobs(store.pending(), store, client)
+
+    except Exception as e:
+        return error(e, 400)
+
+    return jsonify({"message": "success", "inserted": n_inserted}), 200
@@ -0,0 +1,147 @@
+"""
+Per-registry pull rate limiter shared by all scanner instances.
+
+Each registry has a token bucket stored in gallery.rate_limits:
+
+    {_id: registry, tokens, updated_at}
+
+Buckets are refilled and drawn from in a single `find_one_and_update`
+with an update pipeline, so concurrent instances never overdraw them.
+
+Limits are configured with REGISTRY_RATE_LIMITS as a comma-separated
+list of `registry=rate:burst`, where `rate` is pulls per second. For
+example `docker.io=1.5:10,cgr.dev=10:50`. Registries that are not
+listed use DEFAULT_RATE_LIMIT.
+"""
+
+# Standard lib
+from typing import Dict, Tuple
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, asdict
+
+# 3rd Party
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+
+REGISTRY_RATE_LIMITS = os.environ.get("REGISTRY_RATE_LIMITS",
+                                      "docker.io=1.5:10,cgr.dev=10:50,mcr.microsoft.com=5:25")
+DEFAULT_RATE_LIMIT = (5.0, 25.0)
+RATE_LIMIT_MAX_WAIT_SECS = float(os.environ.get("RATE_LIMIT_MAX_WAIT_SECS", 30))
+
+
+class Throttled(RuntimeError):
+    """
+    Raised when a registry has no tokens left within the wait budget.
+    The scan should be deferred, not failed.
+    """
+    def __init__(self, registry: str, retry_after: float):
+        super().__init__(f"Pulls from {registry} are throttled. Retry after {retry_after:.1f}s")
+        self.registry = registry
+        self.retry_after = retry_after
+
+
+@dataclass
+class RegistryStats:
+    acquired: int = 0
+    throttled: int = 0
+    wait_secs: float = 0.0
+    max_wait_secs: float = 0.0
+
+
+def parse_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in value.split(","):
+        if item.strip() == "":
+            continue
+        registry, limit = item.strip().split("=")
+        rate, burst = limit.split(":")
+        limits[registry] = (float(rate), float(burst))
+    return limits
+
+
+def _bucket_pipeline(rate: float, burst: float):
+    """
+    An update pipeline that refills a bucket for the time elapsed since
+    its last update and takes one token if available.
+    """
+    elapsed_secs = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+    refilled = {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed_secs, rate]}]}
+    return [
+        {"$set": {"tokens": {"$min": [burst, refilled]}, "updated_at": "$$NOW"}},
+        {"$set": {"granted": {"$gte": ["$tokens", 1]}}},
+        {"$set": {"tokens": {"$cond": ["$granted", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+    ]
+
+
+class RegistryRateLimiter:
+    """
+    A distributed token bucket per registry.
+    """
+    def __init__(self, collection: Collection, limits: Dict[str, Tuple[float, float]]=None,
+                 max_wait: float=RATE_LIMIT_MAX_WAIT_SECS):
+        """
+        collection (Collection): The collection holding the buckets.
+        limits (Dict, optional): Maps registries to (pulls per second, burst).
+        max_wait (float, optional): Seconds `acquire` waits before raising `Throttled`.
+        """
+        self.collection = collection
+        self.limits = parse_limits(REGISTRY_RATE_LIMITS) if limits is None else limits
+        self.max_wait = max_wait
+        self.stats: Dict[str, RegistryStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def try_acquire(self, registry: str) -> float:
+        """
+        Takes a token from the registry's bucket.
+
+        Returns:
+            0 if a token was taken, otherwise the seconds until one is available.
+        """
+        rate, burst = self.limits.get(registry, DEFAULT_RATE_LIMIT)
+        bucket = self.collection.find_one_and_update(
+            {"_id": registry}, _bucket_pipeline(rate, burst),
+            upsert=True, return_document=ReturnDocument.AFTER)
+        if bucket["granted"]:
+            return 0
+        return (1 - bucket["tokens"]) / rate
+
+    def record(self, registry: str, wait_secs: float, throttled: bool):
+        with self._stats_lock:
+            stats = self.stats.setdefault(registry, RegistryStats())
+            if throttled:
+                stats.throttled += 1
+            else:
+                stats.acquired += 1
+            stats.wait_secs += wait_secs
+            stats.max_wait_secs = max(stats.max_wait_secs, wait_secs)
+
+    def acquire(self, registry: str) -> float:
+        """
+        Waits for a token for up to `max_wait` seconds.
+
+        Returns:
+            The seconds spent waiting.
+
+        Raises:
+            `Throttled` if no token became available in time.
+        """
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(registry)
+            waited = time.monotonic() - start
+            if wait == 0:
+                self.record(registry, waited, throttled=False)
+                return waited
+            if waited + wait > self.max_wait:
+                self.record(registry, waited, throttled=True)
+                logging.warning(f"Throttled pull from {registry} after waiting {waited:.1f}s")
+                raise Throttled(registry, wait)
+            time.sleep(wait)
+
+    def metrics(self) -> Dict[str, Dict]:
+        with self._stats_lock:
+            return {registry: asdict(stats) for registry, stats in self.stats.items()}
@@ -0,0 +1,142 @@
+"""
+Rollups of open CVE matches, kept up to date as scans are stored, so
+trends do not need the remediation pipeline.
+
+gallery.open_cves holds one document per image and hour, and per image
+and day:
+
+    {granularity: "hour" | "day", bucket, registry, repository, tag,
+     scan_start, total, counts: {<severity>: {<fix_state>: n}}}
+
+`counts` are the distinct matches open at `scan_start`, the latest scan
+of the image in the bucket. A scan only replaces a rollup if it is at
+least as recent as the one the rollup was built from, so retries and
+out-of-order writes are safe. Buckets in which an image was not scanned
+have no document.
+
+Run `python rollup.py` to rebuild the rollups from stored scans.
+"""
+
+# Standard lib
+from typing import Dict, List
+import os
+from datetime import datetime
+
+# 3rd Party
+from pymongo import MongoClient, UpdateOne, ASCENDING
+
+
+MONGO_DB_NAME = "gallery"
+MONGO_COLLECTION_NAME = "cves"
+ROLLUPS_COLLECTION_NAME = "open_cves"
+MONGO_URI = os.environ.get("MONGO_URI", None)
+
+GRANULARITIES = ["hour", "day"]
+REBUILD_BATCH_SIZE = 1000
+
+_EPOCH = datetime(1970, 1, 1)
+_indexes_ensured = False
+
+
+def bucket(scan_start: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return scan_start.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return scan_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def open_counts(cves: List[Dict]) -> Dict[str, Dict[str, int]]:
+    """
+    Counts the distinct CVE matches of a scan by severity and fix state.
+    """
+    counts = {}
+    seen = set()
+    for cve in cves:
+        component = cve.get("component", None) or {}
+        key = (cve["id"], cve["severity"], cve["fix_state"],
+               component.get("name"), component.get("version"), component.get("type_"))
+        if key in seen:
+            continue
+        seen.add(key)
+
+        by_fix_state = counts.setdefault(cve["severity"] or "unknown", {})
+        fix_state = cve["fix_state"] or "unknown"
+        by_fix_state[fix_state] = by_fix_state.get(fix_state, 0) + 1
+    return counts
+
+
+def rollup_ops(document: Dict) -> List[UpdateOne]:
+    """
+    Builds the upserts that roll a scan document up into its hour and day.
+
+    Returns:
+        `UpdateOne` operations for `bulk_write` on gallery.open_cves.
+    """
+    counts = open_counts(document["cves"])
+    total = sum(n for by_fix_state in counts.values() for n in by_fix_state.values())
+    scan_start = document["scan_start"]
+
+    # Evaluated against the stored rollup, so older scans leave it as is
+    newer = {"$lte": [{"$ifNull": ["$scan_start", _EPOCH]}, scan_start]}
+    update = [{"$set": {"scan_start": {"$cond": [newer, scan_start, "$scan_start"]},
+                        "total": {"$cond": [newer, total, "$total"]},
+                        "counts": {"$cond": [newer, {"$literal": counts}, "$counts"]}}}]
+
+    ops = []
+    for granularity in GRANULARITIES:
+        key = {"granularity": granularity,
+               "registry": document["registry"],
+               "repository": document["repository"],
+               "tag": document["tag"],
+               "bucket": bucket(scan_start, granularity)}
+        ops.append(UpdateOne(key, update, upsert=True))
+    return ops
+
+
+def ensure_indexes(client: MongoClient):
+    collection = client[MONGO_DB_NAME][ROLLUPS_COLLECTION_NAME]
+    collection.create_index([("granularity", ASCENDING), ("registry", ASCENDING),
+                             ("repository", ASCENDING), ("tag", ASCENDING),
+                             ("bucket", ASCENDING)], unique=True)
+    collection.create_index([("granularity", ASCENDING), ("bucket", ASCENDING)])
+
+
+def update_rollups(document: Dict, client: MongoClient):
+    global _indexes_ensured
+    if not _indexes_ensured:
+        ensure_indexes(client)
+        _indexes_ensured = True
+
+    client[MONGO_DB_NAME][ROLLUPS_COLLECTION_NAME].bulk_write(rollup_ops(document), ordered=False)
+
+
+def rebuild_rollups(client: MongoClient) -> int:
+    """
+    Rolls up every stored scan. Existing rollups are kept unless a
+    stored scan is more recent.
+
+    Returns:
+        The number of scans rolled up.
+    """
+    ensure_indexes(client)
+    collection = client[MONGO_DB_NAME][ROLLUPS_COLLECTION_NAME]
+    scans = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME].find(
+        {}, {"registry": 1, "repository": 1, "tag": 1, "scan_start": 1, "cves": 1})
+
+    n_scans = 0
+    ops = []
+    for scan in scans:
+        ops += rollup_ops(scan)
+        n_scans += 1
+        if len(ops) >= REBUILD_BATCH_SIZE:
+            collection.bulk_write(ops, ordered=False)
+            ops = []
+    if len(ops) > 0:
+        collection.bulk_write(ops, ordered=False)
+    return n_scans
+
+
+if __name__ == "__main__":
+    with MongoClient(MONGO_URI) as client:
+        print(f"Rolled up {rebuild_rollups(client)} scans")
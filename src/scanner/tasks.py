@@ -0,0 +1,59 @@
+# Standard lib
+from typing import Dict
+import os
+import json
+import uuid
+
+# 3rd party
+from google.cloud import tasks_v2
+import google.oauth2.id_token
+import google.auth.transport.requests
+
+# Local
+from tracing import inject
+
+
+CLOUD_PROJECT_NAME = os.environ.get("CLOUD_PROJECT_NAME", None)
+CLOUD_QUEUE_LOCATION = os.environ.get("CLOUD_QUEUE_LOCATION", None)
+PARSE_QUEUE_NAME = os.environ.get("PARSE_QUEUE_NAME", None)
+PARSER_URL = os.environ.get("PARSER_URL", None)
+
+
+def get_auth_token() -> str:
+    audience = PARSER_URL
+    client = google.auth.transport.requests.Request()
+    id_token = google.oauth2.id_token.fetch_id_token(client, audience)
+    return id_token
+
+
+def push_parse_task(data: Dict, client):
+    """
+    Push `data` to the parse queue.
+    """
+    for name in ["CLOUD_PROJECT_NAME", "CLOUD_QUEUE_LOCATION", "PARSER_URL"]:
+        if globals()[name] is None:
+            raise ValueError(f"{name} not provided")
+
+    task_id = str(uuid.uuid4())
+    task_path = client.task_path(CLOUD_PROJECT_NAME, CLOUD_QUEUE_LOCATION, PARSE_QUEUE_NAME, task_id)
+
+    headers = inject({
+        "Content-type": "application/json",
+        "Authorization": f"Bearer {get_auth_token()}"
+    })
+
+    task = tasks_v2.Task(
+        http_request=tasks_v2.HttpRequest(
+        http_method=tasks_v2.HttpMethod.POST,
+        url=PARSER_URL,
+        headers=headers,
+        body=json.dumps(data).encode()),
+        name=task_path
+    )
+
+    client.create_task(
+        tasks_v2.CreateTaskRequest(
+            parent=client.queue_path(CLOUD_PROJECT_NAME, CLOUD_QUEUE_LOCATION, PARSE_QUEUE_NAME),
+            task=task,
+        )
+    )
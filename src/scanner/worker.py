@@ -0,0 +1,71 @@
+"""
+Pull-based scanner worker for the MongoDB queue backend
+(`QUEUE_BACKEND=mongo` on the publisher).
+
+Claims up to `WORKER_CONCURRENCY` jobs at a time and scans them in
+parallel. New jobs are only claimed once the current batch is done, so
+a busy worker never holds more leases than it can process.
+
+Run with `python worker.py`.
+"""
+
+# Standard lib
+from typing import Dict
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd Party
+from pymongo import MongoClient
+
+# Local
+from app import (parse_args, process_scan, grype_db, span_attributes,
+                 MONGO_DB_NAME, MONGO_URI, SCAN_TIMEOUT_SECS)
+from jobqueue import MongoJobClaimer, JOB_QUEUE_COLLECTION_NAME
+from ratelimit import Throttled
+from tracing import tracer, extract
+
+
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", os.cpu_count() or 1))
+WORKER_POLL_SECS = float(os.environ.get("WORKER_POLL_SECS", 5))
+# Leases must outlive the slowest scan, including the parse and store
+VISIBILITY_TIMEOUT_SECS = float(os.environ.get("VISIBILITY_TIMEOUT_SECS", SCAN_TIMEOUT_SECS + 120))
+
+
+def handle_job(job: Dict, queue: MongoJobClaimer, client: MongoClient):
+    try:
+        args = parse_args(job["data"])
+        with tracer.start_as_current_span("scan", context=extract(job.get("trace", None)),
+                                          attributes=span_attributes(args)):
+            process_scan(args, client)
+        queue.ack(job)
+    except Throttled as e:
+        queue.defer(job, e.retry_after)
+    except Exception as e:
+        logging.error(f"Error processing job {job['_id']}: {e}")
+        queue.fail(job, str(e))
+
+
+def run():
+    if MONGO_URI is None:
+        raise ValueError("MONGO_URI not provided")
+
+    client = MongoClient(MONGO_URI)
+    queue = MongoJobClaimer(client[MONGO_DB_NAME][JOB_QUEUE_COLLECTION_NAME],
+                            visibility_timeout=VISIBILITY_TIMEOUT_SECS)
+    queue.ensure_indexes()
+    grype_db()
+
+    with ThreadPoolExecutor(WORKER_CONCURRENCY) as pool:
+        while True:
+            jobs = queue.claim(WORKER_CONCURRENCY)
+            if len(jobs) == 0:
+                time.sleep(WORKER_POLL_SECS)
+                continue
+            list(pool.map(lambda job: handle_job(job, queue, client), jobs))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run()
@@ -1,11 +1,17 @@
 # Stadnard lib
-from typing import Dict
+from typing import Dict, List
 from datetime import datetime
 
 # 3rd party
 import pytest
 from gryft.scanning.types import CVE, Component
 
+# Local
+import src.analysis.stat as stat
+import src.analysis.remediation as rem
+import src.analysis.synthetic as syn
+from tests.mongo import TEST_MONGO_URI, scan_db, module_scan_db
+
 
 @pytest.fixture
 def cve_001_python() -> CVE:
@@ -82,3 +88,14 @@ def empty_scan() -> Dict:
         "latest": "tag",
         "cves": []
     }
+
+
+def synthetic_tables(config: syn.HistoryConfig, images: List[Dict]=None) -> List[stat.RemediationTable]:
+    """
+    The remediation table of every image of a synthetic history, or only
+    of `images` if given.
+    """
+    keys = None if images is None else {(img["registry"], img["repository"], img["tag"]) for img in images}
+    return [stat.RemediationTable.from_remediations(image, rem._collect_image_remediations(scans))
+            for image, scans in syn.synthetic_history(config)
+            if keys is None or (image["registry"], image["repository"], image["tag"]) in keys]
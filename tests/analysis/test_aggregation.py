@@ -0,0 +1,80 @@
+# Standard lib
+from typing import Dict, List
+from collections import Counter
+from datetime import timedelta
+import copy
+
+# 3rd party
+from pymongo import ASCENDING
+
+# Local
+import src.analysis.aggregation as agg
+import src.analysis.remediation as rem
+import src.analysis.synthetic as syn
+from fixtures import (cve_001_python_dict,
+                      cve_001_jre_dict,
+                      cve_001_none_dict,
+                      small_scan,
+                      scan_db)
+
+
+def _assert_parity(collection, images: List[Dict]):
+    """
+    Checks that both engines find the same remediations in the stored scans.
+    """
+    remediations = agg.collect_remediations(collection)
+    for img in images:
+        key = tuple(img[k] for k in agg.IMAGE_KEYS)
+        scans = collection.find({k: img[k] for k in agg.IMAGE_KEYS}) \
+                          .sort([("scan_start", ASCENDING)])
+        expected = rem._collect_image_remediations(scans)
+        assert Counter(remediations.get(key, [])) == Counter(expected)
+
+
+def _hourly(scan: Dict, cves: List[List[Dict]]) -> List[Dict]:
+    scans = []
+    for i, c in enumerate(cves):
+        s = copy.deepcopy(scan)
+        s["scan_start"] = scan["scan_start"] + timedelta(hours=i)
+        s["cves"] = copy.deepcopy(c)
+        scans.append(s)
+    return scans
+
+
+def test__collect_remediations__synthetic(scan_db):
+    config = syn.HistoryConfig(n_images=10, days=3, rebuild_rate=0.2, discovery_rate=24,
+                               late_start=0.5, n_cves=50, n_packages=5)
+    syn.load(config, scan_db.client, scan_db.name)
+    _assert_parity(scan_db["cves"], syn.synthetic_images(config))
+
+
+def test__collect_remediations__reappearing(scan_db, small_scan, cve_001_python_dict,
+                                                 cve_001_jre_dict, cve_001_none_dict):
+    python, jre, none = cve_001_python_dict, cve_001_jre_dict, cve_001_none_dict
+    scans = _hourly(small_scan, [[python], [python, jre], [jre, none], [none],
+                                 [python, none], [python, none, none]])
+    scan_db["cves"].insert_many(scans)
+
+    remediations = agg.collect_remediations(scan_db["cves"])
+    key = ("cgr.dev", "chainguard/python", "latest")
+    # python is present at the first scan, so neither of its intervals has a first_seen_at
+    assert sorted((r.cve.id, r.cve.component.name or "", r.first_seen_at is None, r.remediated_at is None)
+                  for r in remediations[key]) == [("CVE_001", "", False, True),
+                                                   ("CVE_001", "jre", False, False),
+                                                   ("CVE_001", "python3.10", True, False),
+                                                   ("CVE_001", "python3.10", True, True)]
+    _assert_parity(scan_db["cves"], [small_scan])
+
+
+def test__collect_remediations__single_and_empty_scans(scan_db, small_scan):
+    empty = dict(copy.deepcopy(small_scan), repository="chainguard/static", cves=[])
+    scan_db["cves"].insert_many([copy.deepcopy(small_scan), empty])
+    _assert_parity(scan_db["cves"], [small_scan, empty])
+
+
+def test__collect_remediations__query(scan_db, small_scan, cve_001_jre_dict):
+    other = dict(copy.deepcopy(small_scan), repository="chainguard/jre")
+    scan_db["cves"].insert_many(_hourly(small_scan, [[], [cve_001_jre_dict]]) +
+                                _hourly(other, [[cve_001_jre_dict], []]))
+    remediations = agg.collect_remediations(scan_db["cves"], {"repository": "chainguard/jre"})
+    assert list(remediations.keys()) == [("cgr.dev", "chainguard/jre", "latest")]
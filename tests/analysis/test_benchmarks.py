@@ -0,0 +1,163 @@
+# Standard lib
+from typing import Callable, Dict, List
+import os
+import tracemalloc
+
+# 3rd party
+import pytest
+from pymongo import ASCENDING
+
+# Local
+import src.analysis.stat as stat
+import src.analysis.remediation as rem
+import src.analysis.synthetic as syn
+import src.analysis.aggregation as agg
+import src.analysis.survival as surv
+from fixtures import module_scan_db, synthetic_tables
+
+
+pytest.importorskip("pytest_benchmark")
+
+# Only `small` runs with the rest of the tests. `make benchmark-analysis` runs all sizes.
+SIZES = {
+    "small": syn.HistoryConfig(n_images=20, days=7),
+    "medium": syn.HistoryConfig(n_images=200, days=30),
+    "large": syn.HistoryConfig(n_images=1000, days=90),
+}
+SELECTED = os.environ.get("ANALYSIS_BENCHMARK_SIZES", "small").split(",")
+SIZE_PARAMS = [pytest.param(SIZES[s], id=s) for s in SELECTED]
+
+_tables: Dict[int, List[stat.RemediationTable]] = {}
+_loaded: Dict[int, str] = {}
+
+
+def _measure(benchmark, fn: Callable, *args):
+    """
+    Benchmarks `fn(*args)` and records the peak memory of an untimed call.
+    """
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_memory_mb"] = peak / 2 ** 20
+    return benchmark(fn, *args)
+
+
+def _image_tables(config: syn.HistoryConfig) -> List[stat.RemediationTable]:
+    """
+    The remediation table of every image, computed once per size.
+    """
+    key = id(config)
+    if key not in _tables:
+        _tables[key] = synthetic_tables(config)
+    return _tables[key]
+
+
+def _loaded_scans(db, config: syn.HistoryConfig):
+    """
+    The collection holding the history of a size, loaded once per module.
+    """
+    key = id(config)
+    if key not in _loaded:
+        _loaded[key] = f"cves_{len(_loaded)}"
+        syn.load(config, db.client, db.name)
+        db["cves"].rename(_loaded[key])
+        agg.ensure_indexes(db[_loaded[key]])
+    return db[_loaded[key]]
+
+
+def _python_engine(collection, images: List[Dict]):
+    for img in images:
+        scans = collection.find({k: img[k] for k in agg.IMAGE_KEYS}) \
+                          .sort([("scan_start", ASCENDING)])
+        rem._collect_image_remediations(scans)
+
+
+@pytest.fixture
+def offline_fetch(monkeypatch):
+    """
+    Serves the first and latest scan times from the generator instead of MongoDB.
+    """
+    def use(config: syn.HistoryConfig):
+        monkeypatch.setattr(stat, "global_latest_scan", lambda: config.end)
+        monkeypatch.setattr(stat, "images_first_scan", lambda: syn.first_scans(config))
+    return use
+
+
+def test__synthetic_history__seeded():
+    config = syn.HistoryConfig(n_images=3, days=2, rebuild_rate=0.2)
+    first = [list(scans) for _, scans in syn.synthetic_history(config)]
+    second = [list(scans) for _, scans in syn.synthetic_history(config)]
+    assert first == second
+    assert all(len(scans) > 0 for scans in first)
+    assert len({len(s["cves"]) for scans in first for s in scans}) > 1
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__collect_image_remediations(benchmark, config):
+    image = syn.synthetic_images(config)[0]
+    scans = list(syn.image_scans(config, image, 0))
+    benchmark.extra_info["scans"] = len(scans)
+    _measure(benchmark, rem._collect_image_remediations, scans)
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__from_remediations(benchmark, config):
+    image = syn.synthetic_images(config)[0]
+    remediations = rem._collect_image_remediations(syn.image_scans(config, image, 0))
+    benchmark.extra_info["remediations"] = len(remediations)
+    _measure(benchmark, stat.RemediationTable.from_remediations, image, remediations)
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__concat(benchmark, config):
+    tables = _image_tables(config)
+    benchmark.extra_info["tables"] = len(tables)
+    _measure(benchmark, stat.concat, tables)
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__resolve_edge_cases(benchmark, config, offline_fetch):
+    offline_fetch(config)
+    table = stat.concat(_image_tables(config))
+    benchmark.extra_info["rows"] = table._df.shape[0]
+    _measure(benchmark, table.resolve_edge_cases)
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__cve_stats(benchmark, config):
+    table = stat.concat(_image_tables(config))
+    benchmark.extra_info["rows"] = table._df.shape[0]
+    _measure(benchmark, table.cve_stats)
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__image_summary(benchmark, config, offline_fetch):
+    offline_fetch(config)
+    table = stat.concat(_image_tables(config)).resolve_edge_cases()
+    benchmark.extra_info["rows"] = table._df.shape[0]
+    _measure(benchmark, table.image_summary)
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__survival_curves(benchmark, config):
+    table = stat.concat(_image_tables(config))
+    benchmark.extra_info["rows"] = table._df.shape[0]
+    _measure(benchmark, surv.survival_curves, table, ["registry"],
+             syn.first_scans(config), config.end)
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__engine__python(benchmark, config, module_scan_db):
+    collection = _loaded_scans(module_scan_db, config)
+    benchmark.extra_info["scans"] = collection.estimated_document_count()
+    _measure(benchmark, _python_engine, collection, syn.synthetic_images(config))
+
+
+@pytest.mark.parametrize("config", SIZE_PARAMS)
+def test__engine__mongo(benchmark, config, module_scan_db):
+    collection = _loaded_scans(module_scan_db, config)
+    benchmark.extra_info["scans"] = collection.estimated_document_count()
+    _measure(benchmark, agg.collect_remediations, collection)
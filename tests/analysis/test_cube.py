@@ -0,0 +1,84 @@
+# 3rd party
+import pytest
+import pandas as pd
+
+# Local
+import src.analysis.cube as cube
+import src.analysis.stat as stat
+import src.analysis.synthetic as syn
+from fixtures import synthetic_tables
+
+
+CONFIG = syn.HistoryConfig(n_images=8, days=4, rebuild_rate=0.1, discovery_rate=6, late_start=0.3)
+
+
+@pytest.fixture
+def table() -> stat.RemediationTable:
+    return stat.concat(synthetic_tables(CONFIG))
+
+
+def _assert_stats_equal(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert actual[key] == pytest.approx(expected[key])
+
+
+def test__cve_stats(table):
+    c = cube.RemediationCube.from_table(table)
+    _assert_stats_equal(c.cve_stats(), table.cve_stats())
+    _assert_stats_equal(c.cve_stats(registry="cgr.dev"), table.filter(registry="cgr.dev").cve_stats())
+    _assert_stats_equal(c.cve_stats(labels="base"), table.filter(label="base").cve_stats())
+
+    severe = stat.RemediationTable(table._df[table._df["severity"].isin(["critical", "high"])])
+    _assert_stats_equal(c.cve_stats(severity=["critical", "high"]), severe.cve_stats())
+
+
+def test__rtime_stats(table):
+    resolved = table.resolve_edge_cases(first_seen_at=False, remediated_at=False)
+    c = cube.RemediationCube.from_table(resolved)
+    rtime = resolved.remediated()["rtime"]
+    stats = c.rtime_stats()
+    assert stats["rtime_mean"] == pytest.approx(rtime.mean())
+    assert stats["rtime_std"] == pytest.approx(rtime.std())
+
+
+def test__image_summary(table):
+    expected = table.image_summary()
+    actual = cube.RemediationCube.from_table(table).image_summary()
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test__rollup__weeks(table):
+    df = cube.RemediationCube.from_table(table).rollup(["week"])
+    discovered = table.discovered()
+    weeks = pd.to_datetime(discovered["first_seen_at"]).dt.to_period("W").dt.start_time
+    assert df.dropna(subset=["week"])["n_discovered"].tolist() == weeks.value_counts().sort_index().tolist()
+
+
+def test__refresh(table):
+    config = syn.HistoryConfig(**{**CONFIG.__dict__, "days": 6})
+    images = syn.synthetic_images(config)
+    longer = synthetic_tables(config)
+
+    refreshed = cube.RemediationCube.from_table(table) \
+                    .refresh(stat.concat(longer[:2]), images=images[:2])
+    expected = stat.concat(longer[:2] + synthetic_tables(CONFIG)[2:])
+    _assert_stats_equal(refreshed.cve_stats(), expected.cve_stats())
+
+
+def test__save_load(table, tmp_path):
+    c = cube.RemediationCube.from_table(table)
+    c.save(str(tmp_path / "cube.pkl"))
+    loaded = cube.RemediationCube.load(str(tmp_path / "cube.pkl"))
+    assert loaded.cve_stats(registry="docker.io") == c.cve_stats(registry="docker.io")
+
+
+def test__rtime_quantile(table):
+    resolved = table.resolve_edge_cases(first_seen_at=False, remediated_at=False)
+    c = cube.RemediationCube.from_table(resolved)
+    rtime = resolved.filter(registry="cgr.dev").remediated()["rtime"]
+    # Synthetic rtimes take few distinct values, so the estimates are close to exact
+    assert c.rtime_quantile(0.5, registry="cgr.dev") == pytest.approx(rtime.median(), rel=0.05)
+
+    df = c.rollup(["registry"], quantiles=[0.5, 0.9])
+    assert list(df.columns[-2:]) == ["rtime_p50", "rtime_p90"]
@@ -0,0 +1,108 @@
+# Standard lib
+import threading
+from collections import Counter
+
+# 3rd party
+import pytest
+
+# Local
+import src.analysis.pipeline as pl
+
+
+CALLS = Counter()
+
+
+def _source(n: int) -> list:
+    CALLS["source"] += 1
+    return list(range(n))
+
+
+def _total(xs: list) -> int:
+    CALLS["total"] += 1
+    return sum(xs)
+
+
+def _count(xs: list) -> int:
+    CALLS["count"] += 1
+    return len(xs)
+
+
+def _mean(total: int, count: int) -> float:
+    CALLS["mean"] += 1
+    return total / count
+
+
+def _pipeline(tmp_path, n: int=10, watermark: str="w1") -> pl.Pipeline:
+    stages = [
+        pl.Stage("mean", _mean, ["total", "count"]),
+        pl.Stage("total", _total, ["source"]),
+        pl.Stage("count", _count, ["source"]),
+        pl.Stage("source", _source, params={"n": n}, reads_data=True),
+    ]
+    return pl.Pipeline(stages, cache_dir=str(tmp_path), watermark=lambda: watermark)
+
+
+@pytest.fixture(autouse=True)
+def calls():
+    CALLS.clear()
+    return CALLS
+
+
+def test__run__caches(tmp_path, calls):
+    assert _pipeline(tmp_path).run() == {"source": list(range(10)), "total": 45, "count": 10, "mean": 4.5}
+    assert set(calls) == {"source", "total", "count", "mean"}
+
+    calls.clear()
+    pipeline = _pipeline(tmp_path)
+    assert pipeline.run(["mean"]) == {"mean": 4.5}
+    assert pipeline.computed == [] and not calls
+
+
+def test__run__recomputes_changed(tmp_path, calls):
+    _pipeline(tmp_path).run()
+
+    calls.clear()
+    pipeline = _pipeline(tmp_path, watermark="w2")
+    assert pipeline.run(["mean"]) == {"mean": 4.5}
+    assert sorted(pipeline.computed) == ["count", "mean", "source", "total"]
+
+    # Only downstream of a forced stage
+    calls.clear()
+    pipeline = _pipeline(tmp_path)
+    pipeline.run(["mean"], force=["mean"])
+    assert pipeline.computed == ["mean"]
+
+    # A changed param changes the keys of everything downstream
+    keys, changed = _pipeline(tmp_path).keys(), _pipeline(tmp_path, n=4).keys()
+    assert all(keys[n] != changed[n] for n in keys)
+
+
+def test__run__parallel(tmp_path):
+    # Deadlocks unless both stages run at once
+    barrier = threading.Barrier(2, timeout=5)
+    stages = [pl.Stage("a", barrier.wait), pl.Stage("b", barrier.wait)]
+    pl.Pipeline(stages, cache_dir=str(tmp_path), workers=2).run()
+
+
+def test__pipeline__invalid(tmp_path):
+    with pytest.raises(ValueError):
+        pl.Pipeline([pl.Stage("a", _total, ["b"])], cache_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        pl.Pipeline([pl.Stage("a", _total, ["b"]), pl.Stage("b", _total, ["a"])], cache_dir=str(tmp_path))
+
+
+def test__prune(tmp_path):
+    _pipeline(tmp_path).run()
+    pipeline = _pipeline(tmp_path, n=4)
+    pipeline.run()
+    assert pipeline.prune() == 4
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test__analysis_pipeline__data_stages(tmp_path):
+    pipeline = pl.analysis_pipeline([], cache_dir=str(tmp_path))
+    assert pipeline.watermark is pl.data_watermark
+    # Stages that read gallery are invalidated by changes to the fetch helpers
+    for name in ["images", "remediations", "resolved"]:
+        assert pipeline.stages[name].reads_data
+        assert pl.fetch in pipeline.stages[name].depends
@@ -0,0 +1,59 @@
+# Standard lib
+from typing import Dict
+from datetime import datetime, timedelta
+import copy
+
+# 3rd party
+import pytest
+
+# Local
+import src.analysis.retention as ret
+import src.analysis.remediation as rem
+from fixtures import (cve_001_python_dict,
+                      cve_001_jre_dict,
+                      small_scan)
+
+
+def _hourly(scan: Dict, n: int) -> list:
+    scans = []
+    for i in range(n):
+        s = copy.deepcopy(scan)
+        s["scan_start"] = scan["scan_start"] + timedelta(hours=i)
+        scans.append(s)
+    return scans
+
+
+# _select_removable
+
+def test___select_removable__unchanged(small_scan):
+    scans = _hourly(small_scan, 5)
+    removable = ret._select_removable(scans)
+    assert removable == scans[1:]
+
+
+def test___select_removable__keeps_changes(small_scan, cve_001_jre_dict):
+    scans = _hourly(small_scan, 5)
+    scans[2]["cves"].append(cve_001_jre_dict)
+    scans[3]["cves"].append(cve_001_jre_dict)
+    removable = ret._select_removable(scans)
+    assert removable == [scans[1], scans[3]]
+
+
+def test___select_removable__daily_checkpoint(small_scan):
+    scans = _hourly(small_scan, 48)
+    removable = ret._select_removable(scans)
+    kept = [s for s in scans if s not in removable]
+    assert [s["scan_start"].date() for s in kept] == [datetime(2024, 1, 1).date(),
+                                                      datetime(2024, 1, 2).date(),
+                                                      datetime(2024, 1, 3).date()]
+
+
+def test___select_removable__same_remediations(small_scan, cve_001_jre_dict):
+    scans = _hourly(small_scan, 30)
+    for s in scans[5:12]:
+        s["cves"].append(cve_001_jre_dict)
+    for s in scans[20:]:
+        s["cves"] = []
+    removable = ret._select_removable(scans)
+    kept = [s for s in scans if s not in removable]
+    assert rem._collect_image_remediations(kept) == rem._collect_image_remediations(scans)
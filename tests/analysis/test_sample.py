@@ -0,0 +1,71 @@
+# Standard lib
+from typing import List
+from collections import Counter
+
+# 3rd party
+import pytest
+import numpy as np
+
+# Local
+import src.analysis.sample as smp
+import src.analysis.stat as stat
+import src.analysis.synthetic as syn
+from fixtures import synthetic_tables
+
+
+CONFIG = syn.HistoryConfig(n_images=40, days=4, rebuild_rate=0.1, discovery_rate=6)
+
+
+def _table(images: List[dict]) -> stat.RemediationTable:
+    return stat.concat(synthetic_tables(CONFIG, images))
+
+
+@pytest.fixture
+def images() -> List[dict]:
+    return syn.synthetic_images(CONFIG)
+
+
+def test__sample_images(images):
+    sample = smp.sample_images(images, 0.25, seed=1)
+    assert {smp.stratum(img) for img in sample.images} == {smp.stratum(img) for img in images}
+    assert sample.weights.sum() == pytest.approx(len(images))
+    assert sample.images == smp.sample_images(images, 0.25, seed=1).images
+    assert sample.images != smp.sample_images(images, 0.25, seed=2).images
+
+    with pytest.raises(ValueError):
+        smp.sample_images(images, 0)
+
+
+def test__estimate_stats__census(images):
+    table = _table(images)
+    sample = smp.sample_images(images, 1)
+    df = smp.estimate_stats(table, sample, n_boot=50)
+
+    expected = table.cve_stats()
+    for key, value in expected.items():
+        assert df.loc[key, "estimate"] == pytest.approx(value)
+        # A census has no sampling error
+        assert df.loc[key, "low"] == pytest.approx(value)
+        assert df.loc[key, "high"] == pytest.approx(value)
+
+
+def test__estimate_stats__sample(images):
+    full = _table(images).cve_stats()
+    sample = smp.sample_images(images, 0.5, seed=3)
+    df = smp.estimate_stats(_table(sample.images), sample, n_boot=200)
+
+    assert (df["low"] <= df["estimate"]).all() and (df["estimate"] <= df["high"]).all()
+    assert df.loc["n_discovered", "estimate"] == pytest.approx(full["n_discovered"], rel=0.3)
+    assert np.isfinite(df.loc["rtime_mean", "estimate"])
+
+
+def test__estimate_stats__small_fraction(images):
+    # Every stratum still samples two images, so the intervals are not degenerate
+    full = _table(images).cve_stats()
+    sample = smp.sample_images(images, 0.05, seed=0)
+    assert min(Counter(sample.strata).values()) >= 2
+    df = smp.estimate_stats(_table(sample.images), sample, n_boot=500)
+
+    for stat_name in ["n_discovered", "n_remediated"]:
+        assert df.loc[stat_name, "low"] < df.loc[stat_name, "high"]
+        assert df.loc[stat_name, "low"] <= full[stat_name] <= df.loc[stat_name, "high"]
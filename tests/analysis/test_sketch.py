@@ -0,0 +1,102 @@
+# Standard lib
+from typing import List
+
+# 3rd party
+import pytest
+import numpy as np
+
+# Local
+import src.analysis.sketch as sketch
+import src.analysis.stat as stat
+import src.analysis.synthetic as syn
+from fixtures import synthetic_tables
+
+
+QUANTILES = [0.01, 0.1, 0.5, 0.9, 0.99]
+
+
+def _rank_error(values: np.ndarray, estimates: np.ndarray, qs: List[float]) -> float:
+    """
+    The largest difference between the requested quantile and the
+    quantile of the estimate among `values`.
+    """
+    values = np.sort(values)
+    ranks = np.searchsorted(values, estimates) / len(values)
+    return float(np.max(np.abs(ranks - np.array(qs))))
+
+
+@pytest.fixture
+def values() -> np.ndarray:
+    return np.random.default_rng(0).lognormal(3, 1.5, 100_000)
+
+
+def test__tdigest__accuracy(values):
+    digest = sketch.TDigest.from_values(values)
+    assert len(digest.means) < 1000
+    assert digest.count == len(values)
+    assert _rank_error(values, digest.quantile(QUANTILES), QUANTILES) < 0.005
+    assert digest.quantile(0) == values.min()
+    assert digest.quantile(1) == values.max()
+
+
+def test__tdigest__merge(values):
+    parts = [sketch.TDigest.from_values(chunk) for chunk in np.array_split(values, 16)]
+    merged = sketch.TDigest.merge_all(parts)
+    assert merged.count == len(values)
+    assert _rank_error(values, merged.quantile(QUANTILES), QUANTILES) < 0.005
+
+
+def test__tdigest__incremental(values):
+    digest = sketch.TDigest()
+    for chunk in np.array_split(values, 50):
+        digest.update(chunk)
+    assert _rank_error(values, digest.quantile(QUANTILES), QUANTILES) < 0.01
+
+
+def test__tdigest__empty_and_dict():
+    assert np.isnan(sketch.TDigest().quantile(0.5))
+    digest = sketch.TDigest.from_values([1, 2, 3, np.nan])
+    restored = sketch.TDigest.from_dict(digest.to_dict())
+    assert restored.count == 3
+    assert restored.quantile(0.5) == digest.quantile(0.5) == 2
+
+
+def test__rtime_sketches__merge_copies():
+    a, b = sketch.RtimeSketches(["registry"]), sketch.RtimeSketches(["registry"])
+    a.digests[("x",)] = sketch.TDigest.from_values([1, 2, 3])
+    b.digests[("y",)] = sketch.TDigest.from_values([4])
+    assert a.quantile(0.5) == 2
+
+    merged = a.merge(b)
+    for digest in merged.digests.values():
+        digest.update([100] * 5)
+
+    # Updating the merged sketches leaves the inputs and their cached quantiles alone
+    assert a.digests[("x",)].count == 3
+    assert b.digests[("y",)].count == 1
+    a._cache.clear()
+    assert a.quantile(0.5) == 2
+
+
+def test__rtime_sketches(tmp_path):
+    config = syn.HistoryConfig(n_images=10, days=5, rebuild_rate=0.1, discovery_rate=12)
+    tables = synthetic_tables(config)
+    table = stat.concat(tables).resolve_edge_cases(first_seen_at=False, remediated_at=False)
+
+    # Built one image at a time on two "workers", then merged
+    first, second = sketch.RtimeSketches(["registry", "severity"]), sketch.RtimeSketches(["registry", "severity"])
+    for i, t in enumerate(tables):
+        (first if i % 2 else second).add_table(t)
+    sketches = first.merge(second)
+
+    rtime = table.filter(registry="cgr.dev").remediated()["rtime"].dropna().to_numpy()
+    estimates = sketches.quantile(QUANTILES, registry="cgr.dev")
+    assert _rank_error(rtime, estimates, QUANTILES) < 0.02
+
+    summary = sketches.summary(groups=["registry"])
+    assert summary["n_rtime"].sum() == table.remediated()["rtime"].notna().sum()
+
+    sketches.save(str(tmp_path / "sketches.pkl"))
+    loaded = sketch.RtimeSketches.load(str(tmp_path / "sketches.pkl"))
+    assert loaded.quantile(0.5, severity=["critical", "high"]) == \
+        sketches.quantile(0.5, severity=["critical", "high"])
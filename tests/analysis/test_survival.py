@@ -0,0 +1,85 @@
+# Standard lib
+from datetime import datetime
+
+# 3rd party
+import pytest
+import numpy as np
+import pandas as pd
+
+# Local
+import src.analysis.survival as surv
+from src.analysis.stat import RemediationTable
+
+
+def _row(repository: str, cve: str, first_seen_at, remediated_at) -> dict:
+    return {"registry": "cgr.dev", "repository": repository, "tag": "latest", "labels": "",
+            "id": cve, "severity": "high", "fix_state": "fixed",
+            "first_seen_at": first_seen_at, "remediated_at": remediated_at}
+
+
+def test__kaplan_meier__uncensored():
+    curve = surv.kaplan_meier(np.zeros(10), np.arange(1, 11), np.ones(10, dtype=bool))
+    assert curve.survival[-1] == 0
+    assert curve.median() == 5
+
+
+def test__kaplan_meier__censored():
+    curve = surv.kaplan_meier(np.zeros(5), [1, 2, 2, 3, 4], [True, True, False, True, False])
+    np.testing.assert_allclose(curve.times, [1, 2, 3])
+    np.testing.assert_allclose(curve.at_risk, [5, 4, 2])
+    np.testing.assert_allclose(curve.survival, [0.8, 0.6, 0.3])
+    assert curve.median() == 3
+    np.testing.assert_allclose(curve.at([0, 1.5, 10]), [1, 0.8, 0.3])
+
+
+def test__kaplan_meier__truncated():
+    # The third subject is not at risk before hour 2
+    curve = surv.kaplan_meier([0, 0, 2], [1, 3, 4], [True, True, True])
+    np.testing.assert_allclose(curve.at_risk, [2, 2, 1])
+    np.testing.assert_allclose(curve.survival, [0.5, 0.25, 0])
+
+
+def test__kaplan_meier__never_half_remediated():
+    curve = surv.kaplan_meier(np.zeros(3), [1, 5, 5], [True, False, False])
+    assert np.isnan(curve.median())
+
+
+def test__survival_times():
+    t = lambda h: datetime(2024, 1, 1) + pd.Timedelta(hours=h)
+    table = RemediationTable(pd.DataFrame([
+        _row("a", "CVE_1", t(10), t(20)),  # discovered and remediated
+        _row("a", "CVE_2", t(10), None),   # residual
+        _row("b", "CVE_1", None, t(30)),   # preexisting, CVE_1 first seen at hour 10
+        _row("b", "CVE_3", None, None),    # preexisting, never discovered elsewhere
+    ]))
+    first_scans = {("cgr.dev", "a"): t(0), ("cgr.dev", "b"): t(15)}
+
+    df = surv.survival_times(table, first_scans, censor_at=t(40))
+    assert df["entry"].tolist() == [0, 0, 5, 0]
+    assert df["exit"].tolist() == [10, 30, 20, 25]
+    assert df["event"].tolist() == [True, False, True, False]
+
+    medians = surv.median_rtime(table, ["repository"], first_scans, censor_at=t(40))
+    assert medians["n"].tolist() == [2, 2]
+    assert medians["median_rtime"].tolist()[0] == 10
+
+
+def test__survival_times__missing_first_scan(monkeypatch):
+    t = lambda h: datetime(2024, 1, 1) + pd.Timedelta(hours=h)
+    table = RemediationTable(pd.DataFrame([
+        _row("a", "CVE_1", None, t(20)),
+        _row("b", "CVE_2", None, t(30)),
+        _row("b", "CVE_3", None, None),
+    ]))
+    fetched = []
+
+    def image_first_scan(image):
+        fetched.append(image)
+        return pd.Timestamp(t(10))
+    monkeypatch.setattr(surv, "image_first_scan", image_first_scan)
+
+    # b is not in first_scans, so its matches start at its fetched first scan instead of being dropped
+    df = surv.survival_times(table, {("cgr.dev", "a"): t(0)}, censor_at=t(40))
+    assert fetched == [{"registry": "cgr.dev", "repository": "b", "tag": "latest"}]
+    assert df["repository"].tolist() == ["a", "b", "b"]
+    assert df["exit"].tolist() == [20, 20, 30]
@@ -0,0 +1,77 @@
+# Standard lib
+from typing import Dict, List
+from datetime import datetime, timedelta
+import copy
+
+# 3rd party
+import pytest
+
+# Local
+import src.analysis.trends as trends
+import src.scanner.rollup as rollup
+from fixtures import (cve_001_python_dict,
+                      cve_001_jre_dict,
+                      small_scan,
+                      scan_db)
+
+
+def _store(collection, scan: Dict, hours: float, cves: List[Dict], **image):
+    s = copy.deepcopy(scan)
+    s.update(image)
+    s["scan_start"] = scan["scan_start"] + timedelta(hours=hours)
+    s["cves"] = copy.deepcopy(cves)
+    collection.bulk_write(rollup.rollup_ops(s), ordered=False)
+
+
+@pytest.fixture
+def rollups(scan_db):
+    collection = scan_db[rollup.ROLLUPS_COLLECTION_NAME]
+    collection.create_index([("granularity", 1), ("registry", 1), ("repository", 1),
+                             ("tag", 1), ("bucket", 1)], unique=True)
+    return collection
+
+
+def test__open_counts__distinct(cve_001_python_dict, cve_001_jre_dict):
+    jre_not_fixed = dict(cve_001_jre_dict, fix_state="not-fixed")
+    counts = rollup.open_counts([cve_001_python_dict, cve_001_python_dict,
+                                 cve_001_jre_dict, jre_not_fixed])
+    assert counts == {"critical": {"fixed": 2, "not-fixed": 1}}
+
+
+def test__rollup_ops__latest_scan_wins(rollups, small_scan, cve_001_python_dict, cve_001_jre_dict):
+    # small_scan starts at 02:00
+    _store(rollups, small_scan, 0.5, [cve_001_python_dict, cve_001_jre_dict])
+    _store(rollups, small_scan, 0, [cve_001_python_dict])
+    hour = rollups.find_one({"granularity": "hour", "bucket": datetime(2024, 1, 1, 2)})
+    assert hour["total"] == 2
+
+    _store(rollups, small_scan, 5, [])
+    day = rollups.find_one({"granularity": "day", "bucket": datetime(2024, 1, 1)})
+    assert day["total"] == 0
+    assert rollups.count_documents({"granularity": "hour"}) == 2
+
+
+def test__open_cves(rollups, small_scan, cve_001_python_dict, cve_001_jre_dict):
+    jre_low = dict(cve_001_jre_dict, id="CVE_002", severity="low")
+    _store(rollups, small_scan, 0, [cve_001_python_dict, jre_low])
+    _store(rollups, small_scan, 24, [cve_001_python_dict])
+    _store(rollups, small_scan, 0, [cve_001_jre_dict], registry="docker.io", repository="python")
+
+    df = trends.open_cves(collection=rollups)
+    assert list(df["open"]) == [3, 1]
+
+    df = trends.open_cves(registry="cgr.dev", severities=["critical"], collection=rollups)
+    assert list(df["open"]) == [1, 1]
+
+    df = trends.open_cves(by=["registry", "severity"], end=datetime(2024, 1, 2), collection=rollups)
+    assert sorted(zip(df["registry"], df["severity"], df["open"])) == [("cgr.dev", "critical", 1),
+                                                                      ("cgr.dev", "low", 1),
+                                                                      ("docker.io", "critical", 1)]
+
+    df = trends.open_cves(granularity="hour", start=datetime(2024, 1, 2), collection=rollups)
+    assert list(df["bucket"]) == [datetime(2024, 1, 2, 2)]
+
+
+def test__trend_pipeline__unknown_dimension():
+    with pytest.raises(ValueError):
+        trends.trend_pipeline(by=["label"])
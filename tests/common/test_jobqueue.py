@@ -0,0 +1,117 @@
+# Standard lib
+from typing import Dict, List
+from datetime import datetime, timedelta, timezone
+
+# 3rd party
+import pytest
+
+# Local
+import src.common.jobqueue as jobqueue
+from tests.mongo import scan_db
+
+
+def item(key: str) -> Dict:
+    return {"registry": "cgr.dev", "repository": f"chainguard/{key}", "tag": "latest",
+            "idempotency_key": key}
+
+
+def expire(collection, jobs: List[Dict]):
+    """
+    Moves the jobs' `visible_at` into the past, as if their lease or backoff ran out.
+    """
+    collection.update_many({"_id": {"$in": [job["_id"] for job in jobs]}},
+                           {"$set": {"visible_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+
+@pytest.fixture
+def queue(scan_db):
+    collection = scan_db[jobqueue.JOB_QUEUE_COLLECTION_NAME]
+    jobqueue.ensure_indexes(collection)
+    return (jobqueue.MongoJobPusher(collection),
+            jobqueue.MongoJobClaimer(collection, visibility_timeout=60, max_attempts=2))
+
+
+def test__claim__leases_n(queue):
+    pusher, claimer = queue
+    pusher.push_many([item(str(i)) for i in range(5)])
+
+    jobs = claimer.claim(3)
+    assert len(jobs) == 3
+    assert len({job["lease_id"] for job in jobs}) == 1
+    assert all(job["attempts"] == 1 for job in jobs)
+
+    # Claimed jobs stay hidden from other workers
+    assert len(claimer.claim(3)) == 2
+    assert claimer.claim(3) == []
+
+
+def test__claim__visible_after_timeout(queue):
+    pusher, claimer = queue
+    pusher.push_many([item("a")])
+    job, = claimer.claim(1)
+    assert claimer.claim(1) == []
+
+    # The worker died without acknowledging the job
+    expire(claimer.collection, [job])
+    retried, = claimer.claim(1)
+    assert retried["_id"] == job["_id"]
+    assert retried["attempts"] == 2
+
+    # The expired lease can no longer acknowledge the job
+    claimer.ack(job)
+    assert claimer.collection.count_documents({}) == 1
+    claimer.ack(retried)
+    assert claimer.collection.count_documents({}) == 0
+
+
+def test__ack(queue):
+    pusher, claimer = queue
+    pusher.push_many([item("a"), item("b")])
+    job, _ = claimer.claim(2)
+
+    claimer.ack(job)
+    assert [j["_id"] for j in claimer.collection.find()] == ["b"]
+
+
+def test__fail__backoff_then_dead(queue):
+    pusher, claimer = queue
+    pusher.push_many([item("a")])
+
+    job, = claimer.claim(1)
+    claimer.fail(job, "grype failed")
+    failed = claimer.collection.find_one({"_id": "a"})
+    assert failed["state"] == jobqueue.READY
+    assert failed["last_error"] == "grype failed"
+    assert failed["lease_id"] is None
+    # Hidden for the backoff
+    assert claimer.claim(1) == []
+
+    expire(claimer.collection, [job])
+    job, = claimer.claim(1)
+    claimer.fail(job, "grype failed again")
+    assert claimer.collection.find_one({"_id": "a"})["state"] == jobqueue.DEAD
+
+    expire(claimer.collection, [job])
+    assert claimer.claim(1) == []
+
+
+def test__defer__keeps_attempt(queue):
+    pusher, claimer = queue
+    pusher.push_many([item("a")])
+
+    for _ in range(3):
+        job, = claimer.claim(1)
+        assert job["attempts"] == 1
+        claimer.defer(job, 0)
+    assert claimer.collection.find_one({"_id": "a"})["state"] == jobqueue.READY
+
+
+def test__push_many__ignores_duplicates(queue):
+    pusher, claimer = queue
+    pusher.push_many([item("a"), item("b")])
+    pusher.push_many([{**item("a"), "tag": "other"}, item("c")])
+
+    jobs = {job["_id"]: job for job in claimer.collection.find()}
+    assert sorted(jobs) == ["a", "b", "c"]
+    # The job queued first is kept
+    assert jobs["a"]["data"]["tag"] == "latest"
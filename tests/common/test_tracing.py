@@ -0,0 +1,66 @@
+# 3rd party
+import pytest
+
+# Local
+import src.common.tracing as tracing
+import scripts.trace_report as trace_report
+
+
+def test__noop(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_EXPORTER", None)
+    with tracing.tracer.start_as_current_span("scan", attributes={"gallery.image": "python"}) as span:
+        assert isinstance(span, tracing._NoopSpan)
+        span.set_attribute("gallery.cves", 1)
+
+    # Nothing is propagated and no context is read
+    assert tracing.inject({"x-header": "1"}) == {"x-header": "1"}
+    assert tracing.extract({"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"}) is None
+
+    # Setup is a no-op too
+    tracing.setup_tracing("scanner")
+    assert not tracing._configured
+
+
+@pytest.fixture
+def file_exporter(tmp_path, monkeypatch):
+    """
+    Exports spans to a TRACE_FILE in `tmp_path`. OpenTelemetry only
+    takes the first tracer provider of a process, so this is used once.
+    """
+    from opentelemetry import trace
+
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_EXPORTER", "file")
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    monkeypatch.setattr(tracing, "_configured", False)
+    tracing.setup_tracing("publisher")
+    yield path
+    trace.get_tracer_provider().force_flush()
+
+
+def test__inject_extract(file_exporter):
+    with tracing.tracer.start_as_current_span("publish") as parent:
+        headers = tracing.inject()
+    assert "traceparent" in headers
+
+    # The scanner continues the trace from the task's headers
+    with tracing.tracer.start_as_current_span("scan", context=tracing.extract(headers)) as child:
+        pass
+    assert child.get_span_context().trace_id == parent.get_span_context().trace_id
+    assert child.parent.span_id == parent.get_span_context().span_id
+
+    from opentelemetry import trace
+    trace.get_tracer_provider().force_flush()
+    spans, = trace_report.load_spans(str(file_exporter)).values()
+    by_name = {s["name"]: s for s in spans}
+    assert by_name["scan"]["parent_id"] == by_name["publish"]["span_id"]
+    assert by_name["publish"]["service"] == "publisher"
+
+
+def test__extract__no_context(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_EXPORTER", "file")
+    from opentelemetry import trace
+
+    # A request without a traceparent starts a new trace
+    context = tracing.extract({})
+    assert not trace.get_current_span(context).get_span_context().is_valid
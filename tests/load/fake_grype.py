@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+A stand-in for the grype binary. Replays a recorded JSON report instead
+of pulling and scanning the image.
+
+Configured through the environment:
+
+    FAKE_GRYPE_REPORT        Path to the recorded grype JSON report.
+    FAKE_GRYPE_LATENCY_SECS  Seconds to sleep before writing the report.
+    FAKE_GRYPE_SCALE         Repeat the report's matches this many times
+                             to simulate larger images.
+    FAKE_GRYPE_DB_BUILT      The build time `grype db status` reports.
+
+`grype db status` and `grype db update` succeed without touching the network.
+An `--output cyclonedx-json=<path>` SBOM lists the matched packages.
+"""
+
+# Standard lib
+import os
+import sys
+import json
+import copy
+import time
+
+
+def db(command: str):
+    if command == "status":
+        built = os.environ.get("FAKE_GRYPE_DB_BUILT", "2024-04-01 01:30:25 +0000 UTC")
+        print(f"Location: fake\nBuilt: {built}\nSchema: v5\nStatus: valid")
+
+
+def write_sbom(report: dict, path: str):
+    components = [{"type": "library",
+                   "name": m["artifact"]["name"],
+                   "version": m["artifact"]["version"],
+                   "properties": [{"name": "syft:package:type", "value": m["artifact"]["type"]}]}
+                  for m in report["matches"]]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"bomFormat": "CycloneDX", "components": components}, f)
+
+
+def scan(endpoint: str, outputs: list):
+    with open(os.environ["FAKE_GRYPE_REPORT"], "r", encoding="utf-8") as f:
+        report = json.load(f)
+
+    scale = int(os.environ.get("FAKE_GRYPE_SCALE", 1))
+    matches = []
+    for i in range(scale):
+        for m in report["matches"]:
+            m = copy.deepcopy(m)
+            if i > 0:
+                m["vulnerability"]["id"] += f"-{i}"
+            matches.append(m)
+    report["matches"] = matches
+    report["source"]["target"]["userInput"] = endpoint
+
+    time.sleep(float(os.environ.get("FAKE_GRYPE_LATENCY_SECS", 0)))
+    for output in outputs:
+        if output.startswith("cyclonedx-json="):
+            write_sbom(report, output.split("=", 1)[1])
+    json.dump(report, sys.stdout)
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) > 0 and args[0] == "db":
+        db(args[1])
+    else:
+        outputs = [value for flag, value in zip(args, args[1:]) if flag == "--output"]
+        scan(args[0], outputs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Local load test of the publisher -> queue -> scanner -> MongoDB path.
+
+The publisher and scanner apps run in-process. Cloud Tasks is replaced
+with an in-process queue and grype with `fake_grype.py`. Each module
+that writes to MongoDB (the two apps and the scanner's `index`, `distro`
+and `rollup`) is pointed at the `gallery_load` database of a local
+mongod, so scans, the package index, distros and rollups stay out of
+`gallery`.
+
+Usage:
+
+    MONGO_URI=mongodb://localhost:27017 python tests/load/harness.py \\
+        --catalog-sizes 10 100 1000 --workers 4 --latency 0.5
+
+Reports scans per second, p50/p95/p99 latency per phase and MongoDB
+write amplification for each catalog size.
+"""
+
+# Standard lib
+from typing import Dict, List
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+import importlib.util
+from pathlib import Path
+
+# 3rd party
+from pymongo import MongoClient
+
+
+ROOT = Path(__file__).resolve().parents[2]
+HERE = Path(__file__).resolve().parent
+LOAD_DB_NAME = "gallery_load"
+PHASES = ["queue", "grype", "parse", "store", "total"]
+
+
+"""
+Stand-ins
+"""
+
+class LocalTasksClient:
+    """
+    Replaces `tasks_v2.CloudTasksClient`. Tasks are put on an in-process
+    queue as (enqueue time, body, headers) tuples.
+    """
+    tasks = queue.Queue()
+
+    def task_path(self, *args) -> str:
+        return "/".join(args)
+
+    def queue_path(self, *args) -> str:
+        return "/".join(args)
+
+    def create_task(self, request):
+        http_request = request.task.http_request
+        self.tasks.put((time.perf_counter(), http_request.body, dict(http_request.headers)))
+
+
+def install_fake_grype(bin_dir: str, report: str, latency: float, scale: int):
+    path = os.path.join(bin_dir, "grype")
+    shutil.copy(HERE / "fake_grype.py", path)
+    os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["FAKE_GRYPE_REPORT"] = report
+    os.environ["FAKE_GRYPE_LATENCY_SECS"] = str(latency)
+    os.environ["FAKE_GRYPE_SCALE"] = str(scale)
+
+
+def load_services(work_dir: str):
+    """
+    Imports the publisher and scanner apps. Both are named `app`, so the
+    publisher is loaded under `publisher_app`.
+    """
+    os.environ.setdefault("CLOUD_PROJECT_NAME", "local")
+    os.environ.setdefault("CLOUD_QUEUE_LOCATION", "local")
+    os.environ.setdefault("CLOUD_QUEUE_NAME", "to-scan")
+    os.environ.setdefault("SCANNER_URL", "http://scanner.local")
+    os.environ["GRYPE_DB_ROOT"] = os.path.join(work_dir, "grype-db")
+    os.environ["GRYPE_DB_REFRESH_SECS"] = "0"
+    os.environ.pop("PARSE_QUEUE_NAME", None)
+    os.environ["QUEUE_BACKEND"] = "cloud-tasks"
+
+    sys.path.insert(0, str(ROOT / "src" / "scanner"))
+    sys.path.insert(1, str(ROOT / "src" / "common"))
+    import app as scanner
+    import index
+    import distro
+    import rollup
+
+    # Appended so the scanner's modules take precedence over the publisher's
+    sys.path.append(str(ROOT / "src" / "publisher"))
+    spec = importlib.util.spec_from_file_location("publisher_app",
+                                                  ROOT / "src" / "publisher" / "app.py")
+    publisher = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(publisher)
+
+    # Each module names the database itself, so every one that writes is patched
+    for module in [scanner, index, distro, rollup, publisher]:
+        module.MONGO_DB_NAME = LOAD_DB_NAME
+    # The publisher imports tasks_v2 on first use, so patch the module itself
+    from google.cloud import tasks_v2
+    tasks_v2.CloudTasksClient = LocalTasksClient
+    publisher.get_auth_token = lambda: "local"
+
+    return publisher, scanner
+
+
+"""
+Instrumentation
+"""
+
+_local = threading.local()
+
+
+def timed(phase: str, fn):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _local.phases[phase] = _local.phases.get(phase, 0) + elapsed
+    return wrapper
+
+
+def instrument(scanner):
+    run_grype = scanner.run_grype
+
+    def sized_run_grype(args):
+        raw, packages = run_grype(args)
+        _local.grype_bytes = len(raw)
+        return raw, packages
+
+    scanner.run_grype = timed("grype", sized_run_grype)
+    scanner.build_document = timed("parse", scanner.build_document)
+    scanner.store_scan = timed("store", scanner.store_scan)
+
+
+def percentiles(data: List[float]) -> Dict[str, float]:
+    if len(data) < 2:
+        value = data[0] if data else 0
+        return {"p50": value, "p95": value, "p99": value}
+    q = statistics.quantiles(data, n=100, method="inclusive")
+    return {"p50": q[49], "p95": q[94], "p99": q[98]}
+
+
+def mongo_counters(client: MongoClient) -> Dict[str, int]:
+    stats = client[LOAD_DB_NAME].command("dbStats")
+    ops = client.admin.command("serverStatus")["opcounters"]
+    return {
+        "bytes": int(stats.get("dataSize", 0) + stats.get("indexSize", 0)),
+        "writes": int(ops["insert"] + ops["update"])
+    }
+
+
+"""
+Runner
+"""
+
+def seed_catalog(client: MongoClient, size: int):
+    client.drop_database(LOAD_DB_NAME)
+    images = [{"publisher": "load",
+               "registry": "load.local",
+               "repository": f"load/image-{i}",
+               "tag": "latest",
+               "labels": ["load"]} for i in range(size)]
+    client[LOAD_DB_NAME]["images"].insert_many(images)
+
+
+def worker(scanner_client, results: List[Dict], lock: threading.Lock):
+    while True:
+        item = LocalTasksClient.tasks.get()
+        if item is None:
+            LocalTasksClient.tasks.task_done()
+            return
+
+        enqueued_at, body, headers = item
+        start = time.perf_counter()
+        _local.phases = {"queue": start - enqueued_at}
+        _local.grype_bytes = 0
+
+        # Forwards the trace context set by the publisher
+        response = scanner_client.post("/", data=body, headers=headers)
+
+        phases = dict(_local.phases)
+        phases["total"] = time.perf_counter() - start
+        phases["store"] = phases.get("store", 0) - phases.get("parse", 0)
+        with lock:
+            results.append({"ok": response.status_code == 200,
+                            "phases": phases,
+                            "grype_bytes": _local.grype_bytes})
+        LocalTasksClient.tasks.task_done()
+
+
+def run(publisher, scanner, client: MongoClient, size: int, n_workers: int) -> Dict:
+    seed_catalog(client, size)
+    before = mongo_counters(client)
+
+    results, lock = [], threading.Lock()
+    threads = [threading.Thread(target=worker, args=(scanner.app.test_client(), results, lock))
+               for _ in range(n_workers)]
+    for t in threads:
+        t.start()
+
+    start = time.perf_counter()
+    publisher.app.test_client().post("/")
+    publish_secs = time.perf_counter() - start
+    LocalTasksClient.tasks.join()
+    elapsed = time.perf_counter() - start
+
+    for _ in threads:
+        LocalTasksClient.tasks.put(None)
+    for t in threads:
+        t.join()
+
+    after = mongo_counters(client)
+    ok = [r for r in results if r["ok"]]
+    grype_bytes = sum(r["grype_bytes"] for r in ok)
+
+    return {
+        "catalog_size": size,
+        "workers": n_workers,
+        "scans": len(ok),
+        "errors": len(results) - len(ok),
+        "publish_secs": publish_secs,
+        "elapsed_secs": elapsed,
+        "scans_per_sec": len(ok) / elapsed if elapsed > 0 else 0,
+        "latency_secs": {p: percentiles([r["phases"].get(p, 0) for r in ok]) for p in PHASES},
+        "writes_per_scan": (after["writes"] - before["writes"]) / max(len(ok), 1),
+        "bytes_per_scan": (after["bytes"] - before["bytes"]) / max(len(ok), 1),
+        "write_amplification": (after["bytes"] - before["bytes"]) / grype_bytes if grype_bytes else 0
+    }
+
+
+def print_result(result: Dict):
+    print(f"\nCatalog size {result['catalog_size']} ({result['workers']} workers)")
+    print(f"\tScans: {result['scans']} ({result['errors']} errors)")
+    print(f"\tPublish: {result['publish_secs']:.2f}s")
+    print(f"\tThroughput: {result['scans_per_sec']:.2f} scans/s")
+    for phase, p in result["latency_secs"].items():
+        print(f"\t{phase:>6}: p50 {p['p50'] * 1000:8.1f}ms  "
+              f"p95 {p['p95'] * 1000:8.1f}ms  p99 {p['p99'] * 1000:8.1f}ms")
+    print(f"\tMongo writes per scan: {result['writes_per_scan']:.2f}")
+    print(f"\tMongo bytes per scan: {result['bytes_per_scan']:.0f}")
+    print(f"\tWrite amplification: {result['write_amplification']:.2f}x grype output")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog-sizes", "-n", type=int, nargs="+", default=[10, 100],
+                        help="The catalog sizes to run")
+    parser.add_argument("--workers", "-w", type=int, default=4,
+                        help="The number of concurrent scanner workers")
+    parser.add_argument("--latency", "-l", type=float, default=0.0,
+                        help="Seconds the fake grype sleeps per scan")
+    parser.add_argument("--scale", "-s", type=int, default=1,
+                        help="Repeat the recorded matches this many times per scan")
+    parser.add_argument("--report", "-r", default=str(HERE / "reports" / "python.json"),
+                        help="The recorded grype report to replay")
+    parser.add_argument("--output", "-o", default=None,
+                        help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        bin_dir = os.path.join(work_dir, "bin")
+        os.makedirs(bin_dir)
+        install_fake_grype(bin_dir, args.report, args.latency, args.scale)
+
+        publisher, scanner = load_services(work_dir)
+        instrument(scanner)
+
+        results = []
+        with MongoClient(os.environ["MONGO_URI"]) as client:
+            for size in args.catalog_sizes:
+                result = run(publisher, scanner, client, size, args.workers)
+                print_result(result)
+                results.append(result)
+            client.drop_database(LOAD_DB_NAME)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
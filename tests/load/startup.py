@@ -0,0 +1,136 @@
+"""
+Cold-start benchmark of the publisher and scanner.
+
+Each service is started in a fresh interpreter, which reports how long
+its module took to import and how long the first `GET /ready` took.
+grype is replaced with `fake_grype.py`, so the scanner's first request
+does not download a DB.
+
+Usage:
+
+    python tests/load/startup.py --runs 5 --budget-secs 2
+
+Exits with an error if the median time to first request of a service
+is over `--budget-secs`.
+"""
+
+# Standard lib
+from typing import Dict, List
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[2]
+HERE = Path(__file__).resolve().parent
+SERVICES = ["publisher", "scanner"]
+
+# Runs inside the service's directory and prints its timings as JSON
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get("/ready")
+ready = time.perf_counter()
+print(json.dumps({"import_secs": imported - start,
+                  "first_request_secs": ready - start,
+                  "status_code": response.status_code}))
+"""
+
+
+def probe(service: str, env: Dict[str, str]) -> Dict:
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE],
+                            cwd=ROOT / "src" / service, env=env,
+                            capture_output=True, text=True, check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["slowest_imports"] = slowest_imports(output.stderr)
+    return result
+
+
+def slowest_imports(importtime: str, n: int = 5) -> List[Dict]:
+    """
+    Returns the `n` slowest top-level imports from `-X importtime` output.
+    """
+    imports = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        imports.append({"module": name.strip(), "secs": int(cumulative) / 1e6})
+    return sorted(imports, key=lambda i: -i["secs"])[:n]
+
+
+def service_env(work_dir: str) -> Dict[str, str]:
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    shutil.copy(HERE / "fake_grype.py", os.path.join(bin_dir, "grype"))
+    os.chmod(os.path.join(bin_dir, "grype"), 0o755)
+
+    env = dict(os.environ)
+    env["PATH"] = bin_dir + os.pathsep + env["PATH"]
+    # The images copy src/common next to each service's modules
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT / "src" / "common")] +
+                                        [p for p in [env.get("PYTHONPATH", None)] if p])
+    env["FAKE_GRYPE_REPORT"] = str(HERE / "reports" / "python.json")
+    env["GRYPE_DB_ROOT"] = os.path.join(work_dir, "grype-db")
+    env["GRYPE_DB_REFRESH_SECS"] = "0"
+    env.setdefault("MONGO_URI", "mongodb://localhost:27017")
+    env.setdefault("CLOUD_PROJECT_NAME", "local")
+    env.setdefault("CLOUD_QUEUE_LOCATION", "local")
+    env.setdefault("CLOUD_QUEUE_NAME", "to-scan")
+    env.setdefault("SCANNER_URL", "http://scanner.local")
+    return env
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    return {
+        "runs": len(runs),
+        "import_secs": statistics.median(r["import_secs"] for r in runs),
+        "first_request_secs": statistics.median(r["first_request_secs"] for r in runs),
+        "status_codes": sorted({r["status_code"] for r in runs}),
+        "slowest_imports": runs[-1]["slowest_imports"]
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", "-n", type=int, default=5,
+                        help="Cold starts per service")
+    parser.add_argument("--budget-secs", "-b", type=float, default=None,
+                        help="Fail if the median time to first request is over this")
+    parser.add_argument("--output", "-o", default=None,
+                        help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = service_env(work_dir)
+        for service in SERVICES:
+            results[service] = summarize([probe(service, env) for _ in range(args.runs)])
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.budget_secs is not None:
+        over = [s for s, r in results.items() if r["first_request_secs"] > args.budget_secs]
+        if len(over) > 0:
+            sys.exit(f"Over the {args.budget_secs}s startup budget: {', '.join(over)}")
+
+
+if __name__ == "__main__":
+    main()
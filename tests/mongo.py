@@ -0,0 +1,47 @@
+"""
+Fixtures for tests that need MongoDB. Each test gets a throwaway
+database on the mongod at `TEST_MONGO_URI`, and is skipped if there is none.
+"""
+
+# Standard lib
+import os
+import uuid
+
+# 3rd party
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+
+TEST_MONGO_URI = os.environ.get("TEST_MONGO_URI", "mongodb://localhost:27017")
+
+
+def _throwaway_db():
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except ServerSelectionTimeoutError:
+        client.close()
+        pytest.skip(f"No mongod at {TEST_MONGO_URI}")
+
+    name = f"gallery_test_{uuid.uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
+
+
+@pytest.fixture
+def scan_db():
+    """
+    A throwaway database on the mongod at `TEST_MONGO_URI`. Skips the
+    test if there is none.
+    """
+    yield from _throwaway_db()
+
+
+@pytest.fixture(scope="module")
+def module_scan_db():
+    """
+    Like `scan_db`, but shared by the tests of a module.
+    """
+    yield from _throwaway_db()
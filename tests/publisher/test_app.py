@@ -0,0 +1,49 @@
+# Standard lib
+from datetime import datetime, timezone
+
+# 3rd party
+import pytest
+
+# Local
+import src.publisher.app as publisher
+
+
+IMAGE = {"registry": "cgr.dev", "repository": "chainguard/python", "tag": "latest", "labels": ["base"]}
+
+
+def test__scheduling_window():
+    assert publisher.scheduling_window(datetime(2024, 1, 2, 3, 59, 59, tzinfo=timezone.utc)) == "2024010203"
+    assert publisher.scheduling_window(datetime(2024, 1, 2, 4, tzinfo=timezone.utc)) == "2024010204"
+    assert len(publisher.scheduling_window()) == 10
+
+
+def test__get_idempotency_key():
+    key = publisher.get_idempotency_key(IMAGE, "2024010203")
+    assert len(key) == 32
+    # Deterministic across runs, so retries and duplicate publishes collide
+    assert key == publisher.get_idempotency_key(dict(IMAGE), "2024010203")
+    # Labels are not part of the image's identity
+    assert key == publisher.get_idempotency_key({**IMAGE, "labels": []}, "2024010203")
+
+
+@pytest.mark.parametrize("change", [
+    {"registry": "docker.io"},
+    {"repository": "chainguard/go"},
+    {"tag": "dev"},
+])
+def test__get_idempotency_key__image(change):
+    assert publisher.get_idempotency_key({**IMAGE, **change}, "2024010203") != \
+        publisher.get_idempotency_key(IMAGE, "2024010203")
+
+
+def test__get_idempotency_key__window():
+    assert publisher.get_idempotency_key(IMAGE, "2024010203") != \
+        publisher.get_idempotency_key(IMAGE, "2024010204")
+    assert publisher.get_idempotency_key(IMAGE, "2024010203") != \
+        publisher.get_idempotency_key(IMAGE, "db-2024-01-02T03:00:00Z")
+
+
+def test__get_scan_args():
+    args = publisher.get_scan_args(IMAGE, "2024010203")
+    assert args["idempotency_key"] == publisher.get_idempotency_key(IMAGE, "2024010203")
+    assert {k: args[k] for k in IMAGE} == IMAGE
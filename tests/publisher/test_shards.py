@@ -0,0 +1,166 @@
+# Standard lib
+from typing import Dict, List
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+# 3rd party
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+# Local
+import src.publisher.shards as shards
+
+
+OPERATORS = {"$gt": lambda a, b: a is not None and a > b,
+             "$gte": lambda a, b: a is not None and a >= b,
+             "$lt": lambda a, b: a is not None and a < b,
+             "$lte": lambda a, b: a is not None and a <= b}
+
+
+def _matches(doc: Dict, query: Dict) -> bool:
+    for field, cond in query.items():
+        value = doc.get(field, None)
+        if isinstance(cond, dict):
+            if not all(OPERATORS[op](value, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _update(doc: Dict, update: Dict, insert: bool=False):
+    doc.update(update.get("$set", {}))
+    if insert:
+        doc.update(update.get("$setOnInsert", {}))
+    for field, n in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + n
+
+
+class FakeCollection:
+    """
+    The subset of `Collection` that `ShardedCatalog` uses, in memory.
+    """
+    def __init__(self, docs: List[Dict]=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+
+    def find(self, query: Dict, projection: Dict=None, sort=None, batch_size=None) -> List[Dict]:
+        docs = [doc for doc in self.docs.values() if _matches(doc, query)]
+        if sort is not None:
+            (field, _), = sort
+            docs.sort(key=lambda doc: doc[field])
+        if projection is not None:
+            docs = [{k: v for k, v in doc.items() if k == "_id" or k in projection} for doc in docs]
+        return docs
+
+    def find_one(self, query: Dict) -> Dict:
+        docs = self.find(query)
+        return dict(docs[0]) if len(docs) > 0 else None
+
+    def insert_one(self, doc: Dict):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate key")
+        self.docs[doc["_id"]] = dict(doc)
+
+    def update_one(self, query: Dict, update: Dict, upsert: bool=False):
+        docs = self.find(query)
+        if len(docs) > 0:
+            _update(self.docs[docs[0]["_id"]], update)
+        elif upsert:
+            doc = dict(query)
+            _update(doc, update, insert=True)
+            self.docs[doc["_id"]] = doc
+        return SimpleNamespace(matched_count=len(docs[:1]))
+
+    def bulk_write(self, ops: List, ordered: bool=True):
+        for op in ops:
+            self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+    def find_one_and_update(self, query: Dict, update: Dict, return_document=None) -> Dict:
+        docs = self.find(query)
+        if len(docs) == 0:
+            return None
+        _update(self.docs[docs[0]["_id"]], update)
+        return dict(self.docs[docs[0]["_id"]])
+
+    def aggregate(self, pipeline: List[Dict]) -> List[Dict]:
+        match, group = pipeline[0]["$match"], pipeline[1]["$group"]
+        groups: Dict[str, Dict] = {}
+        for doc in self.find(match):
+            state = groups.setdefault(doc["state"], {"_id": doc["state"], "shards": 0, "images": 0})
+            state["shards"] += 1
+            state["images"] += doc["images"]
+        return list(groups.values())
+
+
+def image(i: int) -> Dict:
+    return {"_id": i, "registry": "cgr.dev", "repository": f"chainguard/{i}", "tag": "latest",
+            "labels": [], "digest": "sha256:0"}
+
+
+@pytest.fixture
+def catalog() -> shards.ShardedCatalog:
+    return shards.ShardedCatalog(FakeCollection([image(i) for i in range(10)]),
+                                 FakeCollection(), FakeCollection(),
+                                 shard_size=4, lease_secs=60)
+
+
+def _enqueue_all(catalog: shards.ShardedCatalog, window: str) -> List[int]:
+    ids = []
+    while (shard := catalog.claim(window)) is not None:
+        batch = list(catalog.read(shard, batch_size=2))
+        ids += [img["_id"] for img in batch]
+        catalog.checkpoint(shard, batch[-1]["_id"], len(batch))
+        catalog.complete(shard)
+    return ids
+
+
+def test__plan(catalog):
+    assert catalog.plan("2024010203") == 3
+    assert catalog.runs.docs["2024010203"]["bounds"] == [4, 8]
+    assert [(s["lower"], s["upper"]) for s in catalog.shards.docs.values()] == \
+        [(None, 4), (4, 8), (8, None)]
+
+
+def test__plan__keeps_bounds(catalog):
+    catalog.plan("2024010203")
+    # Images added during the run do not move the bounds of its window
+    for i in range(10, 20):
+        catalog.images.insert_one(image(i))
+    assert catalog.plan("2024010203") == 3
+    assert catalog.plan("2024010204") == 5
+
+
+def test__read__covers_catalog(catalog):
+    catalog.plan("2024010203")
+    assert sorted(_enqueue_all(catalog, "2024010203")) == list(range(10))
+    assert catalog.progress("2024010203") == {"ready": 0, "done": 3, "images": 10}
+
+
+def test__read__projection(catalog):
+    catalog.plan("2024010203")
+    img = next(iter(catalog.read(catalog.claim("2024010203"), batch_size=2)))
+    assert set(img) == {"_id", *shards.IMAGE_PROJECTION}
+
+
+def test__claim__leased(catalog):
+    catalog.plan("2024010203")
+    claimed = [catalog.claim("2024010203") for _ in range(4)]
+    assert len({s["_id"] for s in claimed[:3]}) == 3
+    assert claimed[3] is None
+
+
+def test__claim__resumes_after_checkpoint(catalog):
+    catalog.plan("2024010203")
+    shard = catalog.claim("2024010203")
+    catalog.checkpoint(shard, 1, 2)
+
+    # The lease expires before the worker finishes the shard
+    catalog.shards.docs[shard["_id"]]["leased_until"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    resumed = catalog.claim("2024010203")
+    assert resumed["_id"] == shard["_id"]
+    assert [img["_id"] for img in catalog.read(resumed, batch_size=2)] == [2, 3]
+
+    with pytest.raises(shards.LeaseLost):
+        catalog.checkpoint(shard, 3, 2)
+    catalog.checkpoint(resumed, 3, 2)
+    assert catalog.progress("2024010203")["images"] == 4
@@ -0,0 +1,164 @@
+# Standard lib
+from typing import Dict, List
+import os
+import sys
+import json
+import shutil
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+# 3rd party
+import pytest
+
+# The app imports its siblings as top-level modules, as in the scanner image
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src" / "scanner"))
+
+# Local
+import async_app
+from app import ScanArgs
+from ratelimit import Throttled
+
+
+FAKE_GRYPE = Path(__file__).resolve().parents[1] / "load" / "fake_grype.py"
+SCAN = {"registry": "cgr.dev", "repository": "chainguard/python", "tag": "latest", "labels": []}
+
+
+@pytest.fixture
+def grype(tmp_path, monkeypatch) -> List[asyncio.subprocess.Process]:
+    """
+    Puts the fake grype of the load test on PATH, with scans that take a
+    minute. Returns the grype processes started.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    shutil.copy(FAKE_GRYPE, bin_dir / "grype")
+    os.chmod(bin_dir / "grype", 0o755)
+    report = tmp_path / "report.json"
+    report.write_text(json.dumps({"matches": [], "source": {"target": {}}}))
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_GRYPE_REPORT", str(report))
+    monkeypatch.setenv("FAKE_GRYPE_LATENCY_SECS", "60")
+    monkeypatch.setattr(async_app, "grype_db", lambda: SimpleNamespace(env=lambda: dict(os.environ)))
+
+    procs = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def create(*args, **kwargs):
+        procs.append(await create_subprocess_exec(*args, **kwargs))
+        return procs[-1]
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", create)
+    return procs
+
+
+def test___run_grype_process(grype, monkeypatch, tmp_path):
+    monkeypatch.setenv("FAKE_GRYPE_LATENCY_SECS", "0")
+    raw = asyncio.run(async_app._run_grype_process("cgr.dev/chainguard/python:latest",
+                                                   str(tmp_path / "sbom.json")))
+    assert json.loads(raw)["source"]["target"]["userInput"] == "cgr.dev/chainguard/python:latest"
+
+
+def test___run_grype_process__timeout(grype, monkeypatch, tmp_path):
+    monkeypatch.setattr(async_app, "SCAN_TIMEOUT_SECS", 0.5)
+    with pytest.raises(RuntimeError, match="timed out"):
+        asyncio.run(async_app._run_grype_process("cgr.dev/chainguard/python:latest",
+                                                 str(tmp_path / "sbom.json")))
+    proc, = grype
+    assert proc.returncode is not None
+
+
+def test___run_grype_process__cancelled(grype, tmp_path):
+    async def cancel():
+        task = asyncio.create_task(async_app._run_grype_process("cgr.dev/chainguard/python:latest",
+                                                                str(tmp_path / "sbom.json")))
+        while len(grype) == 0:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await task
+
+    # The request was dropped, e.g. by a client timeout
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancel())
+    proc, = grype
+    assert proc.returncode is not None
+
+
+@pytest.fixture
+def scans(monkeypatch) -> Dict:
+    """
+    Replaces grype and storage with stubs that record how many scans
+    run at once and whether each got its pull token inside a slot.
+    """
+    state = {"running": 0, "max_running": 0, "stored": 0, "pulls_in_slot": []}
+
+    async def run_grype(args: ScanArgs):
+        state["running"] += 1
+        state["max_running"] = max(state["max_running"], state["running"])
+        await asyncio.sleep(0.05)
+        state["running"] -= 1
+        return "{}", []
+
+    async def acquire_pull(registry: str):
+        state["pulls_in_slot"].append(async_app._semaphore.locked())
+
+    async def store_scan(*args, **kwargs):
+        state["stored"] += 1
+
+    monkeypatch.setattr(async_app, "run_grype", run_grype)
+    monkeypatch.setattr(async_app, "acquire_pull", acquire_pull)
+    monkeypatch.setattr(async_app, "store_scan", store_scan)
+    monkeypatch.setattr(async_app, "PARSE_QUEUE_NAME", None)
+    monkeypatch.setattr(async_app, "_client", None)
+    return state
+
+
+def test__process_scan__bounded(scans, monkeypatch):
+    async def run():
+        monkeypatch.setattr(async_app, "_semaphore", asyncio.Semaphore(2))
+        await asyncio.gather(*[async_app.process_scan(ScanArgs(**SCAN)) for _ in range(6)])
+
+    asyncio.run(run())
+    assert scans["max_running"] == 2
+    assert scans["stored"] == 6
+
+
+def test__process_scan__slot_before_pull(scans, monkeypatch):
+    async def run():
+        monkeypatch.setattr(async_app, "_semaphore", asyncio.Semaphore(1))
+        await asyncio.gather(*[async_app.process_scan(ScanArgs(**SCAN)) for _ in range(3)])
+
+    # Scans waiting for a slot do not hold pull tokens
+    asyncio.run(run())
+    assert scans["pulls_in_slot"] == [True, True, True]
+
+
+def test__main__throttled(monkeypatch):
+    async def process_scan(args: ScanArgs):
+        raise Throttled(args.registry, 2.5)
+    monkeypatch.setattr(async_app, "process_scan", process_scan)
+
+    async def post():
+        return await async_app.app.test_client().post("/", json=SCAN)
+
+    response = asyncio.run(post())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+
+
+def test__ready(monkeypatch):
+    monkeypatch.setattr(async_app, "grype_db", lambda: SimpleNamespace(built="2024-04-01"))
+    monkeypatch.setattr(async_app, "MONGO_URI", "mongodb://fake")
+
+    async def get():
+        return await async_app.app.test_client().get("/ready")
+
+    # Startup has not created the client yet
+    monkeypatch.setattr(async_app, "_client", None)
+    assert asyncio.run(get()).status_code == 503
+
+    monkeypatch.setattr(async_app, "_client", object())
+    response = asyncio.run(get())
+    assert response.status_code == 200
+    assert asyncio.run(response.get_json()) == {"message": "ready", "grype_db_built": "2024-04-01",
+                                                "mongo_client": "started"}
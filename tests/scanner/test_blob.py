@@ -0,0 +1,53 @@
+# Standard lib
+import os
+import json
+
+# 3rd party
+import pytest
+
+# Local
+import src.scanner.blob as blob
+
+
+RAW = json.dumps({"matches": []})
+META = {"registry": "cgr.dev", "repository": "chainguard/python", "tag": "latest"}
+
+
+@pytest.fixture
+def store(tmp_path) -> blob.LocalBlobStore:
+    return blob.LocalBlobStore(str(tmp_path / "blobs"))
+
+
+def test__put_get(store):
+    key = store.put_scan(RAW, META)
+    assert store.get_scan(key) == (RAW, META)
+    assert store.pending() == [key]
+
+
+def test__pending__incomplete(store):
+    # A raw report without its metadata is still being written
+    key = store.put_scan(RAW, META)
+    os.remove(store._path(key, blob.META_SUFFIX))
+    with open(store._path("partial", blob.RAW_SUFFIX), "w") as f:
+        f.write(RAW)
+    assert store.pending() == []
+
+
+def test__pending__sorted(store):
+    keys = [store.put_scan(RAW, {**META, "tag": str(i)}) for i in range(5)]
+    assert store.pending() == sorted(keys)
+
+
+def test__delete(store):
+    key = store.put_scan(RAW, META)
+    store.delete(key)
+    store.delete(key)
+    assert store.pending() == []
+    assert os.listdir(store.root) == []
+    with pytest.raises(FileNotFoundError):
+        store.get_scan(key)
+
+
+def test__no_temp_files(store):
+    store.put_scan(RAW, META)
+    assert not [name for name in os.listdir(store.root) if name.endswith(".tmp")]
@@ -0,0 +1,99 @@
+# Standard lib
+import io
+import os
+import stat
+import tarfile
+
+# 3rd party
+import pytest
+
+# Local
+import src.scanner.distro as distro
+
+
+ALPINE = '''NAME="Alpine Linux"
+ID=alpine
+VERSION_ID=3.19.1
+# A comment
+PRETTY_NAME="Alpine Linux v3.19"
+'''
+
+DOCUMENT = {"registry": "cgr.dev", "repository": "chainguard/python", "tag": "latest",
+            "distro": {"name": "wolfi", "version": "20230201"}, "digest": "sha256:abc"}
+
+
+@pytest.mark.parametrize("text,expected", [
+    (ALPINE, {"name": "alpine", "version": "3.19.1"}),
+    ("ID='wolfi'\n", {"name": "wolfi", "version": None}),
+    ("NAME=Unknown\n", None),
+    ("", None),
+])
+def test__parse_os_release(text, expected):
+    assert distro.parse_os_release(text) == expected
+
+
+@pytest.mark.parametrize("scan,expected", [
+    ({"distro": {"name": "debian", "version": "12"}}, {"name": "debian", "version": "12"}),
+    ({"distro": {"name": "debian"}}, {"name": "debian", "version": None}),
+    ({"distro": {"name": "", "version": ""}}, None),
+    ({"distro": None}, None),
+    ({}, None),
+])
+def test__report_distro(scan, expected):
+    assert distro.report_distro(scan) == expected
+
+
+def test__report_digest():
+    assert distro.report_digest({"source": {"target": {"manifestDigest": "sha256:abc"}}}) == "sha256:abc"
+    assert distro.report_digest({"source": {"target": "image"}}) is None
+    assert distro.report_digest({}) is None
+
+
+def test__distro_ops():
+    ops = distro.distro_ops(DOCUMENT)
+    image, = ops[distro.IMAGES_COLLECTION_NAME]
+    assert image._filter == {"registry": "cgr.dev", "repository": "chainguard/python", "tag": "latest"}
+    assert image._doc == {"$set": {"distro": DOCUMENT["distro"], "digest": "sha256:abc"}}
+
+    cached, = ops[distro.DISTROS_COLLECTION_NAME]
+    assert cached._filter == {"_id": "sha256:abc"}
+    assert cached._upsert
+    assert cached._doc["$setOnInsert"]["source"] == "grype"
+
+
+def test__distro_ops__no_digest():
+    # The image still records the distro, the digest cache is skipped
+    ops = distro.distro_ops({**DOCUMENT, "digest": None})
+    assert list(ops) == [distro.IMAGES_COLLECTION_NAME]
+    assert ops[distro.IMAGES_COLLECTION_NAME][0]._doc == {"$set": {"distro": DOCUMENT["distro"]}}
+
+
+def test__distro_ops__no_distro():
+    ops = distro.distro_ops({**DOCUMENT, "distro": None})
+    assert list(ops) == [distro.IMAGES_COLLECTION_NAME]
+    assert ops[distro.IMAGES_COLLECTION_NAME][0]._doc["$set"]["distro"] is None
+
+
+@pytest.fixture
+def crane(tmp_path, monkeypatch):
+    """
+    Puts a `crane` on PATH whose `blob` command writes a layer holding
+    `etc/os-release` followed by a large file.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as layer:
+        for name, content in [("etc/os-release", ALPINE.encode()),
+                              ("usr/lib/big", os.urandom(1 << 20))]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            layer.addfile(info, io.BytesIO(content))
+    (tmp_path / "layer.tar.gz").write_bytes(buffer.getvalue())
+
+    script = tmp_path / "crane"
+    script.write_text(f"#!/bin/sh\ncat {tmp_path / 'layer.tar.gz'}\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+
+def test__layer_os_release(crane):
+    assert distro._layer_os_release("cgr.dev/chainguard/python", "sha256:abc") == ALPINE
@@ -0,0 +1,89 @@
+# Standard lib
+import os
+import json
+import shutil
+from pathlib import Path
+
+# 3rd party
+import pytest
+
+# Local
+import src.scanner.grypedb as grypedb
+
+
+FAKE_GRYPE = Path(__file__).resolve().parents[1] / "load" / "fake_grype.py"
+BUILT = "2024-04-01 01:30:25 +0000 UTC"
+
+
+@pytest.fixture
+def grype(tmp_path, monkeypatch):
+    """
+    Puts the fake grype of the load test on PATH. Its `db status`
+    reports the build time in FAKE_GRYPE_DB_BUILT.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    shutil.copy(FAKE_GRYPE, bin_dir / "grype")
+    os.chmod(bin_dir / "grype", 0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_GRYPE_DB_BUILT", BUILT)
+
+
+@pytest.mark.parametrize("output", [
+    f"Location: /var/lib/grype-db/5\nBuilt: {BUILT}\nSchema: v5\nStatus: valid\n",
+    json.dumps({"Location": "/var/lib/grype-db/5", "Built": BUILT, "Schema": "v5", "Status": "valid"}),
+])
+def test___parse_status(output):
+    assert grypedb._parse_status(output) == {"location": "/var/lib/grype-db/5", "built": BUILT,
+                                             "schema": "v5", "status": "valid"}
+
+
+def test___parse_status__invalid():
+    status = grypedb._parse_status("Location: /var/lib/grype-db/5\nStatus: invalid\nnot a field")
+    assert status == {"location": "/var/lib/grype-db/5", "status": "invalid"}
+
+
+def test___swap(tmp_path):
+    db = grypedb.GrypeDB(str(tmp_path))
+    dirs = [tmp_path / name for name in ["a", "b", "c"]]
+    for i, path in enumerate(dirs):
+        path.mkdir()
+        db._swap(str(path), str(i))
+
+    assert db.built == "2"
+    assert db.env()["GRYPE_DB_CACHE_DIR"] == str(dirs[2])
+    # The previous DB is kept for running scans, older ones are removed
+    assert [path.exists() for path in dirs] == [False, True, True]
+
+
+def test__refresh(tmp_path, grype, monkeypatch):
+    updates = []
+    db = grypedb.GrypeDB(str(tmp_path / "db"), on_update=lambda *args: updates.append(args))
+
+    assert db.refresh()
+    first, = os.listdir(db.root)
+    assert db.built == BUILT
+    assert updates == [(None, os.path.join(db.root, first), BUILT)]
+
+    # The same build is discarded
+    assert not db.refresh()
+    assert os.listdir(db.root) == [first]
+    assert len(updates) == 1
+
+    monkeypatch.setenv("FAKE_GRYPE_DB_BUILT", "2024-04-02 01:30:25 +0000 UTC")
+    assert db.refresh()
+    second = max(os.listdir(db.root))
+    assert db.built == "2024-04-02 01:30:25 +0000 UTC"
+    assert db.env()["GRYPE_DB_CACHE_DIR"] == os.path.join(db.root, second)
+    assert updates[1] == (os.path.join(db.root, first), os.path.join(db.root, second),
+                          "2024-04-02 01:30:25 +0000 UTC")
+
+
+def test__refresh__on_update_error(tmp_path, grype):
+    def on_update(*args):
+        raise RuntimeError("failed")
+
+    # The new DB stays pinned when recording the update fails
+    db = grypedb.GrypeDB(str(tmp_path / "db"), on_update=on_update)
+    assert db.refresh()
+    assert db.built == BUILT
@@ -0,0 +1,144 @@
+# Standard lib
+import sqlite3
+from datetime import datetime
+
+# 3rd party
+import pytest
+
+# Local
+import src.scanner.index as index
+
+
+SBOM = {
+    "bomFormat": "CycloneDX",
+    "components": [
+        {"type": "operating-system", "name": "wolfi", "version": "20230201"},
+        {"type": "library", "name": "openssl", "version": "3.1.4-r0",
+         "purl": "pkg:apk/wolfi/openssl@3.1.4-r0",
+         "properties": [{"name": "syft:package:type", "value": "apk"}]},
+        {"type": "library", "name": "requests", "version": "2.31.0",
+         "purl": "pkg:pypi/requests@2.31.0"},
+    ]
+}
+
+
+def _document(cves=[]) -> dict:
+    return {"registry": "cgr.dev", "repository": "chainguard/python", "tag": "latest",
+            "scan_start": datetime(2024, 1, 1), "cves": cves}
+
+
+def test__sbom_packages():
+    assert index.sbom_packages(SBOM) == [
+        {"name": "openssl", "version": "3.1.4-r0", "type_": "apk"},
+        {"name": "requests", "version": "2.31.0", "type_": "pypi"},
+    ]
+    assert index.sbom_packages({}) == []
+
+
+def test__read_sbom__missing(tmp_path):
+    assert index.read_sbom(str(tmp_path / "sbom.json")) == []
+
+
+def test__package_index_ops():
+    cve = {"id": "CVE_001", "component": {"name": "openssl", "version": "3.1.4-r0", "type_": "apk"}}
+    other = {"id": "CVE_002", "component": {"name": "zlib", "version": "1.3", "type_": "apk"}}
+    ops = index.package_index_ops(_document([cve, other]), index.sbom_packages(SBOM))
+    names = [op._filter["name"] for op in ops]
+    # SBOM packages that never matched are indexed, matched ones only once
+    assert names == ["openssl", "requests", "zlib"]
+    assert ops[0]._filter["repository"] == "chainguard/python"
+
+    assert len(index.package_index_ops(_document([cve]))) == 1
+
+
+@pytest.mark.parametrize("namespace,types", [
+    ("github:language:python", ["python"]),
+    ("wolfi:distro:wolfi:rolling", ["apk"]),
+    ("debian:distro:debian:12", ["deb"]),
+    ("nvd:cpe", None),
+    ("github:language:cobol", None),
+])
+def test__namespace_types(namespace, types):
+    assert index.namespace_types(namespace) == types
+
+
+@pytest.mark.parametrize("version,constraint,expected", [
+    ("1.2.3", "< 1.2.4", True),
+    ("1.2.4", "< 1.2.4", False),
+    ("1.10.0", "< 1.9", False),
+    ("3.1.4-r0", "< 3.1.4-r1", True),
+    ("3.1.4-r1", "< 3.1.4-r1", False),
+    ("1:1.0", "< 2.0", False),
+    ("1.5", ">= 1.0, < 2.0", True),
+    ("2.5", ">= 1.0, < 2.0 || >= 3.0", False),
+    ("3.5", ">= 1.0, < 2.0 || >= 3.0", True),
+    ("1.0", "", True),
+    ("1.0", "~> 1.0", True),
+    (None, "< 1.0", True),
+])
+def test__version_matches(version, constraint, expected):
+    assert index.version_matches(version, constraint) == expected
+
+
+def test__affected_packages():
+    advisories = {("openssl", "wolfi:distro:wolfi:rolling", "< 3.1.4-r1"),
+                  ("requests", "github:language:python", "< 2.31.0")}
+    indexed = [
+        {"name": "openssl", "version": "3.1.4-r0", "type_": "apk"},
+        {"name": "openssl", "version": "3.1.4-r1", "type_": "apk"},
+        # Same name, other ecosystem
+        {"name": "openssl", "version": "0.1", "type_": "npm"},
+        {"name": "requests", "version": "2.30.0", "type_": "python"},
+        {"name": "requests", "version": "2.31.0", "type_": "python"},
+    ]
+    assert index.affected_packages(advisories, indexed) == [
+        {"name": "openssl", "version": "3.1.4-r0", "type_": "apk"},
+        {"name": "requests", "version": "2.30.0", "type_": "python"},
+    ]
+
+
+def _grype_db(cache_dir, rows, schema_version=5):
+    """
+    Writes a grype DB with the `id` and `vulnerability` tables of the v5 schema.
+    """
+    path = cache_dir / str(schema_version) / "vulnerability.db"
+    path.parent.mkdir(parents=True)
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE id (build_timestamp TEXT, schema_version INTEGER)")
+        conn.execute("INSERT INTO id VALUES ('2024-01-01', ?)", (schema_version,))
+        conn.execute("CREATE TABLE vulnerability (id TEXT, package_name TEXT, namespace TEXT, "
+                     "version_constraint TEXT, fix_state TEXT)")
+        conn.executemany("INSERT INTO vulnerability VALUES (?, ?, ?, ?, ?)", rows)
+    conn.close()
+    return str(cache_dir)
+
+
+NAMESPACE = "wolfi:distro:wolfi:rolling"
+
+
+def test__changed_advisories(tmp_path):
+    old = _grype_db(tmp_path / "old", [
+        ("CVE-1", "openssl", NAMESPACE, "< 3.1.4-r1", "fixed"),
+        ("CVE-2", "curl", NAMESPACE, "< 8.0", "fixed"),
+        ("CVE-3", "zlib", NAMESPACE, "", "not-fixed"),
+    ])
+    new = _grype_db(tmp_path / "new", [
+        ("CVE-1", "openssl", NAMESPACE, "< 3.1.4-r1", "fixed"),
+        # Removed CVE-2, fixed CVE-3 and added CVE-4
+        ("CVE-3", "zlib", NAMESPACE, "< 1.3-r1", "fixed"),
+        ("CVE-4", "requests", "github:language:python", "< 2.31.0", "fixed"),
+    ])
+    assert index.changed_advisories(old, new) == {
+        ("curl", NAMESPACE, "< 8.0"),
+        ("zlib", NAMESPACE, ""),
+        ("zlib", NAMESPACE, "< 1.3-r1"),
+        ("requests", "github:language:python", "< 2.31.0"),
+    }
+
+
+def test__changed_advisories__unsupported_schema(tmp_path):
+    old = _grype_db(tmp_path / "old", [])
+    with pytest.raises(index.UnsupportedSchema):
+        index.changed_advisories(old, _grype_db(tmp_path / "new", [], schema_version=6))
+    with pytest.raises(index.UnsupportedSchema):
+        index.changed_advisories(old, str(tmp_path / "missing"))
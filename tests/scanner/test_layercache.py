@@ -0,0 +1,94 @@
+# Standard lib
+import os
+import json
+import hashlib
+
+# 3rd party
+import pytest
+
+# Local
+import src.scanner.layercache as layercache
+
+
+def blob(content: bytes) -> str:
+    return "sha256:" + hashlib.sha256(content).hexdigest()
+
+
+class FakeLayerCache(layercache.LayerCache):
+    """
+    Serves manifests and blobs from memory instead of crane.
+    """
+    def __init__(self, root: str, max_bytes: int, blobs: dict):
+        super().__init__(root, max_bytes)
+        self.blobs = {blob(content): content for content in blobs}
+        self.downloads = []
+
+    def image(self, contents: list):
+        manifest = {"schemaVersion": 2,
+                    "config": {"digest": blob(contents[0])},
+                    "layers": [{"digest": blob(c)} for c in contents[1:]]}
+        self.manifest = json.dumps(manifest).encode()
+
+    def _fetch_manifest(self, ref: str) -> bytes:
+        return self.manifest
+
+    def _download(self, repo: str, digest: str, path: str):
+        self.downloads.append(digest)
+        with open(path, "wb") as f:
+            f.write(self.blobs[digest])
+
+
+CONFIG, BASE, APP = b"c" * 10, b"b" * 100, b"a" * 100
+
+
+@pytest.fixture
+def cache(tmp_path) -> FakeLayerCache:
+    return FakeLayerCache(str(tmp_path), max_bytes=1000, blobs=[CONFIG, BASE, APP])
+
+
+def test__prepare__hits(cache):
+    cache.image([CONFIG, BASE, APP])
+    cache.release(cache.prepare("cgr.dev", "chainguard/python", "latest"))
+    layout = cache.prepare("cgr.dev", "chainguard/python", "latest")
+
+    assert cache.metrics() == {"hits": 3, "misses": 3}
+    with open(os.path.join(layout, "blobs", "sha256", blob(BASE).split(":")[1]), "rb") as f:
+        assert f.read() == BASE
+
+
+def test__fetch_blob__refetches_evicted(cache):
+    cache.image([CONFIG, BASE, APP])
+    cache.release(cache.prepare("cgr.dev", "chainguard/python", "latest"))
+    os.remove(cache._blob_path(blob(BASE)))
+
+    cache.prepare("cgr.dev", "chainguard/python", "latest")
+    assert cache.downloads.count(blob(BASE)) == 2
+
+
+def test__evict__skips_pinned(cache):
+    cache.image([CONFIG, BASE, APP])
+    layout = cache.prepare("cgr.dev", "chainguard/python", "latest")
+
+    cache.max_bytes = 0
+    cache.evict()
+    # Every blob is linked into the layout, so none is removed
+    assert all(os.path.exists(cache._blob_path(d)) for d in cache.blobs)
+
+    cache.release(layout)
+    cache.evict()
+    assert not any(os.path.exists(cache._blob_path(d)) for d in cache.blobs)
+
+
+def test__evict__counts_layout_bytes(cache):
+    cache.image([CONFIG, APP])
+    cache.prepare("cgr.dev", "chainguard/python", "latest")
+    # APP was evicted while the layout uses it, so it still takes space
+    os.remove(cache._blob_path(blob(APP)))
+    with open(cache._blob_path(blob(BASE)), "wb") as f:
+        f.write(BASE)
+
+    # The blobs alone fit, APP held by the layout does not
+    cache.max_bytes = len(CONFIG) + len(BASE) + len(APP) // 2
+    cache.evict()
+    assert not os.path.exists(cache._blob_path(blob(BASE)))
+    assert os.path.exists(cache._blob_path(blob(CONFIG)))
@@ -0,0 +1,173 @@
+# Standard lib
+from typing import Dict, List
+import sys
+import json
+from pathlib import Path
+
+# 3rd party
+import pytest
+from pymongo.errors import BulkWriteError
+
+# The parser imports its siblings as top-level modules, as in the scanner image
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src" / "scanner"))
+
+# Local
+import parser
+from app import PENDING_WRITES_FIELD
+from blob import LocalBlobStore
+
+
+class FakeScans:
+    """
+    The scans collection, with the unique index on `idempotency_key`.
+    """
+    def __init__(self):
+        self.docs: List[Dict] = []
+        self.insert_calls = 0
+
+    def insert_many(self, documents: List[Dict], ordered: bool=True):
+        self.insert_calls += 1
+        errors = []
+        for i, doc in enumerate(documents):
+            if any(d["idempotency_key"] == doc["idempotency_key"] for d in self.docs):
+                errors.append({"index": i, "code": parser.DUPLICATE_KEY_ERROR})
+            else:
+                self.docs.append(dict(doc, _id=len(self.docs)))
+        if len(errors) > 0:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def find_one(self, query: Dict, projection: Dict=None) -> Dict:
+        return next((d for d in self.docs
+                     if all(d.get(k) == v for k, v in query.items())), None)
+
+
+class FakeClient(dict):
+    def __init__(self):
+        super().__init__({parser.MONGO_DB_NAME: {parser.MONGO_COLLECTION_NAME: FakeScans()}})
+
+    @property
+    def scans(self) -> FakeScans:
+        return self[parser.MONGO_DB_NAME][parser.MONGO_COLLECTION_NAME]
+
+
+def meta(key: str) -> Dict:
+    return {"scan_start": "2024-01-01T00:00:00+00:00",
+            "scan_duration_secs": 1.0,
+            "args": {"registry": "cgr.dev", "repository": "chainguard/python", "tag": "latest",
+                     "labels": [], "idempotency_key": key},
+            "packages": [{"name": "python", "version": "3.12", "type_": "binary"}]}
+
+
+@pytest.fixture
+def side_effects(monkeypatch) -> Dict[str, List]:
+    calls = {"write": [], "resume": []}
+    # The report itself is not under test, only what happens to its document
+    monkeypatch.setattr(parser, "build_document",
+                        lambda scan, scan_start, scan_duration, args: {**scan, **vars(args)})
+    monkeypatch.setattr(parser, "ensure_indexes", lambda client: None)
+    monkeypatch.setattr(parser, "write_side_effects",
+                        lambda document, client, packages: calls["write"].append(
+                            (document["idempotency_key"], packages)))
+    monkeypatch.setattr(parser, "resume_side_effects",
+                        lambda key, client: calls["resume"].append(key))
+    return calls
+
+
+@pytest.fixture
+def store(tmp_path) -> LocalBlobStore:
+    return LocalBlobStore(str(tmp_path / "blobs"))
+
+
+def _put(store: LocalBlobStore, keys: List[str]) -> List[str]:
+    return [store.put_scan(json.dumps({"matches": []}), meta(key)) for key in keys]
+
+
+def test__parse_blobs__batches(monkeypatch, store, side_effects):
+    monkeypatch.setattr(parser, "PARSE_BATCH_SIZE", 2)
+    client = FakeClient()
+    blobs = _put(store, ["a", "b", "c"])
+
+    assert parser.parse_blobs(blobs, store, client) == 3
+    assert client.scans.insert_calls == 2
+    assert [d["idempotency_key"] for d in client.scans.docs] == ["a", "b", "c"]
+    # Side writes are pending until write_side_effects clears the mark
+    assert all(d[PENDING_WRITES_FIELD]["packages"] == meta("a")["packages"]
+               for d in client.scans.docs)
+    assert [key for key, _ in side_effects["write"]] == ["a", "b", "c"]
+    assert store.pending() == []
+
+
+def test__parse_blobs__duplicates(store, side_effects):
+    client = FakeClient()
+    parser.parse_blobs(_put(store, ["a"]), store, client)
+
+    # A second scan of the same job resumes the first one's side writes instead
+    assert parser.parse_blobs(_put(store, ["a", "b"]), store, client) == 1
+    assert side_effects["resume"] == ["a"]
+    assert [key for key, _ in side_effects["write"]] == ["a", "b"]
+    assert store.pending() == []
+
+
+def test__parse_blobs__keeps_blobs_on_error(store, side_effects):
+    client = FakeClient()
+    blobs = _put(store, ["a"])
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("insert failed")
+    client.scans.insert_many = fail
+
+    with pytest.raises(RuntimeError):
+        parser.parse_blobs(blobs, store, client)
+    # Only stored blobs are deleted, so the retry still has this one
+    assert store.pending() == blobs
+
+
+def test__parse_blobs__missing(store, side_effects):
+    client = FakeClient()
+    blobs = _put(store, ["a"])
+
+    with pytest.raises(parser.MissingBlobs) as e:
+        parser.parse_blobs(["gone"] + blobs, store, client)
+    assert e.value.keys == ["gone"]
+    # The other blobs are still parsed
+    assert [d["idempotency_key"] for d in client.scans.docs] == ["a"]
+
+
+@pytest.fixture
+def parser_app(monkeypatch, store, side_effects):
+    client = FakeClient()
+    monkeypatch.setattr(parser, "MONGO_URI", "mongodb://fake")
+    monkeypatch.setattr(parser, "MongoClient", lambda uri: client)
+    monkeypatch.setattr(parser, "BLOB_DIR", store.root)
+    return parser.app.test_client(), client
+
+
+def test__main__redelivered(parser_app, store):
+    test_client, client = parser_app
+    blob, = _put(store, ["a"])
+    assert test_client.post("/", json={"blob": blob, "idempotency_key": "a"}).status_code == 200
+
+    # The first delivery stored the scan and deleted its blob
+    response = test_client.post("/", json={"blob": blob, "idempotency_key": "a"})
+    assert response.status_code == 200
+    assert response.json["inserted"] == 0
+
+
+def test__main__lost_blob(parser_app):
+    test_client, _ = parser_app
+    # Failing makes Cloud Tasks retry and report the scan instead of dropping it
+    response = test_client.post("/", json={"blob": "gone", "idempotency_key": "a"})
+    assert response.status_code == 400
+    assert "gone" in response.json["error"]
+
+
+def test__ready(monkeypatch, tmp_path):
+    test_client = parser.app.test_client()
+    monkeypatch.setattr(parser, "MONGO_URI", "mongodb://fake")
+
+    # The bucket is not mounted
+    monkeypatch.setattr(parser, "BLOB_DIR", str(tmp_path / "missing"))
+    assert test_client.get("/ready").status_code == 503
+
+    monkeypatch.setattr(parser, "BLOB_DIR", str(tmp_path))
+    assert test_client.get("/ready").status_code == 200
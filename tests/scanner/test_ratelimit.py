@@ -0,0 +1,76 @@
+# 3rd party
+import pytest
+
+# Local
+import src.scanner.ratelimit as ratelimit
+from tests.mongo import scan_db
+
+
+@pytest.fixture
+def buckets(scan_db):
+    return scan_db["rate_limits"]
+
+
+def rewind(buckets, registry: str, secs: float):
+    """
+    Moves a bucket's last update back by `secs`, as if that time had passed.
+    """
+    buckets.update_one({"_id": registry},
+                       [{"$set": {"updated_at": {"$subtract": ["$updated_at", int(secs * 1000)]}}}])
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("docker.io=1.5:10,cgr.dev=10:50", {"docker.io": (1.5, 10.0), "cgr.dev": (10.0, 50.0)}),
+    (" docker.io=1:2 , ", {"docker.io": (1.0, 2.0)}),
+    ("", {}),
+])
+def test__parse_limits(value, expected):
+    assert ratelimit.parse_limits(value) == expected
+
+
+def test__parse_limits__invalid():
+    with pytest.raises(ValueError):
+        ratelimit.parse_limits("docker.io=1.5")
+
+
+def test__try_acquire__burst(buckets):
+    limiter = ratelimit.RegistryRateLimiter(buckets, {"docker.io": (2, 3)})
+    # A new bucket starts full
+    assert [limiter.try_acquire("docker.io") for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_acquire("docker.io") == pytest.approx(0.5, abs=0.02)
+    assert buckets.find_one({"_id": "docker.io"})["tokens"] == pytest.approx(0, abs=0.02)
+
+
+def test__try_acquire__refill(buckets):
+    limiter = ratelimit.RegistryRateLimiter(buckets, {"docker.io": (2, 3)})
+    for _ in range(3):
+        limiter.try_acquire("docker.io")
+
+    rewind(buckets, "docker.io", 0.75)
+    assert limiter.try_acquire("docker.io") == 0
+    assert buckets.find_one({"_id": "docker.io"})["tokens"] == pytest.approx(0.5, abs=0.02)
+    assert limiter.try_acquire("docker.io") == pytest.approx(0.25, abs=0.02)
+
+    # Refills never exceed the burst
+    rewind(buckets, "docker.io", 3600)
+    limiter.try_acquire("docker.io")
+    assert buckets.find_one({"_id": "docker.io"})["tokens"] == pytest.approx(2)
+
+
+def test__try_acquire__default_limit(buckets):
+    limiter = ratelimit.RegistryRateLimiter(buckets, {})
+    rate, burst = ratelimit.DEFAULT_RATE_LIMIT
+    for _ in range(int(burst)):
+        assert limiter.try_acquire("quay.io") == 0
+    # The bucket refilled a little while it was drained
+    assert 0 < limiter.try_acquire("quay.io") <= 1 / rate
+
+
+def test__acquire__throttled(buckets):
+    limiter = ratelimit.RegistryRateLimiter(buckets, {"docker.io": (0.01, 1)}, max_wait=1)
+    assert limiter.acquire("docker.io") < 1
+    with pytest.raises(ratelimit.Throttled) as e:
+        limiter.acquire("docker.io")
+    assert e.value.retry_after == pytest.approx(100, rel=0.01)
+    assert limiter.metrics()["docker.io"]["acquired"] == 1
+    assert limiter.metrics()["docker.io"]["throttled"] == 1
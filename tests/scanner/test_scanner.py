@@ -19,8 +19,6 @@ def test__scanner():
     
     client = MongoClient("localhost", 27017)
     document = client["gallery"]["cves"].find_one()
-    import pdb
-    pdb.set_trace()
     assert document is not None
     assert "cves" in document.keys()
     assert "scan_duration_secs" in document.keys()
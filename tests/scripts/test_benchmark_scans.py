@@ -0,0 +1,63 @@
+# Standard lib
+from typing import Dict
+
+# 3rd party
+import pytest
+
+# Local
+import scripts.benchmark_scans as benchmark_scans
+
+
+def level(concurrency: int, scans_per_sec: float, p95_wall: float=10, peak_rss: float=100) -> Dict:
+    per_scan = {m: {"p50": 1.0, "p95": 1.0, "max": 1.0} for m in benchmark_scans.METRICS}
+    per_scan["wall_secs"]["p95"] = p95_wall
+    per_scan["peak_rss_mb"]["max"] = peak_rss
+    return {"concurrency": concurrency, "scans_per_sec": scans_per_sec, "per_scan": per_scan}
+
+
+def report(*levels: Dict) -> Dict:
+    return {"levels": list(levels)}
+
+
+@pytest.mark.parametrize("data,expected", [
+    ([], {"p50": 0, "p95": 0, "max": 0}),
+    ([3.0], {"p50": 3.0, "p95": 3.0, "max": 3.0}),
+    ([float(i) for i in range(1, 102)], {"p50": 51.0, "p95": 96.0, "max": 101.0}),
+])
+def test__percentiles(data, expected):
+    assert benchmark_scans.percentiles(data) == pytest.approx(expected)
+
+
+def test__recommend():
+    levels = [level(8, 4.0, peak_rss=200), level(1, 1.0), level(2, 3.9, peak_rss=150), level(4, 4.1)]
+    # 2 is the lowest level within 95% of the best throughput
+    assert benchmark_scans.recommend(levels) == {"concurrency": 2, "scans_per_sec": 3.9,
+                                                 "memory_mb": 300, "cpu_per_scan_secs": 1.0}
+
+
+def test__compare__no_regression():
+    # Improvements and changes within the tolerance are not regressions
+    baseline = report(level(1, 1.0, p95_wall=10, peak_rss=100))
+    assert benchmark_scans.compare(report(level(1, 2.0, p95_wall=5, peak_rss=50)), baseline, 0.1) == []
+    assert benchmark_scans.compare(report(level(1, 0.95, p95_wall=10.5, peak_rss=105)), baseline, 0.1) == []
+
+
+def test__compare__regressions():
+    baseline = report(level(1, 1.0, p95_wall=10, peak_rss=100))
+    regressions = benchmark_scans.compare(report(level(1, 0.8, p95_wall=12, peak_rss=150)), baseline, 0.1)
+    assert regressions == ["concurrency 1: scans/s 1.00 -> 0.80 (-20.0%)",
+                           "concurrency 1: p95 wall secs 10.00 -> 12.00 (+20.0%)",
+                           "concurrency 1: max peak RSS MB 100.00 -> 150.00 (+50.0%)"]
+
+
+def test__compare__zero_baseline():
+    # Metrics the baseline could not measure are skipped instead of dividing by zero
+    baseline = report(level(1, 0.0, p95_wall=0, peak_rss=0))
+    assert benchmark_scans.compare(report(level(1, 0.5, p95_wall=12, peak_rss=150)), baseline, 0.1) == []
+
+
+def test__compare__missing_levels():
+    # Only levels both reports ran are compared
+    baseline = report(level(1, 1.0), level(2, 2.0))
+    assert benchmark_scans.compare(report(level(2, 1.0), level(4, 0.1)), baseline, 0.1) == \
+        ["concurrency 2: scans/s 2.00 -> 1.00 (-50.0%)"]
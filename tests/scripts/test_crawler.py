@@ -0,0 +1,96 @@
+# Standard lib
+from typing import Dict, List
+import asyncio
+
+# 3rd party
+import pytest
+from aiohttp import web
+
+# Local
+import scripts.crawler as crawler
+
+
+TAGS = [f"1.{i}" for i in range(5)]
+
+
+def _registry(counts: Dict[str, int], throttle: int=0) -> web.Application:
+    """
+    A registry stand-in that requires a token, pages tags two at a time,
+    answers the first `throttle` requests with 429, and supports ETags.
+    """
+    async def token(request):
+        counts["token"] += 1
+        assert request.query["scope"] == "repository:library/python:pull"
+        return web.json_response({"token": "t0k3n"})
+
+    async def tags(request):
+        counts["tags"] += 1
+        if counts["tags"] <= throttle:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        if request.headers.get("Authorization") != "Bearer t0k3n":
+            challenge = (f'Bearer realm="http://{request.host}/token",'
+                         'service="registry.local",scope="repository:library/python:pull"')
+            return web.Response(status=401, headers={"WWW-Authenticate": challenge})
+
+        start = TAGS.index(request.query["last"]) + 1 if "last" in request.query else 0
+        page = TAGS[start:start + 2]
+        etag = f'"{start}"'
+        if request.headers.get("If-None-Match") == etag:
+            counts["not_modified"] += 1
+            return web.Response(status=304)
+
+        headers = {"ETag": etag}
+        if start + 2 < len(TAGS):
+            headers["Link"] = f'</v2/library/python/tags/list?n=2&last={page[-1]}>; rel="next"'
+        return web.json_response({"name": "library/python", "tags": page}, headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/token", token)
+    app.router.add_get("/v2/library/python/tags/list", tags)
+    return app
+
+
+async def _list_tags(app: web.Application, cache_dir: str, n_runs: int=1) -> List[List[str]]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        results = []
+        for _ in range(n_runs):
+            async with crawler.RegistryCrawler(cache_dir=cache_dir, page_size=2) as c:
+                results.append(await c.list_tags(f"http://127.0.0.1:{port}", "library/python"))
+        return results
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture
+def counts() -> Dict[str, int]:
+    return {"token": 0, "tags": 0, "not_modified": 0}
+
+
+def test__list_tags__paginates_with_token(counts, tmp_path):
+    tags, = asyncio.run(_list_tags(_registry(counts), str(tmp_path)))
+    assert tags == TAGS
+    assert counts["token"] == 1
+
+
+def test__list_tags__retries_throttled(counts, tmp_path):
+    tags, = asyncio.run(_list_tags(_registry(counts, throttle=2), str(tmp_path)))
+    assert tags == TAGS
+
+
+def test__list_tags__revalidates_cache(counts, tmp_path):
+    first, second = asyncio.run(_list_tags(_registry(counts), str(tmp_path), n_runs=2))
+    assert first == second == TAGS
+    # Every page of the second run is answered with 304
+    assert counts["not_modified"] == 3
+
+
+def test__next_link():
+    link = '</v2/x/tags/list?n=2&last=b>; rel="next"'
+    assert crawler.next_link(link, "https://r.io/v2/x/tags/list?n=2") == \
+        "https://r.io/v2/x/tags/list?n=2&last=b"
+    assert crawler.next_link(None, "https://r.io") is None
@@ -0,0 +1,83 @@
+# Standard lib
+from typing import Dict
+import os
+
+# 3rd party
+import pytest
+
+# The client is only created by `main`
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+# Local
+import scripts.push_images as push_images
+
+
+def row(repository: str, publisher: str="chainguard", labels=("base",)) -> Dict:
+    return {"publisher": publisher, "registry": "cgr.dev", "repository": repository,
+            "tag": "latest", "labels": list(labels)}
+
+
+def existing(*rows: Dict) -> Dict:
+    return {push_images.image_key(r): {**r, "_id": i} for i, r in enumerate(rows)}
+
+
+def test__plan_sync__insert_update_unchanged():
+    ops, report = push_images.plan_sync(
+        [row("python"), row("go", labels=["lang"]), row("node")],
+        existing(row("go"), row("node")), prune=True)
+
+    assert report.inserted == [("cgr.dev", "python", "latest")]
+    assert report.updated == [("cgr.dev", "go", "latest")]
+    assert report.unchanged == 1
+    assert report.deleted == []
+    assert len(ops) == 2
+    assert all(op._upsert for op in ops)
+
+
+def test__plan_sync__publisher_changed():
+    _, report = push_images.plan_sync([row("python", publisher="bitnami")],
+                                      existing(row("python")), prune=True)
+    assert report.updated == [("cgr.dev", "python", "latest")]
+
+
+def test__plan_sync__duplicate_rows():
+    ops, report = push_images.plan_sync([row("python"), row("python", labels=["lang"])],
+                                        {}, prune=True)
+    assert report.duplicate_rows == 1
+    assert report.inserted == [("cgr.dev", "python", "latest")]
+    # The later row wins
+    assert ops[0]._doc["$set"]["labels"] == ["lang"]
+
+
+def test__plan_sync__deletes_missing():
+    images = existing(row("python"), row("go"))
+    ops, report = push_images.plan_sync([row("python")], images, prune=True)
+
+    assert report.deleted == [("cgr.dev", "go", "latest")]
+    assert [op._filter for op in ops] == [{"_id": 1}]
+
+
+def test__plan_sync__deletes_only_listed_publishers():
+    # A per-publisher CSV leaves the images of other publishers alone
+    images = existing(row("python"), row("redis", publisher="bitnami"))
+    _, report = push_images.plan_sync([row("python")], images, prune=True)
+    assert report.deleted == []
+
+
+def test__plan_sync__empty_csv_deletes_nothing():
+    _, report = push_images.plan_sync([], existing(row("python")), prune=True)
+    assert report.deleted == []
+
+
+def test__plan_sync__keep_missing():
+    ops, report = push_images.plan_sync([row("python")], existing(row("python"), row("go")),
+                                        prune=False)
+    assert ops == []
+    assert report.deleted == []
+    assert report.unchanged == 1
+
+
+@pytest.mark.parametrize("prune", [True, False])
+def test__plan_sync__report(prune):
+    _, report = push_images.plan_sync([row("python")], existing(row("go")), prune=prune)
+    assert str(report).startswith(f"Inserted 1, updated 0, deleted {int(prune)}")
@@ -0,0 +1,43 @@
+# Standard lib
+from typing import Dict
+from collections import defaultdict
+
+# Local
+import scripts.trace_report as trace_report
+
+
+def span(span_id: str, name: str, start: float, end: float, parent_id: str=None) -> Dict:
+    return {"trace_id": "t", "span_id": span_id, "parent_id": parent_id, "name": name,
+            "service": "publisher", "start": start, "end": end, "status": "UNSET", "attributes": {}}
+
+
+# Two batches enqueued concurrently. The scan of the second outlives the publish span.
+SPANS = [
+    span("root", "publish", 0, 10),
+    span("a", "enqueue_a", 1, 4, parent_id="root"),
+    span("b", "enqueue_b", 3, 6, parent_id="root"),
+    span("scan", "scan", 7, 12, parent_id="b"),
+]
+
+
+def test__critical_path():
+    by_id = {s["span_id"]: s for s in SPANS}
+    children = defaultdict(list)
+    for s in SPANS[1:]:
+        children[s["parent_id"]].append(s)
+    finish = trace_report._finish_times(by_id, children)
+    assert finish == {"root": 12, "a": 4, "b": 12, "scan": 12}
+
+    segments = trace_report.critical_path(by_id["root"], children, finish)
+    # enqueue_a overlaps enqueue_b, which finished later, so it is not on the path
+    assert segments == [("scan", 5), ("enqueue_b", 3), (trace_report.WAIT, 1), ("publish", 3)]
+    assert sum(secs for _, secs in segments) == finish["root"] - by_id["root"]["start"]
+
+
+def test__summarize():
+    summary, = trace_report.summarize(SPANS)
+    assert summary["root"] == "publish"
+    assert summary["wall_secs"] == 12
+    assert summary["scans"] == 1
+    assert summary["critical_path_secs"] == {"scan": 5, "enqueue_b": 3, "publish": 3,
+                                             trace_report.WAIT: 1}